@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 历史回测
+用日K线回放2%规则：突破买入（按止损距离算集中仓位）、离止损价10%以内提示注意、
+跌穿止损价清仓、仓位超过建议仓位时降低到建议仓位，输出资金曲线和交易记录
+
+每只股票分到相同的初始资金（独立账户），按交易日循环、所有股票一起向量化计算；
+股票多时按块分给进程池，各块资金曲线相加就是组合资金曲线。
+CSV先转换成按 (交易日 × 股票) 排列的 .npy 文件，回测时内存映射读取，不把行情加载成Python对象
+"""
+
+import sys
+import os
+import csv
+import json
+import time
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+import stock_db
+
+# CSV表头（不区分大小写，中英文都可以）
+COLUMN_NAMES = {
+    "date": ["date", "日期", "trade_date"],
+    "open": ["open", "开盘", "开盘价"],
+    "high": ["high", "最高", "最高价"],
+    "low": ["low", "最低", "最低价"],
+    "close": ["close", "收盘", "收盘价"],
+}
+FIELDS = ["open", "high", "low", "close"]
+
+CACHE_DIR_NAME = ".npy_cache"
+
+# 每个进程一次处理的股票数
+BLOCK_SYMBOLS = 500
+
+DEFAULT_PARAMS = {
+    "capital": stock_db.DEFAULT_TOTAL_CAPITAL,
+    "stop_pct": 8,        # 买入时止损价 = 买入价 × (1 - 8%)
+    "breakout": 20,       # 收盘价突破前20天最高收盘价时买入
+    "target_risk": 2,     # 每笔交易风险（%），集中仓位 = 目标风险 / 止损距离
+    "fee": 0.0003,        # 单边手续费率
+}
+
+ACTION_BUY = 0
+ACTION_WARN = 1
+ACTION_STOP = 2
+ACTION_REDUCE = 3
+ACTION_LABELS = ["买入", "⚠️ 注意", "🆘 止损清仓", "⚠️ 降低仓位"]
+
+def require_numpy():
+    """未安装NumPy时给出提示并退出"""
+    if not NUMPY_AVAILABLE:
+        print("❌ 需要安装 NumPy：pip install numpy")
+        sys.exit(1)
+
+def _find_columns(header):
+    """表头 → {字段: 列号}"""
+    lookup = {name.strip().lower(): i for i, name in enumerate(header)}
+    columns = {}
+    for field, names in COLUMN_NAMES.items():
+        for name in names:
+            if name in lookup:
+                columns[field] = lookup[name]
+                break
+        else:
+            raise ValueError(f"缺少 {field} 列（表头: {','.join(header)}）")
+    return columns
+
+def _csv_files(csv_dir):
+    return sorted((entry for entry in os.scandir(csv_dir) if entry.is_file() and entry.name.endswith(".csv")),
+                  key=lambda entry: entry.name)
+
+def _file_list(files):
+    """{文件名: [大小, 修改时间(纳秒)]}：转换时记到 meta.json，判断缓存是否过期"""
+    return {entry.name: [entry.stat().st_size, entry.stat().st_mtime_ns] for entry in files}
+
+def cache_is_fresh(csv_dir, cache_dir):
+    """缓存存在，且目录下的CSV（文件名、大小、修改时间）和转换时完全相同
+
+    不比较缓存和CSV谁更新：cp -p 保留了旧的修改时间、删掉的CSV，都要重新转换
+    """
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), encoding="utf-8") as f:
+            files = json.load(f).get("files")
+    except (OSError, ValueError):
+        return False
+    return files == _file_list(_csv_files(csv_dir))
+
+def convert_csv_dir(csv_dir, cache_dir):
+    """把目录下每只股票一个的日K线CSV（文件名为代码）转换成 (交易日 × 股票) 的 float32 .npy 文件
+
+    第一遍逐个解析CSV、收集所有交易日，单只股票的数组暂存到临时文件；
+    第二遍按交易日对齐写入内存映射数组，缺失的交易日为NaN。返回 (股票数, 跳过的 [(文件名, 原因), ...])；
+    全部CSV都无法解析时抛 ValueError（不写缓存）
+    """
+    files = _csv_files(csv_dir)
+    if not files:
+        raise ValueError(f"{csv_dir} 下没有CSV文件")
+    # 解析之前记下文件列表：转换期间CSV有改动的，下次会重新转换
+    listed = _file_list(files)
+    os.makedirs(cache_dir, exist_ok=True)
+    parts_dir = os.path.join(cache_dir, "parts")
+    os.makedirs(parts_dir, exist_ok=True)
+
+    codes, all_days, skipped = [], set(), []
+    for entry in files:
+        with open(entry.path, "r", encoding="utf-8-sig") as f:
+            header = next(csv.reader(f), None)
+        try:
+            if header is None:
+                raise ValueError("空文件")
+            columns = _find_columns(header)
+            days = np.loadtxt(entry.path, delimiter=",", skiprows=1, usecols=(columns["date"],),
+                              dtype="datetime64[D]", ndmin=1, encoding="utf-8-sig").astype(np.int64)
+            values = np.loadtxt(entry.path, delimiter=",", skiprows=1,
+                                usecols=[columns[field] for field in FIELDS],
+                                dtype=np.float32, ndmin=2, encoding="utf-8-sig")
+        except ValueError as e:
+            skipped.append((entry.name, str(e)))
+            continue
+        np.save(os.path.join(parts_dir, f"{len(codes)}.npy"), np.column_stack([days, values]).astype(np.float64))
+        codes.append(entry.name[:-4])
+        all_days.update(days.tolist())
+    if not codes:
+        os.rmdir(parts_dir)
+        reasons = "；".join(f"{name}: {reason}" for name, reason in skipped[:3])
+        raise ValueError(f"{csv_dir} 下没有可用的CSV（{len(skipped)} 个文件都无法解析：{reasons}"
+                         f"{' 等' if len(skipped) > 3 else ''}）")
+
+    dates = np.array(sorted(all_days), dtype=np.int64)
+    shape = (len(dates), len(codes))
+    arrays = {field: np.lib.format.open_memmap(os.path.join(cache_dir, f"{field}.npy"), mode="w+",
+                                               dtype=np.float32, shape=shape) for field in FIELDS}
+    for array in arrays.values():
+        array[:] = np.nan
+    for i in range(len(codes)):
+        part_path = os.path.join(parts_dir, f"{i}.npy")
+        part = np.load(part_path)
+        rows = np.searchsorted(dates, part[:, 0].astype(np.int64))
+        for j, field in enumerate(FIELDS):
+            arrays[field][rows, i] = part[:, j + 1]
+        os.remove(part_path)
+    os.rmdir(parts_dir)
+    for array in arrays.values():
+        array.flush()
+    np.save(os.path.join(cache_dir, "dates.npy"), dates)
+    with open(os.path.join(cache_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"codes": codes, "skipped": skipped, "files": listed}, f, ensure_ascii=False)
+    return len(codes), skipped
+
+def open_cache(cache_dir):
+    """内存映射打开缓存，返回 (交易日数组, 代码列表, {字段: 数组})"""
+    with open(os.path.join(cache_dir, "meta.json"), encoding="utf-8") as f:
+        codes = json.load(f)["codes"]
+    dates = np.load(os.path.join(cache_dir, "dates.npy"))
+    arrays = {field: np.load(os.path.join(cache_dir, f"{field}.npy"), mmap_mode="r") for field in FIELDS}
+    return dates, codes, arrays
+
+def simulate_block(cache_dir, start, stop, params, sleeve_capital):
+    """回测第 start..stop 只股票，返回该块每天的现金、持仓市值、事件记录和计数"""
+    dates, _, arrays = open_cache(cache_dir)
+    k = stop - start
+    fee = params["fee"]
+    stop_ratio = 1 - params["stop_pct"] / 100
+    entry_position = min(params["target_risk"] / params["stop_pct"] * 100, 100)
+    window = params["breakout"]
+
+    cash = np.full(k, sleeve_capital)
+    shares = np.zeros(k)
+    cost = np.zeros(k)          # 持仓成本（含手续费），卖出时按比例扣减
+    stop_price = np.zeros(k)
+    in_pos = np.zeros(k, dtype=bool)
+    warned = np.zeros(k, dtype=bool)
+    last_close = np.zeros(k)
+    recent = np.full((window, k), np.nan)   # 最近 window 天收盘价（环形缓冲）
+    n_valid = np.zeros(k, dtype=np.int64)
+
+    cash_curve = np.zeros(len(dates))
+    value_curve = np.zeros(len(dates))
+    events = []
+
+    def log(t, idx, action, price, qty, pnl, position):
+        events.append((np.full(len(idx), t, dtype=np.int32), idx + start, np.full(len(idx), action, dtype=np.int8),
+                       price, qty, pnl, position))
+
+    for t in range(len(dates)):
+        o = arrays["open"][t, start:stop].astype(np.float64)
+        low = arrays["low"][t, start:stop].astype(np.float64)
+        c = arrays["close"][t, start:stop].astype(np.float64)
+        valid = ~np.isnan(c)
+
+        # 1. 跌穿止损价 → 清仓（跳空低开时按开盘价成交）
+        hit = np.nonzero(in_pos & valid & (low <= stop_price))[0]
+        if len(hit):
+            price = np.fmin(o[hit], stop_price[hit])
+            proceeds = shares[hit] * price * (1 - fee)
+            log(t, hit, ACTION_STOP, price, shares[hit], proceeds - cost[hit], np.zeros(len(hit)))
+            cash[hit] += proceeds
+            shares[hit] = cost[hit] = 0
+            in_pos[hit] = warned[hit] = False
+
+        np.copyto(last_close, c, where=valid)
+        live = in_pos & valid
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = shares * last_close
+            equity = cash + value
+            position = value / equity * 100
+            drop_to_stop = (c - stop_price) / c * 100
+            # 与 get_simple_suggestion 相同：集中建议仓位 = 目标风险 / 止损距离
+            suggested = params["target_risk"] / ((1 - stop_price / c) * 100) * 100
+
+        # 2. 离止损价10%以内 → 注意（只记录进入提示的那一天）
+        warn = live & (drop_to_stop <= 10)
+        new_warn = np.nonzero(warn & ~warned)[0]
+        if len(new_warn):
+            log(t, new_warn, ACTION_WARN, c[new_warn], np.zeros(len(new_warn)), np.zeros(len(new_warn)),
+                position[new_warn])
+        warned = warn | (warned & ~live)
+
+        # 3. 集中仓位（>2%）超过建议仓位 → 降低到建议仓位（离止损价10%以内时建议是"注意"，不调整）
+        reduce = np.nonzero(live & ~warn & (position > 2) & (position > suggested))[0]
+        if len(reduce):
+            sell_value = value[reduce] - equity[reduce] * suggested[reduce] / 100
+            qty = sell_value / c[reduce]
+            fraction = qty / shares[reduce]
+            proceeds = sell_value * (1 - fee)
+            log(t, reduce, ACTION_REDUCE, c[reduce], qty, proceeds - cost[reduce] * fraction, suggested[reduce])
+            cash[reduce] += proceeds
+            shares[reduce] -= qty
+            cost[reduce] *= 1 - fraction
+
+        # 4. 收盘价突破前 window 天最高收盘价 → 按集中仓位买入
+        previous_high = np.fmax.reduce(recent, axis=0)
+        enter = np.nonzero(~in_pos & valid & (n_valid >= window) & (c > previous_high))[0]
+        if len(enter):
+            buy_value = cash[enter] * entry_position / 100 / (1 + fee)
+            qty = buy_value / c[enter]
+            log(t, enter, ACTION_BUY, c[enter], qty, np.zeros(len(enter)), np.full(len(enter), entry_position))
+            cash[enter] -= buy_value * (1 + fee)
+            shares[enter] = qty
+            cost[enter] = buy_value * (1 + fee)
+            stop_price[enter] = c[enter] * stop_ratio
+            in_pos[enter] = True
+
+        recent[t % window] = c
+        n_valid += valid
+        cash_curve[t] = cash.sum()
+        value_curve[t] = (shares * last_close).sum()
+
+    if events:
+        events = [np.concatenate(column) for column in zip(*events)]
+    return cash_curve, value_curve, events
+
+def _block_worker(args):
+    return simulate_block(*args)
+
+def run_backtest(cache_dir, params=None, workers=1):
+    """按块回测全部股票并合并，返回结果字典"""
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    dates, codes, _ = open_cache(cache_dir)
+    if not codes:
+        raise ValueError(f"{cache_dir} 里没有股票（没有可用的CSV），用 --rebuild 重新转换")
+    sleeve_capital = params["capital"] / len(codes)
+    tasks = [(cache_dir, a, min(a + BLOCK_SYMBOLS, len(codes)), params, sleeve_capital)
+             for a in range(0, len(codes), BLOCK_SYMBOLS)]
+    if workers > 1:
+        from multiprocessing import Pool
+        with Pool(workers) as pool:
+            blocks = pool.map(_block_worker, tasks)
+    else:
+        blocks = [simulate_block(*task) for task in tasks]
+
+    cash = sum(block[0] for block in blocks)
+    value = sum(block[1] for block in blocks)
+    parts = [block[2] for block in blocks if len(block[2])]
+    events = [np.concatenate(column) for column in zip(*parts)] if parts else [np.zeros(0)] * 7
+    # 事件按 (交易日, 股票) 排序
+    order = np.lexsort((events[1], events[0]))
+    events = [column[order] for column in events]
+    return {"dates": dates, "codes": codes, "cash": cash, "value": value, "events": events, "params": params}
+
+def summarize(result):
+    """收益、年化、最大回撤和各类事件次数"""
+    equity = result["cash"] + result["value"]
+    capital = result["params"]["capital"]
+    peak = np.maximum.accumulate(equity)
+    drawdown = (peak - equity) / peak * 100
+    years = max((result["dates"][-1] - result["dates"][0]) / 365.25, 1 / 365.25)
+    actions = result["events"][2]
+    pnl = result["events"][5]
+    stops = actions == ACTION_STOP
+    return {
+        "final_equity": float(equity[-1]),
+        "total_return": float(equity[-1] / capital - 1) * 100,
+        "annual_return": float((equity[-1] / capital) ** (1 / years) - 1) * 100,
+        "max_drawdown": float(drawdown.max()),
+        "counts": {label: int((actions == code).sum()) for code, label in enumerate(ACTION_LABELS)},
+        "stop_loss_avg": float(pnl[stops].mean()) if stops.any() else 0.0,
+    }
+
+def write_outputs(result, out_dir):
+    """输出资金曲线（equity.csv）和交易记录（trades.csv），返回两个文件路径"""
+    os.makedirs(out_dir, exist_ok=True)
+    dates = result["dates"].astype("datetime64[D]").astype(str)
+    equity = result["cash"] + result["value"]
+    peak = np.maximum.accumulate(equity)
+    equity_path = os.path.join(out_dir, "equity.csv")
+    with open(equity_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["date", "equity", "cash", "exposure_pct", "drawdown_pct"])
+        for row in zip(dates, equity.round(2), result["cash"].round(2),
+                       (result["value"] / equity * 100).round(2), ((peak - equity) / peak * 100).round(2)):
+            writer.writerow(row)
+
+    trades_path = os.path.join(out_dir, "trades.csv")
+    t, symbol, action, price, qty, pnl, position = result["events"]
+    codes = result["codes"]
+    with open(trades_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["date", "code", "action", "price", "shares", "value", "pnl", "position_pct"])
+        for row in zip(t.tolist(), symbol.tolist(), action.tolist(), price.round(4).tolist(), qty.round(2).tolist(),
+                       (price * qty).round(2).tolist(), pnl.round(2).tolist(), position.round(2).tolist()):
+            writer.writerow([dates[row[0]], codes[row[1]], ACTION_LABELS[row[2]]] + list(row[3:]))
+    return equity_path, trades_path
+
+def backtest(csv_dir, params=None, workers=1, out_dir=".", cache_dir=None, rebuild=False):
+    """命令行入口：必要时先转换CSV，再回测并输出结果"""
+    require_numpy()
+    cache_dir = cache_dir or os.path.join(csv_dir, CACHE_DIR_NAME)
+    if rebuild or not cache_is_fresh(csv_dir, cache_dir):
+        start = time.perf_counter()
+        n, skipped = convert_csv_dir(csv_dir, cache_dir)
+        print(f"📦 转换 {n} 只股票的日K线到 {cache_dir}（{time.perf_counter() - start:.1f}s）")
+        for name, reason in skipped:
+            print(f"   ⚠️ 跳过 {name}: {reason}")
+
+    start = time.perf_counter()
+    result = run_backtest(cache_dir, params, workers)
+    elapsed = time.perf_counter() - start
+    summary = summarize(result)
+    equity_path, trades_path = write_outputs(result, out_dir)
+
+    params = result["params"]
+    dates = result["dates"].astype("datetime64[D]").astype(str)
+    print(f"📊 回测结果（{len(result['codes'])} 只股票，{dates[0]} ~ {dates[-1]}，{len(dates)} 个交易日）")
+    print(f"   规则: 突破{params['breakout']}日高点买入，止损{params['stop_pct']:g}%，目标风险{params['target_risk']:g}%")
+    print(f"   初始资金: {params['capital']:.0f}元 → 期末: {summary['final_equity']:.0f}元")
+    print(f"   总收益: {summary['total_return']:+.1f}%，年化: {summary['annual_return']:+.1f}%，"
+          f"最大回撤: {summary['max_drawdown']:.1f}%")
+    print("   事件: " + "，".join(f"{label} {count}" for label, count in summary["counts"].items()))
+    print(f"   平均每次止损亏损: {summary['stop_loss_avg']:.2f}元")
+    print(f"   耗时: {elapsed:.1f}s")
+    print(f"   资金曲线: {equity_path}")
+    print(f"   交易记录: {trades_path}")
+    return summary
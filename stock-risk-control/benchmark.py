@@ -0,0 +1,1475 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 性能基准测试
+所有测试都在临时数据库上运行，不会影响真实持仓数据
+"""
+
+import sys
+import os
+import math
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import redirect_stderr, redirect_stdout
+from multiprocessing import Pool, Process
+
+import stock_db
+
+SKILL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def use_temp_db(tmpdir, name="bench.db"):
+    """把stock_db指向临时数据库并初始化"""
+    stock_db.DB_PATH = os.path.join(tmpdir, name)
+    stock_db.SCHEMA_PATH = os.path.join(SKILL_DIR, "init_db.sql")
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull), redirect_stderr(devnull):
+        stock_db.init_db()
+    return stock_db.DB_PATH
+
+def seed_stocks(db_path, n, deleted_ratio=0.0, total_capital=stock_db.DEFAULT_TOTAL_CAPITAL):
+    """批量写入n只随机持仓"""
+    rows = []
+    for i in range(n):
+        quantity = random.randint(1, 50) * 100
+        cost_price = round(random.uniform(5, 200), 2)
+        current_price = round(cost_price * random.uniform(0.7, 1.5), 2)
+        stop_loss = round(cost_price * random.uniform(0.6, 0.95), 2)
+        total_value = stock_db.calculate_total_value(quantity, current_price)
+        position = stock_db.calculate_position(total_value, total_capital)
+        pnl, pnl_percent = stock_db.calculate_pnl(current_price, cost_price, position, total_value)
+        mode = stock_db.auto_adjust_mode(position)
+        is_deleted = 1 if random.random() < deleted_ratio else 0
+        rows.append((f"股票{i}", f"{i:06d}", mode, quantity, position, total_value,
+                     cost_price, stop_loss, current_price, None, pnl, pnl_percent, is_deleted))
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany("""
+            INSERT INTO stocks (name, code, mode, quantity, position, total_value,
+                               cost_price, stop_loss, current_price, hold_reason, pnl, pnl_percent, is_deleted)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    conn.close()
+
+def _concurrent_writer(args):
+    """压力测试子进程：反复更新随机股票现价"""
+    db_path, writes, n_stocks, legacy = args
+    failures = 0
+    start = time.perf_counter()
+    if legacy:
+        # 旧连接方式：回滚日志模式，无等锁超时，不重试
+        conn = sqlite3.connect(db_path, timeout=0)
+        for _ in range(writes):
+            try:
+                conn.execute("UPDATE stocks SET current_price = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                             (random.uniform(5, 200), random.randint(1, n_stocks)))
+                conn.commit()
+            except sqlite3.OperationalError:
+                conn.rollback()
+                failures += 1
+        retries = 0
+    else:
+        stock_db.DB_PATH = db_path
+        conn = stock_db.get_conn()
+        for _ in range(writes):
+            price, stock_id = random.uniform(5, 200), random.randint(1, n_stocks)
+            try:
+                stock_db.run_write(conn, lambda cursor: cursor.execute(
+                    "UPDATE stocks SET current_price = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (price, stock_id)))
+            except sqlite3.OperationalError:
+                failures += 1
+        retries = stock_db.WRITE_STATS["retries"]
+    conn.close()
+    return writes - failures, failures, retries, time.perf_counter() - start
+
+def bench_concurrent_writes(processes=8, writes=200, n_stocks=100):
+    """并发写入压力测试：N个进程同时写，对比旧连接方式与WAL+串行写入"""
+    print(f"📊 并发写入压力测试（{processes} 个进程 × {writes} 次写入）")
+    print("=" * 72)
+    print(f"{'连接方式':<16} {'提交':<8} {'锁失败':<8} {'重试':<8} {'耗时':<10} {'提交/秒':<10}")
+    print("-" * 72)
+    for legacy in [True, False]:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = use_temp_db(tmpdir)
+            seed_stocks(db_path, n_stocks)
+            if legacy:
+                conn = sqlite3.connect(db_path)
+                conn.execute("PRAGMA journal_mode = DELETE")
+                conn.close()
+            start = time.perf_counter()
+            with Pool(processes) as pool:
+                results = pool.map(_concurrent_writer, [(db_path, writes, n_stocks, legacy)] * processes)
+            elapsed = time.perf_counter() - start
+        commits = sum(r[0] for r in results)
+        failures = sum(r[1] for r in results)
+        retries = sum(r[2] for r in results)
+        label = "旧(回滚日志)" if legacy else "WAL+串行写入"
+        elapsed_display = f"{elapsed * 1000:.0f}ms"
+        print(f"{label:<16} {commits:<8} {failures:<8} {retries:<8} {elapsed_display:<10} {commits / elapsed:<10.0f}")
+    print("=" * 72)
+
+def _percentiles(samples_ms):
+    """返回 (p50, p95)"""
+    samples_ms = sorted(samples_ms)
+    return statistics.median(samples_ms), samples_ms[int(len(samples_ms) * 0.95) - 1]
+
+def bench_daemon(rounds=50, n_stocks=50):
+    """常驻服务往返延迟：对比每次启动新进程执行 列表"""
+    import stock_daemon
+
+    print(f"📊 常驻服务往返延迟（{n_stocks} 只持仓，{rounds} 次）")
+    print("=" * 64)
+    print(f"{'方式':<24} {'p50':<12} {'p95':<12}")
+    print("-" * 64)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = use_temp_db(tmpdir)
+        seed_stocks(db_path, n_stocks)
+        socket_path = os.path.join(tmpdir, "bench.sock")
+
+        # 冷启动：每次新开解释器
+        code = f"import stock_db; stock_db.DB_PATH = {db_path!r}; stock_db.main(['stock_db.py', '列表'])"
+        cold = []
+        for _ in range(min(rounds, 20)):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=SKILL_DIR, stdout=subprocess.DEVNULL, check=True)
+            cold.append((time.perf_counter() - start) * 1000)
+
+        daemon = Process(target=lambda: stock_daemon.StockDaemon(socket_path).serve_forever())
+        with redirect_stdout(open(os.devnull, "w")):
+            daemon.start()
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+
+        writer = sqlite3.connect(db_path)
+        hits, misses = [], []
+        for i in range(rounds):
+            # 其他进程写入 → 缓存失效
+            writer.execute("UPDATE stocks SET current_price = current_price + 0.01 WHERE id = ?", (i % n_stocks + 1,))
+            writer.commit()
+            start = time.perf_counter()
+            stock_daemon.request({"argv": ["stock_db.py", "列表"]}, socket_path)
+            misses.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            stock_daemon.request({"argv": ["stock_db.py", "列表"]}, socket_path)
+            hits.append((time.perf_counter() - start) * 1000)
+        writer.close()
+
+        status = stock_daemon.request({"cmd": "status"}, socket_path)["output"]
+        stock_daemon.request({"cmd": "shutdown"}, socket_path)
+        daemon.join()
+
+    for label, samples in [("新进程 python3 stock_db.py", cold), ("常驻服务（缓存未命中）", misses), ("常驻服务（缓存命中）", hits)]:
+        p50, p95 = _percentiles(samples)
+        print(f"{label:<24} {f'{p50:.2f}ms':<12} {f'{p95:.2f}ms':<12}")
+    print("=" * 64)
+    for line in status.splitlines():
+        if "请求数" in line or "缓存" in line:
+            print(line.strip())
+    print("注：常驻服务的数字是socket往返时间，不含客户端自身的解释器启动")
+
+def _list_history_child(output_format, queue):
+    """子进程里输出历史列表，回报耗时和最大常驻内存"""
+    import resource
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        stock_db.list_stocks(show_deleted=True, output_format=output_format)
+        elapsed = time.perf_counter() - start
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+def bench_history_memory(sizes=(10000, 100000, 1000000)):
+    """历史列表内存：不同行数下流式输出的进程内存峰值应基本不变"""
+    from multiprocessing import Queue
+
+    print("📊 历史列表内存峰值（流式输出到 /dev/null）")
+    print("=" * 64)
+    print(f"{'行数':<12} {'格式':<8} {'耗时':<12} {'最大常驻内存':<12}")
+    print("-" * 64)
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = use_temp_db(tmpdir)
+            # 在子进程里造数据，避免父进程内存膨胀后被列表子进程继承
+            seeder = Process(target=seed_stocks, args=(db_path, n, 0.5))
+            seeder.start()
+            seeder.join()
+            for output_format in stock_db.LIST_FORMATS:
+                queue = Queue()
+                child = Process(target=_list_history_child, args=(output_format, queue))
+                child.start()
+                elapsed, maxrss_kb = queue.get()
+                child.join()
+                print(f"{n:<12} {output_format:<8} {f'{elapsed:.2f}s':<12} {f'{maxrss_kb / 1024:.1f}MB':<12}")
+    print("=" * 64)
+
+def _time_query(conn, sql, params, repeat=5):
+    """查询取完结果的耗时中位数（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def bench_pagination(sizes=(10000, 100000, 1000000), page_size=50):
+    """列表/历史分页查询延迟：加复合索引前后对比"""
+    print(f"📊 列表/历史查询延迟（每页 {page_size} 行，中位数）")
+    print("=" * 84)
+    print(f"{'行数':<10} {'查询':<22} {'无索引':<14} {'复合索引':<14} {'加速':<10}")
+    print("-" * 84)
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = use_temp_db(tmpdir)
+            seed_stocks(db_path, n, deleted_ratio=0.3)
+            conn = sqlite3.connect(db_path)
+            # 深分页游标：取排序后中间那一行
+            middle = conn.execute("SELECT position, id FROM stocks WHERE is_deleted = 0 ORDER BY position DESC, id LIMIT 1 OFFSET ?",
+                                  (n // 3,)).fetchone()
+            queries = [
+                ("列表 第一页", stock_db.build_list_query(False, page_size)),
+                ("列表 深分页", stock_db.build_list_query(False, page_size, middle)),
+                ("历史 第一页", stock_db.build_list_query(True, page_size)),
+                ("历史 深分页", stock_db.build_list_query(True, page_size, middle)),
+            ]
+            results = {}
+            for indexed in [False, True]:
+                if indexed:
+                    with open(os.path.join(SKILL_DIR, "init_db.sql")) as f:
+                        conn.executescript(f.read())
+                else:
+                    conn.execute("DROP INDEX IF EXISTS idx_stocks_live_position")
+                    conn.execute("DROP INDEX IF EXISTS idx_stocks_position")
+                conn.execute("ANALYZE")
+                for label, (sql, params) in queries:
+                    results.setdefault(label, []).append(_time_query(conn, sql, params))
+            conn.close()
+        for label, (before, after) in results.items():
+            print(f"{n:<10} {label:<22} {f'{before:.2f}ms':<14} {f'{after:.3f}ms':<14} {f'{before / after:.0f}x':<10}")
+    print("=" * 84)
+
+def _hot_table_kb(conn):
+    """stocks 表和它的索引占用的空间（KB），没有编译 dbstat 时返回 None"""
+    try:
+        size = conn.execute("""
+            SELECT SUM(pgsize) FROM dbstat
+            WHERE name = 'stocks' OR name IN (SELECT name FROM sqlite_master WHERE tbl_name = 'stocks' AND type = 'index')
+        """).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+    return size / 1024
+
+def bench_archive(sizes, deleted_ratio=0.7, page_size=50):
+    """归档：已删除持仓搬到归档表前后，列表/历史的查询延迟和热表大小，以及归档+回收的耗时"""
+    import portfolio_store
+
+    print(f"📊 归档前后对比（已删除 {deleted_ratio:.0%}，删除时间都在60天前）")
+    print("=" * 84)
+    print(f"{'行数':<10} {'指标':<20} {'归档前':<14} {'归档后':<14} {'变化':<10}")
+    print("-" * 84)
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = use_temp_db(tmpdir)
+            seed_stocks(db_path, n, deleted_ratio=deleted_ratio)
+            with portfolio_store.PortfolioStore(db_path) as store:
+                conn = store.conn
+                with conn:
+                    conn.execute("UPDATE stocks SET deleted_at = datetime('now', '-60 days') WHERE is_deleted = 1")
+                conn.execute("ANALYZE")
+                queries = [
+                    ("列表 全部", stock_db.build_list_query(False)),
+                    ("列表 第一页", stock_db.build_list_query(False, page_size)),
+                    ("历史 第一页", stock_db.build_list_query(True, page_size)),
+                ]
+                results = {}
+                for archived in [False, True]:
+                    if archived:
+                        start = time.perf_counter()
+                        moved = store.archive()
+                        archive_ms = (time.perf_counter() - start) * 1000
+                        free_before, pages_before = store.free_pages()
+                        start = time.perf_counter()
+                        freed = store.vacuum()
+                        vacuum_ms = (time.perf_counter() - start) * 1000
+                        conn.execute("ANALYZE")
+                    for label, (sql, params) in queries:
+                        results.setdefault(label, []).append(_time_query(conn, sql, params))
+                    results.setdefault("历史 行数", []).append(
+                        len(conn.execute(*stock_db.build_list_query(True)).fetchall()))
+                    results.setdefault("热表+索引", []).append(_hot_table_kb(conn))
+                    results.setdefault("数据库", []).append(
+                        conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0] / 1024)
+
+        for label, (before, after) in results.items():
+            if before is None:
+                continue
+            if label == "历史 行数":
+                cells = (str(before), str(after), "✅" if before == after else "❌")
+            elif label in ["热表+索引", "数据库"]:
+                cells = (f"{before:.0f}KB", f"{after:.0f}KB", f"{(after / before - 1) * 100:+.0f}%")
+            else:
+                cells = (f"{before:.2f}ms", f"{after:.2f}ms", f"{before / after:.1f}x")
+            print(f"{n:<10} {label:<20} {cells[0]:<14} {cells[1]:<14} {cells[2]:<10}")
+        print(f"{'':<10} 归档 {moved} 行 {archive_ms:.0f}ms，回收 {freed}/{free_before} 空闲页（共 {pages_before} 页）{vacuum_ms:.0f}ms")
+    print("=" * 84)
+
+# 合成持有理由用的词
+REASON_WORDS = ["AI", "趋势", "芯片", "龙头", "半导体", "国产替代", "算力", "新能源", "光伏", "储能", "白酒", "消费",
+                "复苏", "高股息", "红利", "低估值", "医药", "创新药", "军工", "订单", "业绩", "拐点", "突破", "放量",
+                "回调", "到位", "机器人", "汽车", "出海", "券商", "银行", "稳定", "分红", "周期", "涨价", "资源"]
+
+def bench_search(n=100000, rounds=200):
+    """持有理由搜索：FTS5（单字索引）vs LIKE 扫表，以及触发器给写入带来的开销"""
+    import portfolio_store
+
+    queries = ["芯片", "AI 算力", "国产替代", "龙头 突破", "高股息红利", "机器人出海", "药", "量子计算"]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = use_temp_db(tmpdir)
+        seed_stocks(db_path, n, deleted_ratio=0.3)
+        with portfolio_store.PortfolioStore(db_path) as store:
+            conn = store.conn
+            rows = [(f"{random.choice(REASON_WORDS)}{random.choice(REASON_WORDS)}，{random.choice(REASON_WORDS)}"
+                     f"{random.choice(REASON_WORDS)}", stock_id)
+                    for (stock_id,) in conn.execute("SELECT id FROM stocks").fetchall()]
+            timings = []
+            for with_triggers in [True, False]:
+                if not with_triggers:
+                    conn.execute("DROP TRIGGER trg_reason_update")
+                start = time.perf_counter()
+                stock_db.run_write(conn, lambda cursor: cursor.executemany(
+                    "UPDATE stocks SET hold_reason = ? WHERE id = ?", rows))
+                timings.append(time.perf_counter() - start)
+
+            print(f"📊 持有理由搜索（{n} 只持仓，其中约30%已删除；p50/p95，{rounds} 次）")
+            print("=" * 92)
+            print(f"{'关键词':<14} {'命中(未删除)':<12} {'FTS5 p50':<12} {'FTS5 p95':<12} {'含已删除 p50':<14} {'LIKE扫表':<10}")
+            print("-" * 92)
+            for query in queries:
+                samples, all_samples = [], []
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    store.search(query)
+                    samples.append((time.perf_counter() - start) * 1000)
+                    start = time.perf_counter()
+                    store.search(query, include_deleted=True)
+                    all_samples.append((time.perf_counter() - start) * 1000)
+                terms = query.split()
+                like_sql = "SELECT id FROM stocks WHERE is_deleted = 0" + " AND hold_reason LIKE ?" * len(terms)
+                like_ms = _time_query(conn, like_sql, [f"%{t}%" for t in terms])
+                matched = conn.execute("SELECT COUNT(*) FROM reason_fts JOIN stocks s ON s.id = reason_fts.rowid "
+                                       "WHERE reason_fts MATCH ? AND s.is_deleted = 0",
+                                       (portfolio_store.match_expression(query),)).fetchone()[0]
+                p50, p95 = _percentiles(samples)
+                print(f"{query:<14} {matched:<12} {f'{p50:.3f}ms':<12} {f'{p95:.3f}ms':<12} "
+                      f"{f'{statistics.median(all_samples):.3f}ms':<14} {f'{like_ms:.2f}ms':<10}")
+            print("=" * 92)
+            print(f"返回前 {portfolio_store.SEARCH_LIMIT} 条（最近 {portfolio_store.SEARCH_CANDIDATES} 条命中里BM25排序+片段）；"
+                  f"更新全部持有理由：带索引触发器 {timings[0] * 1000:.0f}ms，不带 {timings[1] * 1000:.0f}ms")
+
+def _scalar_recompute(rows, total_capital):
+    """逐行调用 stock_db 的标量函数重算（对照组）"""
+    params = []
+    suggestions = []
+    for stock_id, quantity, cost_price, stop_loss, current_price, hold_reason in rows:
+        total_value = stock_db.calculate_total_value(quantity, current_price)
+        position = stock_db.calculate_position(total_value, total_capital)
+        pnl, pnl_percent = stock_db.calculate_pnl(current_price, cost_price, position, total_value)
+        mode = stock_db.auto_adjust_mode(position)
+        suggestions.append(stock_db.get_simple_suggestion(mode, current_price, stop_loss, position, hold_reason))
+        params.append((total_value, position, mode, pnl, pnl_percent, stock_id))
+    return params, suggestions
+
+def bench_recompute(n=100000, total_capital=600000):
+    """总资金重算：向量化引擎 vs 逐行标量函数（读取、计算、写回分开计时）"""
+    import portfolio_engine
+    portfolio_engine.require_numpy()
+
+    print(f"📊 总资金重算（{n} 只持仓）")
+    print("=" * 64)
+    print(f"{'方式':<20} {'读取':<10} {'计算':<10} {'写回':<10}")
+    print("-" * 64)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = use_temp_db(tmpdir)
+        seed_stocks(db_path, n)
+        conn = stock_db.get_conn()
+        conn.execute("UPDATE stocks SET hold_reason = '理由' WHERE id % 2 = 0")
+        conn.commit()
+
+        # 标量：逐行调用 calculate_* / get_simple_suggestion
+        t0 = time.perf_counter()
+        rows = conn.execute("""
+            SELECT id, quantity, cost_price, stop_loss, current_price, hold_reason
+            FROM stocks WHERE +is_deleted = 0 ORDER BY id
+        """).fetchall()
+        t1 = time.perf_counter()
+        params, scalar_suggestions = _scalar_recompute(rows, total_capital)
+        t2 = time.perf_counter()
+        stock_db.run_write(conn, lambda cursor: cursor.executemany("""
+            UPDATE stocks SET total_value = ?, position = ?, mode = ?, pnl = ?, pnl_percent = ?,
+                              updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, params))
+        t3 = time.perf_counter()
+        scalar = (t1 - t0, t2 - t1, t3 - t2)
+
+        # 向量化
+        t0 = time.perf_counter()
+        holdings = portfolio_engine.load_holdings(conn)
+        t1 = time.perf_counter()
+        result = portfolio_engine.compute(holdings, total_capital)
+        t2 = time.perf_counter()
+        portfolio_engine.write_back(conn, holdings, result, total_capital)
+        t3 = time.perf_counter()
+        vector = (t1 - t0, t2 - t1, t3 - t2)
+        # 重算保存了总资金：之后不带总资金的更新按它算仓位
+        stock_id, quantity, _, _, current_price, _ = rows[0]
+        updated = stock_db.open_store(conn).update(stock_id, current_price)
+        capital_kept = abs(updated.position - stock_db.calculate_position(quantity * current_price, total_capital)) < 1e-9
+        stock_db.release_conn(conn)
+
+    vector_suggestions = [portfolio_engine.suggestion_text(code, pos) for code, pos in
+                          zip(result["suggestion"].tolist(), result["suggested_position"].tolist())]
+    mismatches = sum(a != b for a, b in zip(scalar_suggestions, vector_suggestions))
+    for label, timings in [("逐行标量函数", scalar), ("NumPy向量化", vector)]:
+        print(f"{label:<20} " + " ".join(f"{f'{t * 1000:.1f}ms':<10}" for t in timings))
+    print("=" * 64)
+    print(f"计算加速: {scalar[1] / vector[1]:.0f}x，建议不一致: {mismatches} 行，"
+          f"重算后更新沿用总资金: {'✅' if capital_kept else '❌'}")
+
+def bench_price_history(n_stocks=50, years=5, ticks_per_day=48, days=30):
+    """价格历史：多年K线 + 保留期内原始价格，查询全部持仓最近N天的延迟"""
+    import price_history
+
+    now = int(time.time())
+    today = price_history.day_of(now)
+    keep = price_history.DEFAULT_KEEP_DAYS
+    print(f"📊 价格历史查询（{n_stocks} 只持仓 × {years} 年日K线 + {keep} 天原始价格，每天 {ticks_per_day} 条）")
+    print("=" * 64)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = use_temp_db(tmpdir)
+        seed_stocks(db_path, n_stocks)
+        conn = stock_db.get_conn()
+        scale = stock_db.PRICE_SCALE
+        bars, ticks = [], []
+        for stock_id in range(1, n_stocks + 1):
+            price = random.uniform(5, 200)
+            for day in range(today - years * 365, today + 1):
+                if day > today - keep:
+                    # 保留期内：原始价格 + 对应的日K线
+                    start = price_history.day_start(day)
+                    day_prices = []
+                    for i in range(ticks_per_day):
+                        price *= random.uniform(0.995, 1.005)
+                        day_prices.append(round(price * scale))
+                        ticks.append((stock_id, start + i * 86400 // ticks_per_day, day_prices[-1]))
+                    bars.append((stock_id, day, day_prices[0], max(day_prices), min(day_prices),
+                                 day_prices[-1], ticks_per_day))
+                else:
+                    high, low = price * random.uniform(1, 1.03), price * random.uniform(0.97, 1)
+                    close = random.uniform(low, high)
+                    bars.append((stock_id, day, round(price * scale), round(high * scale),
+                                 round(low * scale), round(close * scale), ticks_per_day))
+                    price = close
+        with conn:
+            conn.executemany("INSERT INTO price_bars VALUES (?, ?, ?, ?, ?, ?, ?)", bars)
+            conn.executemany("INSERT INTO prices VALUES (?, ?, ?)", ticks)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"K线 {len(bars)} 根，原始价格 {len(ticks)} 条，数据库 {os.path.getsize(db_path) / 1e6:.1f}MB")
+        print("-" * 64)
+
+        for label, n_days, stock_id in [(f"全部持仓 最近{days}天", days, None),
+                                         ("全部持仓 最近1年", 365, None),
+                                         (f"单只股票 最近{days}天", days, 1)]:
+            samples = []
+            for _ in range(20):
+                start = time.perf_counter()
+                price_history.load_daily(conn, n_days, stock_id, now)
+                samples.append((time.perf_counter() - start) * 1000)
+            p50, p95 = _percentiles(samples)
+            print(f"{label:<24} p50 {p50:.2f}ms  p95 {p95:.2f}ms")
+
+        # 再往后推10天压缩：10天的原始价格合并成K线
+        stock_db.release_conn(conn)
+        start = time.perf_counter()
+        compacted, new_bars = price_history.compact_prices(keep, now + 10 * 86400)
+        print(f"压缩 {compacted} 条原始价格（校正 {new_bars} 根K线）: {(time.perf_counter() - start) * 1000:.1f}ms")
+    print("=" * 64)
+
+def _naive_stop_stats(bars, window):
+    """对照组：从日K线 [(day, high, low, close), ...]（按日期排序，价格为整数）直接算最近 window 天的 (ATR, 日波动率)"""
+    scale = stock_db.PRICE_SCALE
+    start = max(0, len(bars) - window)
+    trs, rets = [], []
+    for i in range(start, len(bars)):
+        high, low, close = bars[i][1], bars[i][2], bars[i][3]
+        if i == 0:
+            trs.append((high - low) / scale)
+            continue
+        prev = bars[i - 1][3]
+        trs.append((max(high, prev) - min(low, prev)) / scale)
+        rets.append(math.log(close / prev))
+    return sum(trs) / len(trs), statistics.stdev(rets) if len(rets) >= 2 else None
+
+def bench_stop_suggest(n_stocks=2000, years=3, new_days=30, ticks_per_day=4, rounds=20):
+    """止损建议：写入价格时增量更新滚动统计的开销，读统计 vs 扫日K线重算，增量结果与日K线重算核对"""
+    import price_history
+    import volatility
+    import portfolio_store
+
+    window = volatility.STATS_WINDOW
+    print(f"📊 止损建议（{n_stocks} 只持仓 × {years} 年日K线，之后 {new_days} 天每天 {ticks_per_day} 次批量更新现价）")
+    print("=" * 72)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = use_temp_db(tmpdir)
+        seed_stocks(db_path, n_stocks)
+        scale = stock_db.PRICE_SCALE
+        today = price_history.day_of(time.time())
+        first_new = today - new_days + 1
+        bars, prices = [], {}
+        for stock_id in range(1, n_stocks + 1):
+            price = random.uniform(5, 200)
+            for day in range(first_new - years * 250, first_new):
+                high, low = price * random.uniform(1, 1.03), price * random.uniform(0.97, 1)
+                close = random.uniform(low, high)
+                bars.append((stock_id, day, round(price * scale), round(high * scale),
+                             round(low * scale), round(close * scale), 1))
+                price = close
+            prices[stock_id] = price
+        with portfolio_store.PortfolioStore(db_path) as store:
+            conn = store.conn
+            with conn:
+                conn.executemany("INSERT INTO price_bars VALUES (?, ?, ?, ?, ?, ?, ?)", bars)
+            start = time.perf_counter()
+            stock_db.run_write(conn, volatility.rebuild_stats)
+            print(f"按日K线重建统计（迁移时执行一次）: {len(bars)} 根K线 {(time.perf_counter() - start) * 1000:.0f}ms")
+
+            # 之后每天几次批量更新现价，单独记下增量统计花的时间
+            update_stats, stats_ms = volatility.update_stats, []
+
+            def timed_update_stats(*args):
+                begin = time.perf_counter()
+                update_stats(*args)
+                stats_ms.append((time.perf_counter() - begin) * 1000)
+
+            volatility.update_stats = timed_update_stats
+            batch_ms = []
+            try:
+                for day in range(first_new, today + 1):
+                    for i in range(ticks_per_day):
+                        for stock_id in prices:
+                            prices[stock_id] *= random.uniform(0.98, 1.02)
+                        begin = time.perf_counter()
+                        store.update_prices(list(prices.items()),
+                                            ts=price_history.day_start(day) + 36000 + i * 3600)
+                        batch_ms.append((time.perf_counter() - begin) * 1000)
+            finally:
+                volatility.update_stats = update_stats
+            print(f"批量更新 {n_stocks} 个现价: p50 {_percentiles(batch_ms)[0]:.1f}ms，"
+                  f"其中增量统计 p50 {_percentiles(stats_ms)[0]:.1f}ms（每个价格 "
+                  f"{_percentiles(stats_ms)[0] * 1000 / n_stocks:.1f}µs）")
+            print("-" * 72)
+
+            fast = []
+            for _ in range(rounds):
+                begin = time.perf_counter()
+                suggestions = store.stop_suggestions()
+                fast.append((time.perf_counter() - begin) * 1000)
+            naive, expected = [], {}
+            for _ in range(3):
+                begin = time.perf_counter()
+                history = {}
+                for stock_id, day, high, low, close in conn.execute(
+                        "SELECT stock_id, day, high, low, close FROM price_bars ORDER BY stock_id, day"):
+                    history.setdefault(stock_id, []).append((day, high, low, close))
+                expected = {stock_id: _naive_stop_stats(b, window) for stock_id, b in history.items()}
+                naive.append((time.perf_counter() - begin) * 1000)
+            print(f"止损建议（读 price_stats）     p50 {_percentiles(fast)[0]:.1f}ms")
+            print(f"对照：扫全部日K线重算          p50 {statistics.median(naive):.0f}ms")
+
+            def mismatches():
+                bad = 0
+                for s in store.stop_suggestions():
+                    atr, vol = expected[s.stock_id]
+                    got_vol = s.volatility / 100 / math.sqrt(volatility.TRADING_DAYS)
+                    bad += not (math.isclose(s.atr, atr, rel_tol=1e-9) and math.isclose(got_vol, vol, rel_tol=1e-9))
+                return bad
+
+            incremental_bad = mismatches()
+            stock_db.run_write(conn, volatility.rebuild_stats)
+            print(f"核对（与日K线重算对比）：增量 {'✅' if not incremental_bad else f'❌ {incremental_bad} 只不一致'}，"
+                  f"重建 {'✅' if not mismatches() else '❌'}（{len(suggestions)} 只）")
+
+            # 价格一直不动（停牌、货币基金）：ATR 为0，不能按ATR判断，也不给建议止损
+            flat = store.add("停牌股", "FLAT01", 100, 10.0, 9.0, 10.0)
+            with conn:
+                conn.executemany("INSERT INTO price_bars VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 [(flat.id, day, 10 * scale, 10 * scale, 10 * scale, 10 * scale, 1)
+                                  for day in range(today - volatility.MIN_STATS_DAYS - 1, today)])
+            stock_db.run_write(conn, volatility.rebuild_stats)
+            flat_ok = True
+            for _ in range(2):
+                s = store.stop_suggestions(flat.id)[0]
+                flat_ok &= (s.atr == 0 and s.stop_atr is None and s.suggested_stop is None
+                            and s.suggested_position is None and volatility._verdict(s) == "💤 无波动")
+                store.update_prices([(flat.id, 10.0)], ts=price_history.day_start(today) + 72000)
+            print(f"核对（价格不变、ATR为0）：增量和重建 {'✅' if flat_ok else '❌'}")
+    print("=" * 72)
+
+def bench_stop_watcher(n_symbols=10000, n_ticks=1000000, naive_ticks=200):
+    """止损监控回放：有序阈值 + 二分查找 vs 每个价格重算全部持仓"""
+    import stop_watcher
+
+    print(f"📊 止损监控回放（{n_symbols} 个代码 × {n_ticks} 个价格）")
+    print("=" * 64)
+    holdings, prices = [], {}
+    for i in range(n_symbols):
+        code = f"{i:06d}"
+        prices[code] = random.uniform(5, 200)
+        # 约10%的代码有两笔持仓（不同止损价；第二笔的现价是之前单独更新的，和第一笔不同）
+        for n in range(2 if random.random() < 0.1 else 1):
+            price = prices[code] if n == 0 else prices[code] * random.uniform(0.9, 1.1)
+            holdings.append((len(holdings) + 1, code, price * random.uniform(0.75, 0.95), price))
+    codes = list(prices)
+    ticks = []
+    for _ in range(n_ticks):
+        code = random.choice(codes)
+        prices[code] *= random.uniform(0.98, 1.02)
+        ticks.append((code, prices[code]))
+
+    start = time.perf_counter()
+    watcher = stop_watcher.StopWatcher(holdings)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    events = [event for code, price in ticks for event in watcher.on_price(code, price)]
+    elapsed = time.perf_counter() - start
+
+    # 对照组：每个价格把全部持仓的止损状态重算一遍（只跑前 naive_ticks 个价格再按比例换算）
+    current = {code: price for _, code, _, price in holdings}
+    states = {stock_id: stop_watcher.stop_state(price, stop) for stock_id, _, stop, price in holdings}
+    start = time.perf_counter()
+    for code, price in ticks[:naive_ticks]:
+        current[code] = price
+        for stock_id, code_, stop, _ in holdings:
+            states[stock_id] = stop_watcher.stop_state(current[code_], stop)
+    naive = (time.perf_counter() - start) / naive_ticks * n_ticks
+
+    # 正确性：逐个价格只重算该代码的持仓，事件序列必须一致
+    by_code = {}
+    for stock_id, code, stop, price in holdings:
+        by_code.setdefault(code, []).append((stock_id, stop))
+    states = {stock_id: stop_watcher.stop_state(price, stop) for stock_id, _, stop, price in holdings}
+    expected = []
+    for code, price in ticks:
+        for stock_id, stop in by_code[code]:
+            state = stop_watcher.stop_state(price, stop)
+            if state != states[stock_id]:
+                expected.append((stock_id, state))
+                states[stock_id] = state
+    mismatch = expected != [(e.stock_id, e.new_state) for e in events]
+
+    print(f"建立索引: {build * 1000:.1f}ms（{len(holdings)} 笔持仓）")
+    print(f"有序阈值: {elapsed:.2f}s（{n_ticks / elapsed:.0f} 价格/秒，{elapsed / n_ticks * 1e6:.2f}µs/价格）")
+    print(f"全量重算: {naive:.0f}s（按前 {naive_ticks} 个价格换算）")
+    print(f"状态变化 {len(events)} 次，只检查了 {watcher.stats['checked']} 个持仓，"
+          f"与逐代码重算{'不一致 ❌' if mismatch else '一致 ✅'}")
+    print("=" * 64)
+    print(f"加速: {naive / elapsed:.0f}x")
+
+def bench_ingest(n_stocks=2000, n_ticks=1000000, naive_ticks=2000):
+    """行情接入：按代码合并 + 定时批量写入 vs 每个价格一个事务"""
+    import asyncio
+    import json
+    import tick_ingest
+
+    print(f"📊 行情接入（{n_stocks} 个代码 × {n_ticks} 个价格，JSONL回放）")
+    print("=" * 72)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = use_temp_db(tmpdir)
+        seed_stocks(db_path, n_stocks)
+        source = os.path.join(tmpdir, "ticks.jsonl")
+        prices = {f"{i:06d}": random.uniform(5, 200) for i in range(n_stocks)}
+        codes = list(prices)
+        ts = int(time.time())
+        with open(source, "w") as f:
+            for i in range(n_ticks):
+                code = random.choice(codes)
+                prices[code] *= random.uniform(0.99, 1.01)
+                f.write(json.dumps({"code": code, "price": round(prices[code], 2), "ts": ts + i // 1000}) + "\n")
+
+        # 对照组：每个价格单独一个事务（只跑前 naive_ticks 个再按比例换算）
+        with open(source) as f:
+            ticks = [tick_ingest.parse_tick(next(f)) for _ in range(naive_ticks)]
+        start = time.perf_counter()
+        for code, price, tick_ts in ticks:
+            stock_db.bulk_update_stocks([(code, price)], True, ts=tick_ts)
+        naive = (time.perf_counter() - start) / naive_ticks * n_ticks
+
+        print(f"{'刷新间隔':<10} {'批量':<8} {'耗时':<10} {'价格/秒':<12} {'事务':<8} {'合并丢弃':<12} {'刷新p50/p95':<16}")
+        print("-" * 72)
+        for interval_ms, batch_size in [(100, 500), (500, 2000)]:
+            ingestor = tick_ingest.TickIngestor(interval_ms, batch_size)
+            start = time.perf_counter()
+            asyncio.run(ingestor.run(source, report=False))
+            elapsed = time.perf_counter() - start
+            m = ingestor.snapshot()
+            print(f"{f'{interval_ms}ms':<10} {batch_size:<8} {f'{elapsed:.2f}s':<10} {m['received'] / elapsed:<12.0f} "
+                  f"{m['flushes']:<8} {m['coalesced']:<12} {m['flush_p50_ms']:.1f}/{m['flush_p95_ms']:.1f}ms")
+    print("=" * 72)
+    print(f"每个价格一个事务: 约 {naive:.0f}s（{n_ticks / naive:.0f} 价格/秒，按前 {naive_ticks} 个价格换算）")
+
+def bench_import(sizes, batches=(1000, 5000, 20000), bad_ratio=0.01, naive_rows=1000):
+    """导入券商持仓：流式分批按代码合并写入的吞吐和内存峰值（一半代码已有持仓、一半新增，1%错误行）"""
+    import csv
+    import tracemalloc
+    import broker_import
+    import portfolio_store
+
+    print(f"📊 导入券商持仓（一半更新、一半新增，{bad_ratio:.0%} 错误行）")
+    print("=" * 84)
+    print(f"{'行数':<10} {'每批':<8} {'耗时':<10} {'行/秒':<10} {'新增':<9} {'更新':<9} {'拒绝':<7} {'内存峰值(重新导入)':<16}")
+    print("-" * 84)
+    mapping = broker_import.load_mapping()
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, "positions.csv")
+            with open(source, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["证券代码", "证券名称", "股票余额", "参考成本价", "市价"])
+                for i in range(n):
+                    quantity = random.randint(1, 50) * 100 if random.random() >= bad_ratio else "--"
+                    cost_price = round(random.uniform(5, 200), 2)
+                    writer.writerow([f"{i:06d}", f"股票{i}", quantity, cost_price,
+                                     round(cost_price * random.uniform(0.7, 1.5), 2)])
+            for batch in batches:
+                db_path = use_temp_db(tmpdir, f"bench_{batch}.db")
+                seed_stocks(db_path, n // 2)
+                rejects = os.path.join(tmpdir, "rejects.csv")
+                with portfolio_store.PortfolioStore(db_path) as store:
+                    start = time.perf_counter()
+                    stats = broker_import.import_rows(store, broker_import.read_csv_rows(source), mapping, batch,
+                                                      rejects_path=rejects)
+                    elapsed = time.perf_counter() - start
+                    tracemalloc.start()
+                    broker_import.import_rows(store, broker_import.read_csv_rows(source), mapping, batch,
+                                              rejects_path=rejects)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                print(f"{n:<10} {batch:<8} {f'{elapsed:.2f}s':<10} {stats['rows'] / elapsed:<10.0f} "
+                      f"{stats['inserted']:<9} {stats['updated']:<9} {stats['rejected']:<7} {f'{peak / 1024:.0f}KB':<16}")
+
+    # 对照组：每行一次 /risk 添加 的写法（进程内 store.add，每行一个事务）
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with portfolio_store.PortfolioStore(use_temp_db(tmpdir)) as store:
+            start = time.perf_counter()
+            for i in range(naive_rows):
+                store.add(f"股票{i}", f"{i:06d}", 100, 10, 9, 10)
+            naive = naive_rows / (time.perf_counter() - start)
+    print("=" * 84)
+    print(f"逐行添加（每行一个事务，不含进程启动）: {naive:.0f} 行/秒")
+
+def _synthetic_trades(n, n_stocks, start_ts, gap=30):
+    """合成交易流水：时间递增（每 gap 秒一笔），空仓时买入，否则买卖各半，卖出时一成概率卖光"""
+    held = [0] * (n_stocks + 1)
+    for i in range(n):
+        stock_id = random.randint(1, n_stocks)
+        lot = random.randint(1, 10) * 100
+        price = round(random.uniform(5, 200) * stock_db.PRICE_SCALE)
+        if held[stock_id] == 0 or random.random() < 0.5:
+            kind, quantity = "买入", lot
+        else:
+            kind, quantity = "卖出", held[stock_id] if random.random() < 0.1 else min(lot, held[stock_id])
+        held[stock_id] += quantity if kind == "买入" else -quantity
+        yield stock_id, start_ts + i * gap, kind, quantity, price
+
+def bench_ledger(sizes, n_stocks=2000, queries=200, checks=5):
+    """交易流水按时间点回溯：读快照 + 重放之后的交易 vs 从头重放，结果逐只核对"""
+    import portfolio_store
+
+    every = portfolio_store.SNAPSHOT_EVERY
+    print(f"📊 交易流水按时间点回溯（{n_stocks} 只股票，每 {every} 笔交易一个快照，随机时间点 {queries} 次）")
+    print("=" * 104)
+    print(f"{'交易笔数':<10} {'写入':<9} {'补快照':<16} {'全部持仓p50':<12} {'p95':<9} {'最慢':<9} "
+          f"{'单只p50':<9} {'从头重放':<10} {'核对':<6}")
+    print("-" * 104)
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = use_temp_db(tmpdir)
+            seed_stocks(db_path, n_stocks)
+            start_ts = int(time.time()) - n * 30
+            with portfolio_store.PortfolioStore(db_path) as store:
+                conn = store.conn
+                conn.execute("PRAGMA cache_size = -262144")
+                start = time.perf_counter()
+                with conn:
+                    conn.executemany("INSERT INTO trades (stock_id, ts, kind, quantity, price) VALUES (?, ?, ?, ?, ?)",
+                                     _synthetic_trades(n, n_stocks, start_ts))
+                load_s = time.perf_counter() - start
+                start = time.perf_counter()
+                snapshots = store.take_snapshots()
+                snapshot_s = time.perf_counter() - start
+                conn.execute("PRAGMA cache_size = -2000")
+                conn.execute("ANALYZE")
+
+                book, single = [], []
+                for _ in range(queries):
+                    ts = random.randint(start_ts, start_ts + n * 30)
+                    begin = time.perf_counter()
+                    store.positions_at(ts)
+                    book.append((time.perf_counter() - begin) * 1000)
+                    begin = time.perf_counter()
+                    store.positions_at(ts, random.randint(1, n_stocks))
+                    single.append((time.perf_counter() - begin) * 1000)
+
+                # 对照组：从第一笔开始重放到各个检查点，和快照回溯的结果逐只比较（比较的耗时不计入）
+                checkpoints = sorted(random.randint(start_ts, start_ts + n * 30) for _ in range(checks))
+                state, pending, mismatches, check_s = {}, [], 0, 0.0
+
+                def check(until):
+                    portfolio_store._replay(state, pending)
+                    pending.clear()
+                    begin = time.perf_counter()
+                    expected = {k: v for k, v in state.items() if v[0] > portfolio_store.QUANTITY_EPSILON}
+                    got = {p.stock_id: (p.quantity, p.cost_price) for p in store.positions_at(until)}
+                    bad = sum(1 for k in set(got) | set(expected)
+                              if k not in got or k not in expected or abs(got[k][0] - expected[k][0]) > 1e-6
+                              or abs((got[k][1] or 0) - (expected[k][1] or 0)) > 1e-6)
+                    return bad, time.perf_counter() - begin
+
+                start = time.perf_counter()
+                for row in conn.execute("SELECT stock_id, kind, quantity, price, ts FROM trades ORDER BY ts, id"):
+                    while checkpoints and row[4] > checkpoints[0]:
+                        bad, spent = check(checkpoints.pop(0))
+                        mismatches, check_s = mismatches + bad, check_s + spent
+                    if not checkpoints:
+                        break
+                    pending.append(row[:4])
+                for until in checkpoints:
+                    bad, spent = check(until)
+                    mismatches, check_s = mismatches + bad, check_s + spent
+                full_replay_s = time.perf_counter() - start - check_s
+
+        p50, p95 = _percentiles(book)
+        print(f"{n:<10} {f'{load_s:.1f}s':<9} {f'{snapshots}个 {snapshot_s:.1f}s':<16} {f'{p50:.2f}ms':<12} "
+              f"{f'{p95:.2f}ms':<9} {f'{max(book):.2f}ms':<9} {f'{statistics.median(single):.2f}ms':<9} "
+              f"{f'{full_replay_s:.1f}s':<10} {'✅' if mismatches == 0 else f'❌{mismatches}':<6}")
+    print("=" * 104)
+    print("从头重放：不用快照，读到最后一个检查点为止的全部交易再重放（不含核对耗时）")
+
+def bench_risk_sim(n_holdings=200, paths=100000, horizon=10, days=250):
+    """组合风险模拟耗时：单进程 vs 进程池"""
+    import risk_sim
+    risk_sim.require_numpy()
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    # 单因子收益率：市场 + 个股，保证股票之间相关
+    market = rng.normal(0, 0.012, size=(days, 1))
+    gross = 1 + market * rng.uniform(0.5, 1.5, size=n_holdings) + rng.normal(0, 0.02, size=(days, n_holdings))
+    values = rng.uniform(1000, 20000, size=n_holdings)
+    stop_ratio = rng.uniform(0.8, 0.95, size=n_holdings)
+
+    print(f"📊 组合风险模拟（{n_holdings} 只持仓 × {horizon} 个交易日，{days} 天历史收益率，{os.cpu_count()} 核CPU）")
+    print("=" * 72)
+    print(f"{'路径数':<10} {'进程数':<8} {'耗时':<10} {'VaR 99%':<14} {'CVaR 99%':<14} {'平均止损':<10}")
+    print("-" * 72)
+    for n_paths, workers in [(paths, 1), (paths, 4), (paths * 10, 1), (paths * 10, 4)]:
+        start = time.perf_counter()
+        result = risk_sim.run_simulation(gross, values, stop_ratio, n_paths, horizon, workers, seed=1)
+        elapsed = time.perf_counter() - start
+        summary = risk_sim.summarize(*result)
+        print(f"{n_paths:<10} {workers:<8} {f'{elapsed:.2f}s':<10} {summary['var'][99]:<14.0f} "
+              f"{summary['cvar'][99]:<14.0f} {summary['stops_mean']:<10.2f}")
+    print("=" * 72)
+
+def bench_backtest(n_symbols=5000, years=10):
+    """历史回测：CSV转换（内存映射缓存）和回测耗时"""
+    import backtest
+    backtest.require_numpy()
+    import numpy as np
+
+    n_days = years * 252
+    rng = np.random.default_rng(0)
+    print(f"📊 历史回测（{n_symbols} 只股票 × {years} 年，{n_days} 个交易日）")
+    print("=" * 64)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_dir = os.path.join(tmpdir, "kline")
+        os.makedirs(csv_dir)
+        dates = np.busday_offset("2015-01-05", np.arange(n_days)).astype(str)
+        start = time.perf_counter()
+        for i in range(n_symbols):
+            # 部分股票晚上市
+            first = int(rng.integers(0, n_days // 2)) if i % 10 == 0 else 0
+            close = rng.uniform(5, 100) * np.exp(np.cumsum(rng.normal(0.0002, 0.02, n_days - first)))
+            open_ = close * np.exp(rng.normal(0, 0.005, len(close)))
+            high = np.maximum(open_, close) * rng.uniform(1, 1.02, len(close))
+            low = np.minimum(open_, close) * rng.uniform(0.98, 1, len(close))
+            with open(os.path.join(csv_dir, f"{i:06d}.csv"), "w") as f:
+                f.write("date,open,high,low,close\n")
+                f.writelines(f"{d},{o:.2f},{h:.2f},{l:.2f},{c:.2f}\n"
+                             for d, o, h, l, c in zip(dates[first:], open_, high, low, close))
+        print(f"生成CSV: {time.perf_counter() - start:.1f}s")
+
+        cache_dir = os.path.join(csv_dir, backtest.CACHE_DIR_NAME)
+        start = time.perf_counter()
+        backtest.convert_csv_dir(csv_dir, cache_dir)
+        size = sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir))
+        print(f"转换为 .npy 缓存: {time.perf_counter() - start:.1f}s（{size / 1e6:.0f}MB）")
+
+        for workers in sorted({1, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            result = backtest.run_backtest(cache_dir, workers=workers)
+            elapsed = time.perf_counter() - start
+            summary = backtest.summarize(result)
+            print(f"回测（{workers} 进程）: {elapsed:.1f}s，事件 {len(result['events'][0])} 条，"
+                  f"总收益 {summary['total_return']:+.1f}%，最大回撤 {summary['max_drawdown']:.1f}%")
+    print("=" * 64)
+
+def bench_batch_sizing(n=1000000, spawn_rounds=10):
+    """批量仓位计算：读取/计算/输出分开计时，对照逐行标量函数和每行一个进程"""
+    import io
+    import position_sizing
+    position_sizing.require_numpy()
+
+    print(f"📊 批量仓位计算（{n} 行）")
+    print("=" * 64)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "watchlist.csv")
+        with open(source, "w") as f:
+            f.write("code,price,stop,target_risk\n")
+            for i in range(n):
+                price = random.uniform(5, 200)
+                risk = "" if i % 2 else f"{random.choice([0.5, 1, 2])}"
+                f.write(f"{i:06d},{price:.2f},{price * random.uniform(0.7, 0.97):.2f},{risk}\n")
+
+        start = time.perf_counter()
+        codes, price, stop_loss, target_risk, _ = position_sizing.read_sizing_rows(source)
+        t_read = time.perf_counter() - start
+        start = time.perf_counter()
+        result = position_sizing.batch_sizing(codes, price, stop_loss, target_risk, 1000000)
+        t_compute = time.perf_counter() - start
+        timings = {}
+        for output_format in ["csv", "json"]:
+            start = time.perf_counter()
+            position_sizing.write_rows(result, output_format, io.StringIO())
+            timings[output_format] = time.perf_counter() - start
+
+        # 对照组1：逐行调用 calculate_concentrated 的公式（Python标量）
+        start = time.perf_counter()
+        for p, s, r in zip(price.tolist(), stop_loss.tolist(), target_risk.tolist()):
+            drop = 1 - s / p
+            if drop > 0:
+                r / (drop * 100) * 100
+        t_scalar = time.perf_counter() - start
+
+        # 对照组2：每行启动一次 risk.py（原来筛选自选股的方式）
+        start = time.perf_counter()
+        for _ in range(spawn_rounds):
+            subprocess.run([sys.executable, os.path.join(SKILL_DIR, "risk.py"), "集中", "2960", "2457"],
+                           stdout=subprocess.DEVNULL, check=True)
+        t_spawn = (time.perf_counter() - start) / spawn_rounds * n
+
+    print(f"读取CSV: {t_read:.2f}s（{n / t_read:.0f} 行/秒）")
+    print(f"向量化计算: {t_compute * 1000:.0f}ms（{n / t_compute:.0f} 行/秒）")
+    print(f"输出CSV: {timings['csv']:.2f}s，输出JSON: {timings['json']:.2f}s")
+    print("-" * 64)
+    print(f"逐行标量计算: {t_scalar * 1000:.0f}ms（向量化快 {t_scalar / t_compute:.0f}x）")
+    print(f"每行一个进程: 约 {t_spawn / 3600:.1f} 小时（按 {spawn_rounds} 次换算）")
+    print("=" * 64)
+
+def bench_store(n_stocks=1000, ops=2000, spawn_rounds=20):
+    """持仓库：进程内逐条/批量调用 vs 每次启动进程执行命令"""
+    import portfolio_store
+
+    print(f"📊 持仓库吞吐（{n_stocks} 只持仓，逐条 {ops} 次）")
+    print("=" * 64)
+    print(f"{'方式':<28} {'次数':<10} {'耗时':<12} {'次/秒':<10}")
+    print("-" * 64)
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = use_temp_db(tmpdir)
+        with portfolio_store.PortfolioStore(db_path) as store:
+            rows = [(f"股票{i}", f"{i:06d}", random.randint(1, 50) * 100, 10.0, 8.0, round(random.uniform(9, 12), 2))
+                    for i in range(n_stocks)]
+            start = time.perf_counter()
+            store.add_many(rows)
+            results.append(("add_many（一个事务）", n_stocks, time.perf_counter() - start))
+
+            start = time.perf_counter()
+            for _ in range(ops):
+                store.update(random.randint(1, n_stocks), round(random.uniform(9, 12), 2))
+            results.append(("update（每次一个事务）", ops, time.perf_counter() - start))
+
+            start = time.perf_counter()
+            for _ in range(ops):
+                store.get(random.randint(1, n_stocks))
+            results.append(("get", ops, time.perf_counter() - start))
+
+            prices = [(f"{i:06d}", round(random.uniform(9, 12), 2)) for i in range(n_stocks)]
+            start = time.perf_counter()
+            store.update_prices(prices, by_code=True)
+            results.append(("update_prices（一个事务）", n_stocks, time.perf_counter() - start))
+
+        # 对照组：每次更新启动一个进程执行 stock_db.py 更新（原来集成的方式）
+        code = f"import sys, stock_db; stock_db.DB_PATH = {db_path!r}; stock_db.main(sys.argv)"
+        start = time.perf_counter()
+        for _ in range(spawn_rounds):
+            subprocess.run([sys.executable, "-c", code, "更新", str(random.randint(1, n_stocks)), "10.5"],
+                           cwd=SKILL_DIR, stdout=subprocess.DEVNULL, check=True)
+        results.append(("新进程 stock_db.py 更新", spawn_rounds, time.perf_counter() - start))
+
+    for label, count, elapsed in results:
+        print(f"{label:<28} {count:<10} {f'{elapsed * 1000:.0f}ms':<12} {count / elapsed:<10.0f}")
+    print("=" * 64)
+
+def bench_holdings_cache(sizes, rounds=50, page_size=50):
+    """持仓缓存：命中 vs 每次查询并重新计算建议；其他连接写入后必须重新读取"""
+    import portfolio_store
+
+    print(f"📊 持仓缓存（每项 {rounds} 次取p50，一页 {page_size} 行）")
+    print("=" * 100)
+    print(f"{'持仓数':<8} {'全部·查询':<11} {'全部·命中':<11} {'一页·查询':<11} {'一页·命中':<11} "
+          f"{'写入后重读':<11} {'核对':<6} {'命中/未命中':<12}")
+    print("-" * 100)
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = use_temp_db(tmpdir)
+            seed_stocks(db_path, n)
+            cache = portfolio_store.HoldingsCache()
+            with portfolio_store.PortfolioStore(db_path) as plain, \
+                    portfolio_store.PortfolioStore(db_path, cache=cache) as cached:
+                def timed(fn):
+                    samples = []
+                    for _ in range(rounds):
+                        start = time.perf_counter()
+                        fn()
+                        samples.append((time.perf_counter() - start) * 1000)
+                    return _percentiles(samples)[0]
+
+                middle = plain.holdings()[n // 2]
+                after = (middle.position, middle.id)
+                full_plain = timed(plain.holdings)
+                full_hit = timed(cached.holdings)
+                page_plain = timed(lambda: plain.holdings(limit=page_size, after=after))
+                page_hit = timed(lambda: cached.holdings(limit=page_size, after=after))
+
+                # 其他连接提交一次价格更新 → 下一次读取要重新加载，结果与直接查询一致
+                writer = sqlite3.connect(db_path)
+                reload, mismatches = [], 0
+                for i in range(min(rounds, 20)):
+                    writer.execute("UPDATE stocks SET current_price = current_price + 0.01 WHERE id = ?",
+                                   (random.randint(1, n),))
+                    writer.commit()
+                    start = time.perf_counter()
+                    got = cached.holdings(limit=page_size, after=after)
+                    reload.append((time.perf_counter() - start) * 1000)
+                    expected = plain.holdings(limit=page_size, after=after)
+                    mismatches += [h.to_dict() for h in got] != [h.to_dict() for h in expected]
+                writer.close()
+            stats = cache.stats
+        print(f"{n:<8} {f'{full_plain:.2f}ms':<11} {f'{full_hit:.3f}ms':<11} {f'{page_plain:.2f}ms':<11} "
+              f"{f'{page_hit:.3f}ms':<11} {f'{_percentiles(reload)[0]:.2f}ms':<11} "
+              f"{'✅' if not mismatches else f'❌{mismatches}':<6} {stats['hits']}/{stats['misses']}")
+    print("=" * 100)
+    print("注：命中时只执行一次 PRAGMA data_version；写入后缓存失效，分页读取直接查这一页，不分页的读取才重新加载整份列表")
+
+class _FdSampler:
+    """后台线程每毫秒数一次本进程打开的文件句柄（Linux /proc/self/fd），记录峰值"""
+
+    def __init__(self):
+        import threading
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.001):
+            self.peak = max(self.peak, len(os.listdir("/proc/self/fd")))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def bench_portfolios(n_portfolios=1000, n_stocks=20, requests=5000, hot=50, rounds=3):
+    """多组合：连接池有上限 vs 每次打开关闭 vs 不限；汇总 全部组合 的并发读取"""
+    import shutil
+    import portfolios
+
+    print(f"📊 多组合（{n_portfolios} 个组合 + 默认组合，每个 {n_stocks} 只持仓）")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = use_temp_db(tmpdir)
+        seed_stocks(db_path, n_stocks)
+        stock_db.PORTFOLIO_DIR = os.path.join(tmpdir, "portfolios")
+        os.makedirs(stock_db.PORTFOLIO_DIR)
+        names = [f"p{i:04d}" for i in range(n_portfolios)]
+        for name in names:
+            shutil.copyfile(db_path, stock_db.portfolio_path(name))
+        # 每个组合先打开一次（首次打开检查结构版本），计时只看连接本身
+        for name in names:
+            stock_db.open_db(stock_db.portfolio_path(name), verbose=False).close()
+
+        # 常驻服务的请求：80% 落在 hot 个常用组合上，其余随机
+        picks = [random.choice(names[:hot]) if random.random() < 0.8 else random.choice(names) for _ in range(requests)]
+        print(f"常驻服务请求（汇总 --portfolio，{requests} 次，80%落在{hot}个常用组合）")
+        print("=" * 84)
+        print(f"{'连接方式':<20} {'p50':<10} {'p95':<10} {'句柄峰值':<10} {'累计打开':<10} {'复用':<8}")
+        print("-" * 84)
+        for label, size in [("每次打开关闭", None), (f"连接池 {stock_db.CONN_POOL_SIZE}", stock_db.CONN_POOL_SIZE),
+                            (f"连接池不限（{n_portfolios}）", n_portfolios)]:
+            if size:
+                stock_db.keep_conn_open(size)
+            samples = []
+            with _FdSampler() as fds, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                for name in picks:
+                    start = time.perf_counter()
+                    stock_db.main(["stock_db.py", "汇总", f"--portfolio={name}"])
+                    samples.append((time.perf_counter() - start) * 1000)
+            pool = stock_db._conn_pool
+            opened, reused = (pool.stats["opened"], pool.stats["reused"]) if pool else (requests, 0)
+            stock_db.close_conn_pool()
+            p50, p95 = _percentiles(samples)
+            print(f"{label:<20} {f'{p50:.2f}ms':<10} {f'{p95:.2f}ms':<10} {fds.peak:<10} {opened:<10} {reused:<8}")
+        print("=" * 84)
+
+        print(f"汇总 全部组合（{rounds} 次取中位数）")
+        print("=" * 64)
+        print(f"{'线程数':<8} {'耗时':<12} {'句柄峰值':<10} {'合计只数':<10} {'核对':<6}")
+        print("-" * 64)
+        expected = (n_portfolios + 1) * n_stocks
+        for workers in (1, 4, 8, 16):
+            samples = []
+            with _FdSampler() as fds:
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    results = portfolios.summarize_portfolios(workers=workers)
+                    samples.append((time.perf_counter() - start) * 1000)
+            holdings = sum(t.holdings for _, totals in results for t in totals)
+            print(f"{workers:<8} {f'{statistics.median(samples):.0f}ms':<12} {fds.peak:<10} {holdings:<10} "
+                  f"{'✅' if holdings == expected else '❌':<6}")
+        print("=" * 64)
+    print(f"注：每个WAL连接占3个句柄（数据库、-wal、-shm）；本机 {os.cpu_count()} 个CPU")
+
+def bench_summary(sizes, rounds=50):
+    """持仓汇总：读触发器维护的汇总表 vs 扫表求和；以及触发器给批量更新带来的额外开销"""
+    import portfolio_store
+
+    print(f"📊 持仓汇总查询延迟（p50，{rounds} 次）和触发器开销")
+    print("=" * 84)
+    print(f"{'持仓数':<10} {'汇总表':<10} {'SQL扫表':<10} {'Python扫表':<12} {'批量更新(触发器)':<18} {'批量更新(无)':<14}")
+    print("-" * 84)
+    drifts = 0
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = use_temp_db(tmpdir)
+            seed_stocks(db_path, n, deleted_ratio=0.2)
+            with portfolio_store.PortfolioStore(db_path) as store:
+                conn = store.conn
+
+                def python_scan():
+                    # 原来的做法：取出全部未删除持仓在Python里累加
+                    totals = {}
+                    for mode, total_value, position, pnl in conn.execute(
+                            "SELECT mode, total_value, position, pnl FROM stocks WHERE is_deleted = 0"):
+                        t = totals.setdefault(mode, [0, 0.0, 0.0, 0.0])
+                        t[0] += 1
+                        t[1] += total_value
+                        t[2] += position
+                        t[3] += pnl or 0
+                    return totals
+
+                timings = []
+                for fn in [store.totals, store._recompute_totals, python_scan]:
+                    samples = []
+                    for _ in range(rounds if fn is store.totals else max(rounds // 10, 3)):
+                        start = time.perf_counter()
+                        fn()
+                        samples.append((time.perf_counter() - start) * 1000)
+                    timings.append(statistics.median(samples))
+
+                ids = [row[0] for row in conn.execute("SELECT id FROM stocks WHERE is_deleted = 0")]
+                updates = []
+                for with_triggers in [True, False]:
+                    if not with_triggers:
+                        # 对照组：去掉触发器再更新一遍
+                        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                                                    "AND name LIKE 'trg_totals_%'").fetchall():
+                            conn.execute(f"DROP TRIGGER {name}")
+                    rows = [(stock_id, round(random.uniform(5, 200), 2)) for stock_id in ids]
+                    start = time.perf_counter()
+                    store.update_prices(rows)
+                    updates.append(time.perf_counter() - start)
+                    if with_triggers:
+                        drifts += len(store.check_totals())
+
+        totals_ms, sql_ms, python_ms = (f"{t:.2f}ms" for t in timings)
+        print(f"{n:<10} {totals_ms:<10} {sql_ms:<10} {python_ms:<12} {f'{updates[0] * 1000:.0f}ms':<18} "
+              f"{f'{updates[1] * 1000:.0f}ms':<14}")
+    print("=" * 84)
+    print(f"批量更新：一个事务更新全部未删除持仓（约80%），更新后校验偏差 {drifts} 项")
+
+def bench_scenario(n_holdings=5000, n_scenarios=500, loop_scenarios=5):
+    """情景分析：冲击矩阵广播 vs 每个情景每只持仓逐个调用标量函数"""
+    import scenario
+    scenario.require_numpy()
+
+    print(f"📊 情景分析（{n_holdings} 只持仓 × {n_scenarios} 个情景）")
+    print("=" * 64)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = use_temp_db(tmpdir)
+        seed_stocks(db_path, n_holdings)
+        conn = stock_db.get_conn()
+        holdings, names, codes = scenario.load_holdings(conn)
+        stock_db.release_conn(conn)
+
+    tags = {f"行业{t}": codes[t::20] for t in range(20)}
+    items = []
+    for i in range(n_scenarios):
+        item = {"name": f"情景{i}", "shock": random.uniform(-20, 5)}
+        if i % 2:
+            item["tags"] = {f"行业{t}": random.uniform(-30, 10) for t in random.sample(range(20), 3)}
+        if i % 3 == 0:
+            item["codes"] = {random.choice(codes): random.uniform(-50, 0) for _ in range(10)}
+        items.append(item)
+    scenarios, tags = scenario.parse_scenarios({"tags": tags, "scenarios": items})
+
+    start = time.perf_counter()
+    shocks, _ = scenario.build_shocks(scenarios, codes, tags)
+    t_build = time.perf_counter() - start
+    start = time.perf_counter()
+    _, summary = scenario.run_scenarios(holdings, shocks)
+    t_run = time.perf_counter() - start
+
+    # 对照组：逐个情景、逐只持仓调用 calculate_* 和 get_simple_suggestion（只跑前几个情景再换算）
+    quantity, cost_price = holdings["quantity"].tolist(), holdings["cost_price"].tolist()
+    stop_loss, current_price = holdings["stop_loss"].tolist(), holdings["current_price"].tolist()
+    start = time.perf_counter()
+    for i in range(loop_scenarios):
+        change = 0.0
+        for j in range(n_holdings):
+            price = current_price[j] * (1 + shocks[i, j] / 100)
+            total_value = stock_db.calculate_total_value(quantity[j], price)
+            position = stock_db.calculate_position(total_value)
+            stock_db.calculate_pnl(price, cost_price[j], position, total_value)
+            stock_db.get_simple_suggestion(stock_db.auto_adjust_mode(position), price, stop_loss[j], position, None)
+            change += total_value - quantity[j] * current_price[j]
+        assert abs(change - summary["value_change"][i]) < 1e-6 * max(1.0, abs(change))
+    t_loop = (time.perf_counter() - start) / loop_scenarios * n_scenarios
+
+    print(f"构建冲击矩阵: {t_build * 1000:.1f}ms")
+    print(f"广播计算: {t_run * 1000:.1f}ms（{n_holdings * n_scenarios / t_run / 1e6:.1f}M 格/秒）")
+    print(f"逐个标量计算: 约 {t_loop:.2f}s（按前 {loop_scenarios} 个情景换算，结果一致）")
+    print(f"加速: {t_loop / (t_build + t_run):.0f}x")
+    print("=" * 64)
+
+def synthetic_portfolio(n, total_capital):
+    """合成持仓：价格5~300元，止损跌幅3%~30%；九成资金分散在各持仓上，一成持仓超过建议仓位，少量已跌穿止损"""
+    import numpy as np
+    rng = np.random.default_rng(7)
+    price = np.round(rng.uniform(5, 300, n), 2)
+    stop_loss = np.round(price * (1 - rng.uniform(0.03, 0.3, n)), 2)
+    suggested = 2 / ((1 - stop_loss / price) * 100) * 100
+    value = total_capital * 0.9 / n * rng.uniform(0.3, 1.7, n)
+    over = rng.random(n) < 0.1
+    value[over] = total_capital * suggested[over] / 100 * rng.uniform(1.1, 1.5, over.sum())
+    quantity = np.maximum(np.floor(value / price / 100) * 100, 100)
+    crossed = rng.random(n) < 0.03
+    price[crossed] = np.round(stop_loss[crossed] * 0.98, 2)
+    return {"id": np.arange(1, n + 1), "quantity": quantity, "stop_loss": stop_loss, "current_price": price}
+
+def bench_rebalance(sizes, rounds=20):
+    """调仓方案：合成组合上的耗时，并检查整手、止损上限和现金约束"""
+    import numpy as np
+    import rebalance
+
+    print(f"📊 调仓方案（合成组合，p50/{rounds} 次）")
+    print("=" * 84)
+    print(f"{'持仓数':<8} {'耗时p50':<10} {'调整只数':<10} {'卖出':<14} {'买入':<14} {'剩余现金':<12} {'约束':<6}")
+    print("-" * 84)
+    for n in sizes:
+        total_capital = 20000.0 * n
+        holdings = synthetic_portfolio(n, total_capital)
+        cash = total_capital * 0.1
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            plan = rebalance.plan_rebalance(holdings, total_capital, cash)
+            samples.append((time.perf_counter() - start) * 1000)
+
+        change = plan["change"]
+        price, stop_loss = holdings["current_price"], holdings["stop_loss"]
+        with np.errstate(divide="ignore"):
+            suggested = np.where(price > stop_loss, 2 / ((1 - stop_loss / price) * 100) * 100, 0)
+        limit = np.floor(total_capital * suggested / 100 / price / 100) * 100
+        bought = change > 0
+        ok = (np.all(change[bought] % 100 == 0)
+              and np.all(plan["target"][bought] <= limit[bought])
+              and np.all(plan["target"][change < 0] <= limit[change < 0])
+              and plan["spent"] <= (cash + plan["proceeds"]) * (1 + 1e-12))
+        print(f"{n:<8} {f'{statistics.median(samples):.2f}ms':<10} {int((change != 0).sum()):<10} "
+              f"{plan['proceeds']:<14.0f} {plan['spent']:<14.0f} {plan['remaining']:<12.0f} {'✅' if ok else '❌':<6}")
+    print("=" * 84)
+    print("约束：买入为整手、调整后不超过集中建议仓位、买入金额不超过 现金 + 卖出回收")
+
+def bench_profiling(sizes, rounds=20):
+    """分阶段计时的开销：同一条 列表 命令关闭/开启计时的耗时对比，并汇总各阶段占比"""
+    import profiling
+
+    print(f"📊 分阶段计时开销（列表，进程内 p50/{rounds} 次）")
+    print("=" * 96)
+    print(f"{'持仓数':<10} {'关闭':<10} {'开启':<10} {'开销':<8} {'connect':<10} {'sql':<10} {'compute':<10} {'render':<10}")
+    print("-" * 96)
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = use_temp_db(tmpdir)
+            seed_stocks(db_path, n)
+            log_path = os.path.join(tmpdir, "profile.jsonl")
+            timings = []
+            for target in [None, log_path]:
+                samples = []
+                for _ in range(rounds):
+                    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                        start = time.perf_counter()
+                        # 直接给出目标，不受当前环境变量影响
+                        profiling.configure(target or "0")
+                        profiling.run("列表", lambda: stock_db.run_command(["stock_db.py", "列表"]))
+                        samples.append((time.perf_counter() - start) * 1000)
+                timings.append(statistics.median(samples))
+            profiling.configure("0")
+            events, _ = profiling.load_events([log_path])
+            phases = {row["phase"]: row["p50"] for row in profiling.aggregate(events)}
+
+        off_ms, on_ms = timings
+        cells = (f"{phases.get(phase, 0):.2f}ms" for phase in ["connect", "sql", "compute", "render"])
+        print(f"{n:<10} {f'{off_ms:.2f}ms':<10} {f'{on_ms:.2f}ms':<10} {f'{(on_ms / off_ms - 1) * 100:+.1f}%':<8} "
+              + " ".join(f"{cell:<10}" for cell in cells))
+    print("=" * 96)
+    print("开启时每条SQL、每个阶段各记一行JSON；关闭时只多一次判断")
+
+def show_help():
+    """显示帮助"""
+    print("📊 股票风险控制策略 - 性能基准测试")
+    print("==============================")
+    print()
+    print("用法:")
+    print("  python3 benchmark.py 并发写入 [进程数] [每进程写入次数]   - 并发写入压力测试（默认8×200）")
+    print("  python3 benchmark.py 常驻服务 [次数]                     - 常驻服务往返延迟 vs 新进程（默认50次）")
+    print("  python3 benchmark.py 历史内存 [行数...]                  - 历史列表流式输出的内存峰值（默认1万/10万/100万行）")
+    print("  python3 benchmark.py 分页查询 [行数...]                  - 列表/历史分页查询延迟，加索引前后对比（默认1万/10万/100万行）")
+    print("  python3 benchmark.py 搜索 [持仓数]                       - 持有理由全文搜索延迟：FTS5 vs LIKE扫表（默认10万）")
+    print("  python3 benchmark.py 归档 [行数...]                      - 归档已删除持仓前后的列表/历史延迟、热表大小（默认10万/100万行）")
+    print("  python3 benchmark.py 导入 [行数...]                      - 导入券商持仓：分批按代码合并写入的吞吐和内存峰值（默认5万/20万行）")
+    print("  python3 benchmark.py 回溯 [交易笔数...]                  - 交易流水按时间点回溯：快照+有限重放 vs 从头重放（默认100万/1000万笔）")
+    print("  python3 benchmark.py 汇总 [行数...]                      - 持仓汇总：汇总表 vs 扫表，触发器开销（默认1万/10万行）")
+    print("  python3 benchmark.py 情景 [持仓数] [情景数]              - 情景分析：冲击矩阵广播 vs 逐个标量计算（默认5000只×500个）")
+    print("  python3 benchmark.py 调仓 [持仓数...]                    - 调仓方案耗时和约束检查（合成组合，默认500/5000只）")
+    print("  python3 benchmark.py 分阶段计时 [行数...]                - 列表命令开启/关闭分阶段计时的耗时和各阶段p50（默认1000/1万行）")
+    print("  python3 benchmark.py 持仓缓存 [持仓数...]                - 持仓缓存命中 vs 每次查询，其他连接写入后的重读（默认1000/1万只）")
+    print("  python3 benchmark.py 多组合 [组合数]                     - 多组合连接池的延迟和句柄峰值，汇总 全部组合 的并发读取（默认1000个）")
+    print("  python3 benchmark.py 重算 [持仓数]                       - 总资金重算：NumPy向量化 vs 逐行标量（默认10万）")
+    print("  python3 benchmark.py 持仓库 [持仓数] [次数]              - 持仓库进程内调用吞吐 vs 每次启动进程（默认1000只×2000次）")
+    print("  python3 benchmark.py 批量仓位 [行数]                       - 批量仓位计算吞吐：向量化 vs 逐行（默认100万行）")
+    print("  python3 benchmark.py 回测 [股票数] [年数]                  - 历史回测：CSV转换和回测耗时（默认5000只×10年）")
+    print("  python3 benchmark.py 风险模拟 [持仓数] [路径数]            - 组合风险模拟耗时：单进程 vs 进程池（默认200只×10万条路径）")
+    print("  python3 benchmark.py 行情接入 [代码数] [价格数]            - 行情接入：合并批量写入 vs 每个价格一个事务（默认2000×100万）")
+    print("  python3 benchmark.py 止损建议 [持仓数] [年数]            - 止损建议：增量滚动统计的写入开销，读统计 vs 扫日K线重算（默认2000只×3年）")
+    print("  python3 benchmark.py 止损监控 [代码数] [价格数]            - 止损监控回放：有序阈值 vs 全量重算（默认1万×100万）")
+    print("  python3 benchmark.py 行情 [持仓数] [年数]                - 价格历史最近N天查询延迟和压缩耗时（默认50只×5年）")
+    print()
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        show_help()
+        sys.exit(0)
+
+    command = sys.argv[1]
+
+    try:
+        if command in ["并发写入", "concurrent-writes"]:
+            processes = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+            writes = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+            bench_concurrent_writes(processes, writes)
+        elif command in ["常驻服务", "daemon"]:
+            rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+            bench_daemon(rounds)
+        elif command in ["历史内存", "history-memory"]:
+            sizes = [int(x) for x in sys.argv[2:]] or [10000, 100000, 1000000]
+            bench_history_memory(sizes)
+        elif command in ["分页查询", "pagination"]:
+            sizes = [int(x) for x in sys.argv[2:]] or [10000, 100000, 1000000]
+            bench_pagination(sizes)
+        elif command in ["搜索", "search"]:
+            n = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+            bench_search(n)
+        elif command in ["归档", "archive"]:
+            sizes = [int(x) for x in sys.argv[2:]] or [100000, 1000000]
+            bench_archive(sizes)
+        elif command in ["导入", "import"]:
+            sizes = [int(x) for x in sys.argv[2:]] or [50000, 200000]
+            bench_import(sizes)
+        elif command in ["回溯", "as-of"]:
+            sizes = [int(x) for x in sys.argv[2:]] or [1000000, 10000000]
+            bench_ledger(sizes)
+        elif command in ["汇总", "summary"]:
+            sizes = [int(x) for x in sys.argv[2:]] or [10000, 100000]
+            bench_summary(sizes)
+        elif command in ["情景", "scenario"]:
+            n_holdings = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+            n_scenarios = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+            bench_scenario(n_holdings, n_scenarios)
+        elif command in ["调仓", "rebalance"]:
+            sizes = [int(x) for x in sys.argv[2:]] or [500, 5000]
+            bench_rebalance(sizes)
+        elif command in ["分阶段计时", "profiling"]:
+            sizes = [int(x) for x in sys.argv[2:]] or [1000, 10000]
+            bench_profiling(sizes)
+        elif command in ["持仓缓存", "holdings-cache"]:
+            sizes = [int(x) for x in sys.argv[2:]] or [1000, 10000]
+            bench_holdings_cache(sizes)
+        elif command in ["多组合", "portfolios"]:
+            n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+            bench_portfolios(n)
+        elif command in ["重算", "recompute"]:
+            n = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+            bench_recompute(n)
+        elif command in ["持仓库", "store"]:
+            n_stocks = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+            ops = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+            bench_store(n_stocks, ops)
+        elif command in ["批量仓位", "batch-size"]:
+            n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+            bench_batch_sizing(n)
+        elif command in ["回测", "backtest"]:
+            n_symbols = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+            years = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+            bench_backtest(n_symbols, years)
+        elif command in ["风险模拟", "simulate"]:
+            n_holdings = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+            paths = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+            bench_risk_sim(n_holdings, paths)
+        elif command in ["行情接入", "ingest"]:
+            n_stocks = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+            n_ticks = int(sys.argv[3]) if len(sys.argv) > 3 else 1000000
+            bench_ingest(n_stocks, n_ticks)
+        elif command in ["止损建议", "stop-suggest"]:
+            n_stocks = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+            years = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+            bench_stop_suggest(n_stocks, years)
+        elif command in ["止损监控", "watch-stops"]:
+            n_symbols = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+            n_ticks = int(sys.argv[3]) if len(sys.argv) > 3 else 1000000
+            bench_stop_watcher(n_symbols, n_ticks)
+        elif command in ["行情", "prices"]:
+            n_stocks = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+            years = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+            bench_price_history(n_stocks, years)
+        else:
+            print(f"❌ 未知命令: {command}")
+            print()
+            show_help()
+            sys.exit(1)
+    except ValueError as e:
+        print(f"❌ 参数错误: {e}")
+        sys.exit(1)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 导入券商持仓
+逐行读取券商导出的持仓（CSV/XLSX），按列映射取出名称、代码、数量、成本价、现价等字段，
+每攒够 batch 行校验一次，在一个事务里按代码合并写入（PortfolioStore.upsert_many）：
+代码已有未删除持仓的更新，没有的新增；格式错误或写不进去的行连同原因写到拒绝文件，内存占用与文件大小无关
+
+列映射（JSON，可选，没写的字段用 DEFAULT_COLUMNS 里的常见列名）：
+    {
+      "columns": {"code": "证券代码", "quantity": ["股票余额", "实际数量"], "current_price": "市价"},
+      "encoding": "gbk", "delimiter": "\\t", "sheet": "持仓", "code_digits": 6
+    }
+必需：代码、名称、数量、现价；成本价、止损价、持有理由可选（没有时保留原值，新持仓按 --stop-pct 设置止损）
+XLSX 需要 openpyxl（只读模式逐行读取）
+"""
+
+import io
+import sys
+import csv
+import json
+import time
+
+import stock_db
+
+# 字段 → 可能的列名（按顺序取第一个出现的）
+DEFAULT_COLUMNS = {
+    "code": ["证券代码", "股票代码", "代码", "code"],
+    "name": ["证券名称", "股票名称", "名称", "name"],
+    "quantity": ["股票余额", "持仓数量", "持股数量", "实际数量", "当前持仓", "证券数量", "数量", "quantity"],
+    "cost_price": ["成本价", "参考成本价", "摊薄成本价", "持仓成本", "买入成本", "cost_price"],
+    "current_price": ["市价", "最新价", "当前价", "现价", "current_price"],
+    "stop_loss": ["止损价", "stop_loss"],
+    "hold_reason": ["持有理由", "备注", "hold_reason"],
+}
+REQUIRED_FIELDS = ("code", "name", "quantity", "current_price")
+
+FIELD_NAMES = {"code": "代码", "name": "名称", "quantity": "数量", "cost_price": "成本价",
+               "current_price": "现价", "stop_loss": "止损价", "hold_reason": "持有理由"}
+
+# 每个事务写入的行数
+DEFAULT_BATCH = 5000
+
+# 新持仓没有止损价时，止损价 = 成本价 × (1 - DEFAULT_STOP_PCT%)
+DEFAULT_STOP_PCT = 8
+
+# A股代码位数：纯数字代码不足位数时补前导0（Excel 会把 000016 存成 16）
+DEFAULT_CODE_DIGITS = 6
+
+# 表头不一定在第一行（券商导出前面常有账户信息），在前多少行里找
+HEADER_SCAN_ROWS = 20
+
+# 判断 CSV 编码和分隔符时看文件开头多少字节
+SNIFF_BYTES = 1 << 16
+
+# 导入期间的页缓存（KB）：每批几千行随机改动几个仓位索引，默认 2MB 缓存会反复换页
+IMPORT_CACHE_KB = 65536
+
+def load_mapping(path=None):
+    """读取列映射文件，和默认列名合并；path 为 None 时只用默认列名"""
+    mapping = {}
+    if path:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            mapping = json.load(f)
+        if not isinstance(mapping, dict):
+            raise ValueError("列映射文件应为 JSON 对象")
+    columns = {field: list(names) for field, names in DEFAULT_COLUMNS.items()}
+    for field, names in mapping.get("columns", {}).items():
+        if field not in DEFAULT_COLUMNS:
+            raise ValueError(f"列映射里有未知字段: {field}（可用: {', '.join(DEFAULT_COLUMNS)}）")
+        columns[field] = [names] if isinstance(names, str) else list(names)
+    return dict(mapping, columns=columns)
+
+def _sniff(binary, encoding=None, delimiter=None):
+    """看文件开头判断编码（UTF-8，否则按 GB18030）和分隔符"""
+    sample = binary.peek(SNIFF_BYTES)[:SNIFF_BYTES]
+    if encoding is None:
+        try:
+            # 取样可能正好截断在一个多字节字符中间：只有末尾出错时仍按 UTF-8
+            sample.decode("utf-8")
+            encoding = "utf-8-sig"
+        except UnicodeDecodeError as e:
+            encoding = "utf-8-sig" if e.start >= len(sample) - 3 else "gb18030"
+    if delimiter is None:
+        first_lines = sample.decode(encoding, "ignore").splitlines()[:HEADER_SCAN_ROWS]
+        counts = {d: sum(line.count(d) for line in first_lines) for d in [",", "\t", ";"]}
+        delimiter = max(counts, key=counts.get) if any(counts.values()) else ","
+    return encoding, delimiter
+
+def read_csv_rows(source, encoding=None, delimiter=None):
+    """逐行读取 CSV（'-' 表示stdin），产出 (行号, [单元格...])"""
+    binary = sys.stdin.buffer if source in (None, "-") else open(source, "rb")
+    try:
+        encoding, delimiter = _sniff(binary, encoding, delimiter)
+        text = io.TextIOWrapper(binary, encoding=encoding, newline="")
+        try:
+            yield from enumerate(csv.reader(text, delimiter=delimiter), 1)
+        finally:
+            text.detach()
+    finally:
+        if binary is not sys.stdin.buffer:
+            binary.close()
+
+def read_xlsx_rows(source, sheet=None):
+    """逐行读取 XLSX（openpyxl 只读模式，不把整个表读进内存），产出 (行号, [单元格...])"""
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("读取 XLSX 需要安装 openpyxl：pip install openpyxl（或另存为 CSV）")
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        for line_no, row in enumerate(worksheet.iter_rows(values_only=True), 1):
+            yield line_no, list(row)
+    finally:
+        workbook.close()
+
+def read_rows(source, mapping):
+    """按扩展名选择读取方式"""
+    if str(source).lower().endswith((".xlsx", ".xlsm")):
+        return read_xlsx_rows(source, mapping.get("sheet"))
+    return read_csv_rows(source, mapping.get("encoding"), mapping.get("delimiter"))
+
+def _cell_text(cell):
+    if cell is None:
+        return ""
+    if isinstance(cell, float) and cell.is_integer():
+        cell = int(cell)
+    return str(cell).strip()
+
+def find_header(cells, columns):
+    """表头行 → {字段: 列下标}；缺少必需列时返回 None"""
+    names = [_cell_text(cell) for cell in cells]
+    index = {}
+    for field, candidates in columns.items():
+        for candidate in candidates:
+            if candidate in names:
+                index[field] = names.index(candidate)
+                break
+    if any(field not in index for field in REQUIRED_FIELDS):
+        return None
+    return index
+
+def _number(cell, field):
+    """单元格 → 数字（去掉千分位逗号、货币符号）；空单元格返回 None"""
+    if cell is None:
+        return None
+    try:
+        # 大多数单元格是普通数字（float 会忽略首尾空白）
+        return float(cell)
+    except ValueError:
+        pass
+    except TypeError:
+        # XLSX 里的日期、时间单元格落在数字列：和其他不是数字的单元格一样拒绝这一行，不中断导入
+        raise ValueError(f"{FIELD_NAMES[field]}不是数字: {_cell_text(cell)}")
+    text = cell.strip().replace(",", "").replace("¥", "").replace("元", "")
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"{FIELD_NAMES[field]}不是数字: {cell.strip()}")
+
+def _code(cell, digits):
+    """单元格 → 代码：去掉 Excel 的文本前缀（'000016 / ="000016"），纯数字补足位数"""
+    code = cell.strip() if isinstance(cell, str) else _cell_text(cell)
+    if code[:1] in ("=", "'"):
+        code = code[2:-1] if code.startswith('="') and code.endswith('"') else code.lstrip("'")
+        code = code.strip()
+    if digits and len(code) < digits and code.isdigit():
+        code = code.zfill(digits)
+    return code
+
+def parse_row(cells, index, code_digits=DEFAULT_CODE_DIGITS):
+    """一行 → (名称, 代码, 数量, 成本价, 止损价, 现价, 持有理由)；不合格时抛 ValueError（原因）
+
+    index: find_header 的结果 {字段: 列下标}
+    """
+    width = len(cells)
+    values = {field: cells[i] if i < width else None for field, i in index.items()}
+    code = _code(values["code"], code_digits)
+    name = _cell_text(values["name"])
+    if not code:
+        raise ValueError("缺少代码")
+    if not name:
+        raise ValueError("缺少名称")
+    quantity = _number(values["quantity"], "quantity")
+    current_price = _number(values["current_price"], "current_price")
+    cost_price = _number(values.get("cost_price"), "cost_price")
+    stop_loss = _number(values.get("stop_loss"), "stop_loss")
+    if quantity is None or quantity <= 0:
+        raise ValueError("数量必须大于0" if quantity is not None else "缺少数量")
+    if current_price is None or current_price <= 0:
+        raise ValueError("现价必须大于0" if current_price is not None else "缺少现价")
+    if cost_price is not None and cost_price <= 0:
+        raise ValueError("成本价必须大于0")
+    if stop_loss is not None and stop_loss <= 0:
+        raise ValueError("止损价必须大于0")
+    return name, code, quantity, cost_price, stop_loss, current_price, _cell_text(values.get("hold_reason")) or None
+
+class RejectWriter:
+    """拒绝文件（CSV）：行号、原因 + 原始各列；第一次有被拒绝的行时才创建"""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def write(self, line_no, reason, cells):
+        if self._writer is None:
+            self._file = open(self.path, "w", encoding="utf-8-sig", newline="")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(["行号", "原因"] + [_cell_text(cell) for cell in self.header])
+        self._writer.writerow([line_no, reason] + [_cell_text(cell) for cell in cells])
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+def default_rejects_path(source):
+    return "import_rejects.csv" if source in (None, "-") else f"{source}.rejects.csv"
+
+def import_rows(store, rows, mapping, batch=DEFAULT_BATCH, total_capital=None, stop_pct=DEFAULT_STOP_PCT,
+                rejects_path="import_rejects.csv"):
+    """导入 (行号, [单元格...]) 流，返回统计 dict
+
+    每 batch 行：逐行解析校验，再一个事务 upsert_many；解析失败和 upsert 拒绝的行都写入拒绝文件
+    """
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "rejected": 0, "duplicates": 0, "batches": 0}
+    rows = iter(rows)
+    index = header = None
+    for line_no, cells in rows:
+        if line_no > HEADER_SCAN_ROWS:
+            break
+        index = find_header(cells, mapping["columns"])
+        if index is not None:
+            header = cells
+            break
+    if index is None:
+        required = "、".join(mapping["columns"][field][0] for field in REQUIRED_FIELDS)
+        raise ValueError(f"前 {HEADER_SCAN_ROWS} 行里没找到表头（需要列：{required}），可以用 --mapping 指定列名")
+
+    stats["has_stop_loss"] = "stop_loss" in index
+    code_digits = mapping.get("code_digits", DEFAULT_CODE_DIGITS)
+    rejects = RejectWriter(rejects_path, header)
+
+    def _flush(chunk, sources):
+        inserted, updated, rejected = store.upsert_many(chunk, total_capital, stop_pct)
+        for i, reason in rejected:
+            line_no, cells = sources[i]
+            rejects.write(line_no, reason, cells)
+        stats["inserted"] += inserted
+        stats["updated"] += updated
+        stats["duplicates"] += len(chunk) - inserted - updated - len(rejected)
+        stats["batches"] += 1
+
+    cache_size = store.conn.execute("PRAGMA cache_size").fetchone()[0]
+    store.conn.execute(f"PRAGMA cache_size = -{IMPORT_CACHE_KB}")
+    try:
+        chunk, sources = [], []
+        for line_no, cells in rows:
+            try:
+                chunk.append(parse_row(cells, index, code_digits))
+                sources.append((line_no, cells))
+            except ValueError as e:
+                # 空行（和只有空白的行）直接跳过，不算拒绝
+                if not any(_cell_text(cell) for cell in cells):
+                    continue
+                rejects.write(line_no, str(e), cells)
+            stats["rows"] += 1
+            if len(chunk) >= batch:
+                _flush(chunk, sources)
+                chunk, sources = [], []
+        if chunk:
+            _flush(chunk, sources)
+    finally:
+        store.conn.execute(f"PRAGMA cache_size = {cache_size}")
+        rejects.close()
+    stats["rejected"] = rejects.count
+    return stats
+
+def import_file(source, mapping_path=None, batch=DEFAULT_BATCH, total_capital=None,
+                stop_pct=DEFAULT_STOP_PCT, rejects_path=None):
+    """导入命令入口"""
+    mapping = load_mapping(mapping_path)
+    rejects_path = rejects_path or default_rejects_path(source)
+    conn = stock_db.get_conn()
+    start = time.perf_counter()
+    try:
+        stats = import_rows(stock_db.open_store(conn, total_capital), read_rows(source, mapping), mapping, batch,
+                            total_capital, stop_pct, rejects_path)
+    finally:
+        stock_db.release_conn(conn)
+    elapsed = time.perf_counter() - start
+
+    print(f"✅ 导入完成！读取 {stats['rows']} 行：新增 {stats['inserted']} 只，更新 {stats['updated']} 只"
+          f"（{stats['batches']} 个事务，每个最多 {batch} 行）")
+    print(f"   耗时: {elapsed:.2f}s（{stats['rows'] / elapsed if elapsed > 0 else 0:.0f} 行/秒）")
+    if stats["duplicates"]:
+        print(f"   ⚠️ 同一批里代码重复: {stats['duplicates']} 行（以后面的为准）")
+    if stats["rejected"]:
+        print(f"   ⚠️ 拒绝 {stats['rejected']} 行，原因见: {rejects_path}")
+    if stats["inserted"] and not stats["has_stop_loss"]:
+        print(f"   💡 文件里没有止损价列，新持仓的止损价按成本价下方 {stop_pct:g}% 设置（--stop-pct 调整）")
+    return stats
@@ -1,11 +1,11 @@
 -- 股票风险控制策略 - 数据库初始化脚本
--- SQLite数据库（v3，新增持有理由字段）
+-- SQLite数据库（基础表结构，之后的结构变更见 stock_db.py 的 MIGRATIONS，版本号记录在 PRAGMA user_version）
 
 CREATE TABLE IF NOT EXISTS stocks (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT NOT NULL,
     code TEXT,
-    mode TEXT NOT NULL CHECK(mode IN ('2%集中', '2%分散')),
+    mode TEXT NOT NULL CHECK(mode IN ('集中', '2%集中', '2%分散')),
     quantity REAL NOT NULL,  -- 持有数量（股/份）
     position REAL NOT NULL,
     total_value REAL NOT NULL,
@@ -21,5 +21,8 @@ CREATE TABLE IF NOT EXISTS stocks (
     deleted_at TIMESTAMP
 );
 
-CREATE INDEX IF NOT EXISTS idx_stocks_is_deleted ON stocks(is_deleted);
 CREATE INDEX IF NOT EXISTS idx_stocks_created_at ON stocks(created_at);
+
+-- 列表/历史按 (仓位 DESC, id) 排序和键集分页，直接走索引，不再全表扫描+排序
+CREATE INDEX IF NOT EXISTS idx_stocks_live_position ON stocks(is_deleted, position DESC, id);
+CREATE INDEX IF NOT EXISTS idx_stocks_position ON stocks(position DESC, id);
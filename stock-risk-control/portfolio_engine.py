@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 向量化重算引擎
+总资金变化后，用NumPy数组一次性重算所有持仓的个股市值、仓位、盈亏、模式和建议，并批量写回数据库
+规则与 stock_db 中的 calculate_* / auto_adjust_mode / get_simple_suggestion 完全一致
+"""
+
+import sys
+import time
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+import stock_db
+
+# 建议代码（数组里存代码，需要展示时再转文字）
+SUGGEST_NONE = 0
+SUGGEST_CLEAR = 1
+SUGGEST_WATCH_STOP = 2
+SUGGEST_OBSERVE = 3
+SUGGEST_REDUCE = 4
+SUGGEST_ADD_REASON = 5
+SUGGEST_HOLD = 6
+
+SUGGESTION_LABELS = ["-", "🆘 清仓", "⚠️ 注意", "👀 观察", "⚠️ 降低仓位", "📝 补充理由", "✅ 持有"]
+
+def require_numpy():
+    """未安装NumPy时给出提示并退出"""
+    if not NUMPY_AVAILABLE:
+        print("❌ 需要安装 NumPy：pip install numpy")
+        sys.exit(1)
+
+def load_holdings(conn):
+    """读取全部持仓的计算字段，返回按列组织的数组
+
+    +is_deleted 让SQLite按rowid顺序扫表，不走仓位索引再回表排序
+    """
+    rows = conn.execute("""
+        SELECT id, quantity, IFNULL(cost_price, 0), IFNULL(stop_loss, 0), current_price,
+               hold_reason IS NOT NULL AND TRIM(hold_reason) != ''
+        FROM stocks
+        WHERE +is_deleted = 0
+        ORDER BY id
+    """).fetchall()
+    if not rows:
+        return {"id": np.zeros(0, dtype=np.int64)}
+    ids, quantity, cost_price, stop_loss, current_price, has_reason = zip(*rows)
+    return {
+        "id": np.array(ids, dtype=np.int64),
+        "quantity": np.array(quantity, dtype=np.float64),
+        "cost_price": np.array(cost_price, dtype=np.float64),
+        "stop_loss": np.array(stop_loss, dtype=np.float64),
+        "current_price": np.array(current_price, dtype=np.float64),
+        "has_reason": np.array(has_reason, dtype=bool),
+    }
+
+def compute(holdings, total_capital=stock_db.DEFAULT_TOTAL_CAPITAL):
+    """向量化计算个股市值、仓位、盈亏、模式和建议"""
+    quantity = holdings["quantity"]
+    cost_price = holdings["cost_price"]
+    stop_loss = holdings["stop_loss"]
+    current_price = holdings["current_price"]
+
+    total_value = quantity * current_price
+    position = total_value / total_capital * 100
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pnl_percent = np.where(cost_price > 0, (current_price - cost_price) / cost_price * 100, 0.0)
+        # 离止损价的距离（%）和集中建议仓位（%），公式与标量函数逐字一致，保证边界上结果相同
+        drop_to_stop = (current_price - stop_loss) / current_price * 100
+        suggested_position = 2 / ((1 - stop_loss / current_price) * 100) * 100
+    pnl = total_value * (pnl_percent / 100)
+    # 仓位≤2% → 分散，否则集中
+    is_diversified = position <= 2
+
+    # 按 get_simple_suggestion 的判断顺序，从后往前覆盖
+    suggestion = np.where(holdings["has_reason"], SUGGEST_HOLD, SUGGEST_ADD_REASON)
+    suggestion = np.where(position > suggested_position, SUGGEST_REDUCE, suggestion)
+    suggestion = np.where(is_diversified, SUGGEST_OBSERVE, suggestion)
+    suggestion = np.where(drop_to_stop <= 10, SUGGEST_WATCH_STOP, suggestion)
+    suggestion = np.where(current_price <= stop_loss, SUGGEST_CLEAR, suggestion)
+    suggestion = np.where(stop_loss <= 0, SUGGEST_NONE, suggestion).astype(np.int8)
+
+    return {
+        "total_value": total_value,
+        "position": position,
+        "pnl": pnl,
+        "pnl_percent": pnl_percent,
+        "is_diversified": is_diversified,
+        "suggestion": suggestion,
+        "suggested_position": suggested_position,
+    }
+
+def suggestion_text(code, suggested_position):
+    """建议代码 → 与 get_simple_suggestion 相同的文字"""
+    if code == SUGGEST_REDUCE:
+        return f"⚠️ 降低到{suggested_position:.1f}%"
+    return SUGGESTION_LABELS[code]
+
+def write_back(conn, holdings, result, total_capital):
+    """一个事务内批量写回重算结果，同时保存总资金（之后的添加、更新按它算仓位）"""
+    params = []
+    if result is not None:
+        modes = np.where(result["is_diversified"], "2%分散", "集中")
+        params = zip(result["total_value"].tolist(), result["position"].tolist(), modes.tolist(),
+                     result["pnl"].tolist(), result["pnl_percent"].tolist(), holdings["id"].tolist())
+
+    def _write(cursor):
+        stock_db.save_total_capital(cursor, total_capital)
+        return cursor.executemany("""
+            UPDATE stocks
+            SET total_value = ?, position = ?, mode = ?,
+                pnl = ?, pnl_percent = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, params).rowcount
+
+    return stock_db.run_write(conn, _write)
+
+def recompute_portfolio(total_capital=None, dry_run=False):
+    """按新的总资金重算全部持仓并写回（总资金一起保存），返回 (holdings, result, 耗时秒)
+
+    total_capital 为 None 时用组合保存的总资金
+    """
+    require_numpy()
+    start = time.perf_counter()
+    conn = stock_db.get_conn()
+    try:
+        if total_capital is None:
+            total_capital = stock_db.load_total_capital(conn)
+        holdings = load_holdings(conn)
+        result = compute(holdings, total_capital) if len(holdings["id"]) else None
+        if not dry_run:
+            write_back(conn, holdings, result, total_capital)
+    finally:
+        stock_db.release_conn(conn)
+    return holdings, result, time.perf_counter() - start
+
+def print_recompute_summary(holdings, result, total_capital, elapsed, dry_run=False):
+    """输出重算结果汇总"""
+    if result is None:
+        print("📭 暂无持仓股票")
+        return
+    n = len(holdings["id"])
+    diversified = int(result["is_diversified"].sum())
+    print(f"✅ 重算{'预览' if dry_run else '完成'}！共 {n} 只持仓（总资金：{total_capital:.0f}元）")
+    print(f"   总市值: {result['total_value'].sum():.0f}元")
+    print(f"   总仓位: {result['position'].sum():.1f}%")
+    print(f"   总盈亏: {result['pnl'].sum():+.0f}元")
+    print(f"   模式: 集中 {n - diversified} 只，分散 {diversified} 只")
+    counts = np.bincount(result["suggestion"], minlength=len(SUGGESTION_LABELS))
+    summary = "，".join(f"{SUGGESTION_LABELS[code]} {count}" for code, count in enumerate(counts) if count)
+    print(f"   建议: {summary}")
+    print(f"   耗时: {elapsed * 1000:.1f}ms")
@@ -0,0 +1,1077 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 持仓库（可嵌入的Python接口）
+PortfolioStore 持有一个数据库连接，增删改查都返回记录对象（Holding / Sizing），不输出、不退出进程，
+其他服务可以直接在进程内调用；stock_db.py 的命令只负责解析参数和输出结果
+
+    from portfolio_store import PortfolioStore
+    with PortfolioStore("portfolio.db", total_capital=600000) as store:
+        holding = store.add("上证50", "000016", 200, 2457, 2457, 2960)
+        store.update_prices([("000016", 2980)], by_code=True)
+        for holding in store.holdings():
+            print(holding.name, holding.position, holding.suggestion)
+"""
+
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+import stock_db
+
+# 持仓记录读取的字段（顺序与 Holding 的字段一致）
+HOLDING_COLUMNS = ("id", "name", "code", "mode", "quantity", "position", "total_value", "cost_price",
+                   "stop_loss", "current_price", "hold_reason", "pnl", "pnl_percent", "is_deleted", "deleted_at")
+
+_SELECT_COLUMNS = ", ".join(HOLDING_COLUMNS)
+
+@dataclass
+class Holding:
+    """一只持仓：数据库字段 + 按当前数据算出的建议（与列表里的“建议”列相同）"""
+    __slots__ = HOLDING_COLUMNS + ("suggestion",)
+    id: int
+    name: str
+    code: str
+    mode: str
+    quantity: float
+    position: float
+    total_value: float
+    cost_price: float
+    stop_loss: float
+    current_price: float
+    hold_reason: str
+    pnl: float
+    pnl_percent: float
+    is_deleted: int
+    deleted_at: str
+    suggestion: str
+
+    @classmethod
+    def from_row(cls, row):
+        """数据库行（HOLDING_COLUMNS 顺序）→ Holding"""
+        holding = cls(*row, None)
+        holding.suggestion = stock_db.get_simple_suggestion(holding.mode, holding.current_price, holding.stop_loss,
+                                                            holding.position, holding.hold_reason)
+        return holding
+
+    def to_dict(self):
+        return asdict(self)
+
+@dataclass
+class Sizing:
+    """集中仓位计算结果（与 calculate_concentrated 相同的公式）"""
+    __slots__ = ("current_price", "stop_loss", "target_risk", "stop_loss_drop_pct", "position_pct", "mode")
+    current_price: float
+    stop_loss: float
+    target_risk: float
+    stop_loss_drop_pct: float
+    position_pct: float
+    mode: str
+
+    def to_dict(self):
+        return asdict(self)
+
+@dataclass
+class ModeTotals:
+    """一个模式下未删除持仓的汇总（portfolio_totals 的一行）"""
+    __slots__ = ("mode", "holdings", "total_value", "position", "pnl")
+    mode: str
+    holdings: int
+    total_value: float
+    position: float
+    pnl: float
+
+@dataclass
+class TotalsDrift:
+    """汇总表与重新计算结果不一致的一项"""
+    __slots__ = ("mode", "field", "stored", "actual")
+    mode: str
+    field: str
+    stored: float
+    actual: float
+
+@dataclass
+class SearchHit:
+    """按持有理由搜索到的一只持仓：score 为 BM25 相关度（越大越相关），snippet 为匹配片段"""
+    __slots__ = ("id", "name", "code", "position", "is_deleted", "archived", "score", "snippet")
+    id: int
+    name: str
+    code: str
+    position: float
+    is_deleted: int
+    archived: bool
+    score: float
+    snippet: str
+
+    def to_dict(self):
+        return asdict(self)
+
+@dataclass
+class LedgerPosition:
+    """按交易流水回溯出的某个时间点的一只持仓（成本价为加权平均，可能为空）"""
+    __slots__ = ("stock_id", "name", "code", "quantity", "cost_price")
+    stock_id: int
+    name: str
+    code: str
+    quantity: float
+    cost_price: float
+
+    def to_dict(self):
+        return asdict(self)
+
+@dataclass
+class StopSuggestion:
+    """一只持仓的止损建议：按滚动统计（最近 volatility.STATS_WINDOW 个交易日）算出的 ATR、波动率和建议止损价
+
+    atr 为元，volatility 为年化%，mae 为最低价低于成本价的幅度%，stop_atr 为当前止损距离是几个ATR；
+    价格记录不足 volatility.MIN_STATS_DAYS 天时这些字段和建议都为空；ATR 为0（价格一直不动）时 stop_atr 和建议都为空
+    """
+    __slots__ = ("stock_id", "name", "code", "current_price", "stop_loss", "position", "days", "atr", "volatility",
+                 "mae", "stop_atr", "suggested_stop", "suggested_position")
+    stock_id: int
+    name: str
+    code: str
+    current_price: float
+    stop_loss: float
+    position: float
+    days: int
+    atr: float
+    volatility: float
+    mae: float
+    stop_atr: float
+    suggested_stop: float
+    suggested_position: float
+
+    def to_dict(self):
+        return asdict(self)
+
+# 搜索：默认返回条数；参与排序的候选上限（最近加入的命中）；片段最多多少个字；片段里标记匹配的符号
+SEARCH_LIMIT = 20
+SEARCH_CANDIDATES = 50
+SNIPPET_CHARS = 24
+SNIPPET_MARKS = ("【", "】")
+
+# BM25 参数（与 FTS5 bm25() 相同）
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def search_terms(query):
+    """关键词 → 规范化后的词列表：只保留字母数字并转小写（与索引的分字规则一致）
+
+    没有可搜索的字时抛 ValueError
+    """
+    terms = []
+    for term in query.split():
+        term = "".join(ch for ch in term if ch.isalnum()).lower()
+        if term and term not in terms:
+            terms.append(term)
+    if not terms:
+        raise ValueError("关键词里没有可搜索的文字")
+    return terms
+
+def match_expression(query):
+    """关键词 → FTS5 查询（索引规则见 stock_db.reason_tokens），空格分隔的多个关键词要同时命中
+
+    单字查前缀（"药"*），两字以上查相邻两字组成的短语（"国产 产替 替代"）
+    """
+    phrases = []
+    for term in search_terms(query):
+        if len(term) == 1:
+            phrases.append(f'"{term}"*')
+        else:
+            phrases.append('"' + " ".join(term[i:i + 2] for i in range(len(term) - 1)) + '"')
+    return " ".join(phrases)
+
+def _occurrences(text, term):
+    """term 在 text 里每次出现的起始位置"""
+    found = []
+    start = text.find(term)
+    while start >= 0:
+        found.append(start)
+        start = text.find(term, start + 1)
+    return found
+
+def _snippet(text, spans):
+    """原文里截取第一个匹配附近的 SNIPPET_CHARS 个字，匹配部分加标记
+
+    spans 为匹配的 (起, 止) 下标；相邻或重叠的匹配合并成一段
+    """
+    marked = []
+    for start, end in sorted(spans):
+        if marked and start <= marked[-1][1]:
+            marked[-1][1] = max(marked[-1][1], end)
+        else:
+            marked.append([start, end])
+    left = max(min(marked[0][0] - SNIPPET_CHARS // 4, len(text) - SNIPPET_CHARS), 0)
+    right = min(left + SNIPPET_CHARS, len(text))
+    parts = ["…"] if left > 0 else []
+    pos = left
+    for start, end in marked:
+        if start >= right:
+            break
+        start, end = max(start, pos), min(end, right)
+        parts += [text[pos:start], SNIPPET_MARKS[0], text[start:end], SNIPPET_MARKS[1]]
+        pos = end
+    parts.append(text[pos:right])
+    if right < len(text):
+        parts.append("…")
+    return "".join(parts)
+
+# 汇总字段；校验时浮点字段允许的相对误差（触发器逐行加减会累积舍入误差）
+TOTALS_FIELDS = ("holdings", "total_value", "position", "pnl")
+TOTALS_TOLERANCE = 1e-6
+
+# 持仓缓存：最多缓存几份持仓列表（每个连接的 列表/历史 各一份）；行数可能超过多少的不缓存（照常分页查询）
+HOLDINGS_CACHE_SIZE = 8
+HOLDINGS_CACHE_MAX_ROWS = 100000
+
+# 归档：删除超过多少天的持仓搬到 stocks_archive；每个事务搬多少行（批次之间释放写锁）
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_BATCH = 5000
+
+# 增量VACUUM：空闲页超过总页数的多少%才回收；每个事务回收多少页
+VACUUM_MIN_FREE_PCT = 10
+VACUUM_CHUNK_PAGES = 2000
+
+# 每条 IN (...) 查询最多带多少个代码/id（SQLite 参数个数有上限）
+LOOKUP_CHUNK = 500
+
+# 交易流水：可以记的交易类型；每积累多少笔交易存一次持仓快照（回溯最多重放约这么多笔，持仓只数更多时按只数）；
+# 数量小于此值视为清仓
+TRADE_KINDS = ("买入", "卖出")
+SNAPSHOT_EVERY = 5000
+QUANTITY_EPSILON = 1e-9
+
+# 成交时间的上下界（回溯不限时间时用）
+_TS_MIN, _TS_MAX = -(2 ** 63), 2 ** 63 - 1
+
+def size_position(current_price, stop_loss, target_risk=2):
+    """集中建议仓位 = 目标风险 / 止损跌幅，返回 Sizing；止损价不小于现价时抛 ValueError"""
+    if current_price <= 0:
+        raise ValueError("现价必须大于0")
+    stop_loss_drop = 1 - stop_loss / current_price
+    if stop_loss_drop <= 0:
+        raise ValueError("止损价必须小于现价")
+    position_pct = target_risk / (stop_loss_drop * 100) * 100
+    return Sizing(current_price, stop_loss, target_risk, stop_loss_drop * 100, position_pct,
+                  stock_db.auto_adjust_mode(position_pct))
+
+def apply_trade(quantity, cost_price, kind, trade_quantity, price):
+    """(持有数量, 成本价) 经过一笔交易之后的 (持有数量, 成本价)，price 单位为元（可以为 None）
+
+    买入按加权平均摊成本，卖出不改成本价，卖光后成本价清空，校正直接取校正后的数量和成本价；
+    卖出超过持有数量时抛 ValueError
+    """
+    if kind == "校正":
+        return trade_quantity, price
+    if kind == "买入":
+        total = quantity + trade_quantity
+        if quantity <= QUANTITY_EPSILON:
+            return total, price
+        if cost_price is None or price is None:
+            return total, None
+        return total, (quantity * cost_price + trade_quantity * price) / total
+    left = quantity - trade_quantity
+    if left < -QUANTITY_EPSILON:
+        raise ValueError(f"卖出 {trade_quantity:g} 超过持有数量 {quantity:g}")
+    return (0.0, None) if left <= QUANTITY_EPSILON else (left, cost_price)
+
+def _replay(state, rows):
+    """按顺序把交易 [(stock_id, 类型, 数量, 价格×PRICE_SCALE), ...] 重放到 state {stock_id: (数量, 成本价)} 上"""
+    scale = stock_db.PRICE_SCALE
+    for stock_id, kind, quantity, price in rows:
+        held, cost_price = state.get(stock_id, (0.0, None))
+        state[stock_id] = apply_trade(held, cost_price, kind, quantity, None if price is None else price / scale)
+    return state
+
+class HoldingsCache:
+    """进程内的持仓列表缓存（Holding 已算好建议），按连接和 列表/历史 分开，LRU
+
+    取用前比较连接的 PRAGMA data_version（其他连接、其他进程提交写入后会变）和 total_changes（本连接的写入），
+    都没变就直接返回缓存的列表，代价是一次 PRAGMA。data_version 只在同一个连接上可比，所以按连接对象缓存
+    （连接对象不支持弱引用，被淘汰之前会一直被引用）
+    """
+
+    def __init__(self, size=HOLDINGS_CACHE_SIZE, max_rows=HOLDINGS_CACHE_MAX_ROWS):
+        self.size = size
+        self.max_rows = max_rows
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _lookup(self, conn, key):
+        """返回 (缓存键, 当前版本, 有效的缓存列表或None)，同时记命中/未命中"""
+        token = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+        entry_key = (conn, key)
+        entry = self._entries.get(entry_key)
+        if entry is not None and entry[0] == token:
+            self._entries.move_to_end(entry_key)
+            self.stats["hits"] += 1
+            return entry_key, token, entry[1]
+        self.stats["misses"] += 1
+        return entry_key, token, None
+
+    def get(self, conn, key, load):
+        """缓存有效时返回缓存的列表，否则调用 load() 读取并缓存；load() 返回 None 表示不适合缓存，原样返回
+
+        连接在事务中（写入可能回滚）时直接 load()，不读也不存缓存
+        """
+        if conn.in_transaction:
+            return load()
+        entry_key, token, value = self._lookup(conn, key)
+        if value is not None:
+            return value
+        value = load()
+        if value is None:
+            self._entries.pop(entry_key, None)
+            return None
+        self._entries[entry_key] = (token, value)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+        return value
+
+    def peek(self, conn, key):
+        """只取有效的缓存，没有时返回 None（不加载）"""
+        if conn.in_transaction:
+            return None
+        return self._lookup(conn, key)[2]
+
+    def discard(self, conn):
+        """丢掉某个连接的全部条目（连接关闭时）"""
+        for entry_key in [k for k in self._entries if k[0] is conn]:
+            del self._entries[entry_key]
+
+    def clear(self):
+        self._entries.clear()
+
+# 进程内共享的持仓缓存（常驻进程的命令行持仓库默认使用）
+HOLDINGS_CACHE = HoldingsCache()
+
+def _after_index(book, after):
+    """按 (仓位 DESC, id) 排好序的持仓列表里，排在 after=(仓位, id) 之后的第一只的下标"""
+    position, stock_id = after
+    lo, hi = 0, len(book)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        holding = book[mid]
+        if holding.position > position or (holding.position == position and holding.id <= stock_id):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+class PortfolioStore:
+    """持仓库：一个连接上的增删改查和批量方法
+
+    找不到（或已删除）的持仓返回 None，批量方法另外返回找不到的 id/代码 列表；
+    写入都走 stock_db.run_write（一个事务、锁冲突自动重试）
+    """
+
+    def __init__(self, db_path=None, total_capital=None, conn=None, cache=None):
+        # total_capital：算仓位用的总资金，None 时用组合保存的总资金（重算时保存，见 stock_db.load_total_capital）
+        # conn：借用调用方的连接（不负责关闭），否则自己打开 db_path（默认当前组合，见 stock_db.use_portfolio）
+        # cache：HoldingsCache（长期运行的进程传 HOLDINGS_CACHE），holdings() 在数据库没有变化时不再查询
+        self.total_capital = total_capital
+        self.cache = cache
+        self._owns_conn = conn is None
+        self.conn = stock_db.open_db(db_path or stock_db.current_db_path(), verbose=False) if conn is None else conn
+
+    def close(self):
+        if self._owns_conn and self.conn is not None:
+            self.conn.close()
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ---- 读取 ----
+
+    def get(self, stock_id, include_deleted=False):
+        """按ID读取一只持仓（include_deleted 时也查归档表）"""
+        row = self.conn.execute(f"""
+            SELECT {_SELECT_COLUMNS} FROM stocks
+            WHERE id = ? {"" if include_deleted else "AND is_deleted = 0"}
+        """, (stock_id,)).fetchone()
+        if row is None and include_deleted:
+            row = self.conn.execute(f"SELECT {_SELECT_COLUMNS} FROM stocks_archive WHERE id = ?",
+                                    (stock_id,)).fetchone()
+        return Holding.from_row(row) if row else None
+
+    def find(self, code):
+        """按代码读取持仓（同一代码可能有多只）"""
+        rows = self.conn.execute(f"""
+            SELECT {_SELECT_COLUMNS} FROM stocks
+            WHERE code = ? AND is_deleted = 0
+            ORDER BY id
+        """, (code,))
+        return [Holding.from_row(row) for row in rows]
+
+    def _load_book(self, show_deleted):
+        """全部持仓（缓存用），行数可能超过缓存上限时返回 None"""
+        if show_deleted:
+            # id 在两张表之间不重复，行数不超过最大id
+            bound = self.conn.execute("""
+                SELECT MAX((SELECT IFNULL(MAX(id), 0) FROM stocks), (SELECT IFNULL(MAX(id), 0) FROM stocks_archive))
+            """).fetchone()[0]
+        else:
+            bound = self.conn.execute("SELECT TOTAL(holdings) FROM portfolio_totals").fetchone()[0]
+        if bound > self.cache.max_rows:
+            return None
+        sql, params = stock_db.build_list_query(show_deleted, columns=_SELECT_COLUMNS)
+        return [Holding.from_row(row) for row in self.conn.execute(sql, params)]
+
+    def holdings(self, show_deleted=False, limit=None, after=None):
+        """按 (仓位 DESC, id) 排序的持仓列表，limit/after 与列表命令的键集分页相同
+
+        有缓存时整份列表缓存起来，分页直接在缓存上切（返回的 Holding 是共享的，不要修改）；
+        缓存失效时只有不分页的读取才重新加载整份列表，分页照常查一页
+        """
+        book = None
+        if self.cache is not None and limit:
+            book = self.cache.peek(self.conn, show_deleted)
+        elif self.cache is not None:
+            book = self.cache.get(self.conn, show_deleted, lambda: self._load_book(show_deleted))
+        if book is not None:
+            start = 0 if after is None else _after_index(book, after)
+            return book[start:start + limit] if limit else book[start:]
+        sql, params = stock_db.build_list_query(show_deleted, limit, after, _SELECT_COLUMNS)
+        holdings = [Holding.from_row(row) for row in self.conn.execute(sql, params)]
+        return holdings[:limit] if limit else holdings
+
+    def search(self, query, include_deleted=False, limit=SEARCH_LIMIT):
+        """按持有理由全文搜索，返回 ([SearchHit, ...], 命中是否超过候选上限)
+
+        FTS5 按 rowid 倒序取最近加入的 SEARCH_CANDIDATES 条（不少于 limit）命中，再在这些候选里按 BM25 排序、截取片段；
+        不用 bm25()/snippet() 是因为它们要先扫一遍全部命中（常见词上万行时要几十毫秒）。
+        多个关键词时各词权重相同（候选都同时含有全部关键词）。
+        include_deleted 时也搜索已删除和已归档的持仓
+        """
+        terms = search_terms(query)
+        window = max(SEARCH_CANDIDATES, limit)
+        if include_deleted:
+            columns = """IFNULL(s.id, a.id), IFNULL(s.name, a.name), IFNULL(s.code, a.code),
+                         IFNULL(s.position, a.position), IFNULL(s.is_deleted, 1), s.id IS NULL,
+                         IFNULL(s.hold_reason, a.hold_reason)"""
+            source = """reason_fts
+                LEFT JOIN stocks s ON s.id = reason_fts.rowid
+                LEFT JOIN stocks_archive a ON a.id = reason_fts.rowid AND s.id IS NULL"""
+            live = ""
+        else:
+            columns = "s.id, s.name, s.code, s.position, s.is_deleted, 0, s.hold_reason"
+            source = "reason_fts JOIN stocks s ON s.id = reason_fts.rowid"
+            live = "AND s.is_deleted = 0"
+        rows = self.conn.execute(f"""
+            SELECT {columns}
+            FROM {source}
+            WHERE reason_fts MATCH ? {live}
+            ORDER BY reason_fts.rowid DESC
+            LIMIT ?
+        """, (match_expression(query), window + 1)).fetchall()
+        more = len(rows) > window
+        # 关键词不含标点，直接在原文（转小写）里数出现次数即可，与索引的匹配规则一致
+        candidates = [(row, (row[-1] or "").lower()) for row in rows[:window]]
+        if not candidates:
+            return [], False
+
+        avgdl = sum(len(text) for _, text in candidates) / len(candidates)
+        scored = []
+        for row, text in candidates:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * len(text) / avgdl)
+            score = 0.0
+            for term in terms:
+                tf = text.count(term)
+                score += tf * (BM25_K1 + 1) / (tf + norm)
+            scored.append((score, row, text))
+        # 同分时较新的在前（候选本来就按 rowid 倒序，sort 是稳定的）
+        scored.sort(key=lambda item: -item[0])
+
+        hits = []
+        for score, row, text in scored[:limit]:
+            stock_id, name, code, position, is_deleted, archived, reason = row
+            spans = [(start, start + len(term)) for term in terms for start in _occurrences(text, term)]
+            snippet = _snippet(reason, spans) if spans else ""
+            hits.append(SearchHit(stock_id, name, code, position, is_deleted, bool(archived), score, snippet))
+        return hits, more
+
+    # ---- 写入 ----
+
+    def capital(self, total_capital=None):
+        """这次写入用的总资金：参数 > 构造时给的 > 组合保存的"""
+        return total_capital or self.total_capital or stock_db.load_total_capital(self.conn)
+
+    def _valuation(self, quantity, cost_price, current_price, total_capital):
+        """(个股市值, 仓位, 模式, 盈亏, 盈亏%)，规则与命令行相同；total_capital 为 capital() 的结果"""
+        total_value = stock_db.calculate_total_value(quantity, current_price)
+        position = stock_db.calculate_position(total_value, total_capital)
+        pnl, pnl_percent = stock_db.calculate_pnl(current_price, cost_price, position, total_value)
+        return total_value, position, stock_db.auto_adjust_mode(position), pnl, pnl_percent
+
+    def _select(self, cursor, stock_id):
+        cursor.execute(f"SELECT {_SELECT_COLUMNS} FROM stocks WHERE id = ?", (stock_id,))
+        return Holding.from_row(cursor.fetchone())
+
+    def add(self, name, code, quantity, cost_price, stop_loss, current_price, hold_reason=None,
+            total_capital=None):
+        """添加一只持仓（模式按仓位自动确定），返回 Holding"""
+        return self.add_many([(name, code, quantity, cost_price, stop_loss, current_price, hold_reason)],
+                             total_capital)[0]
+
+    def add_many(self, rows, total_capital=None):
+        """一个事务添加多只持仓
+
+        rows: [(名称, 代码, 数量, 成本价, 止损价, 现价[, 持有理由]), ...]，返回 [Holding, ...]
+        """
+        total_capital = self.capital(total_capital)
+        params = []
+        for row in rows:
+            name, code, quantity, cost_price, stop_loss, current_price = row[:6]
+            hold_reason = row[6] if len(row) > 6 else None
+            total_value, position, mode, pnl, pnl_percent = self._valuation(quantity, cost_price, current_price,
+                                                                             total_capital)
+            params.append((name, code, mode, quantity, position, total_value, cost_price, stop_loss,
+                           current_price, hold_reason, pnl, pnl_percent))
+
+        def _insert(cursor):
+            ids = []
+            for values in params:
+                cursor.execute("""
+                    INSERT INTO stocks (name, code, mode, quantity, position, total_value,
+                                       cost_price, stop_loss, current_price, hold_reason, pnl, pnl_percent)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, values)
+                ids.append(cursor.lastrowid)
+            stock_db.append_prices(cursor, [(stock_id, values[8]) for stock_id, values in zip(ids, params)])
+            now = int(time.time())
+            self._append_trades(cursor, [(stock_id, now, "校正", values[3], values[6], "添加")
+                                         for stock_id, values in zip(ids, params)])
+            self._snapshot(cursor)
+            return [self._select(cursor, stock_id) for stock_id in ids]
+
+        return stock_db.run_write(self.conn, _insert)
+
+    def _live_by_code(self, cursor, codes):
+        """{代码: [(id, 数量, 成本价), ...]}：这些代码下未删除的持仓
+
+        指定走 idx_stocks_live_code：只有 is_deleted = 0 一个等值条件时规划器会选 idx_stocks_live_position 扫全部持仓
+        """
+        found = {}
+        for start in range(0, len(codes), LOOKUP_CHUNK):
+            part = codes[start:start + LOOKUP_CHUNK]
+            cursor.execute(f"""
+                SELECT id, code, quantity, cost_price FROM stocks INDEXED BY idx_stocks_live_code
+                WHERE code IN ({", ".join("?" * len(part))}) AND is_deleted = 0
+            """, part)
+            for stock_id, code, quantity, cost_price in cursor.fetchall():
+                found.setdefault(code, []).append((stock_id, quantity, cost_price))
+        return found
+
+    def upsert_many(self, rows, total_capital=None, stop_pct=None, ts=None):
+        """一个事务按代码合并写入：代码已有未删除持仓的更新，没有的新增
+
+        rows: [(名称, 代码, 数量, 成本价, 止损价, 现价, 持有理由), ...]；成本价/止损价/持有理由为 None 时保留原值，
+        同一代码出现多次时后面的为准。新增的持仓没有止损价时取 成本价（没有则现价）× (1 - stop_pct%)，
+        stop_pct 也为 None 则拒绝。数量或成本价有变化的记一笔校正到交易流水（成交时间为 ts）。
+        返回 (新增数, 更新数, [(rows下标, 原因), ...])
+        """
+        latest = {row[1]: i for i, row in enumerate(rows)}
+        trade_ts = int(time.time() if ts is None else ts)
+
+        def _upsert(cursor):
+            capital = self.capital(total_capital)
+            existing = self._live_by_code(cursor, list(latest))
+            updates, inserts, rejected, trades = [], [], [], []
+            for code, i in latest.items():
+                name, _, quantity, cost_price, stop_loss, current_price, hold_reason = rows[i]
+                matched = existing.get(code)
+                if matched and len(matched) > 1:
+                    rejected.append((i, f"代码 {code} 有 {len(matched)} 只未删除持仓，不知道更新哪一只"))
+                    continue
+                if matched:
+                    stock_id, old_quantity, old_cost = matched[0]
+                    cost_price = old_cost if cost_price is None else cost_price
+                    if quantity != old_quantity or cost_price != old_cost:
+                        trades.append((stock_id, trade_ts, "校正", quantity, cost_price, "导入"))
+                    valuation = self._valuation(quantity, cost_price, current_price, capital)
+                    updates.append((name, quantity, cost_price, stop_loss, current_price, hold_reason or None,
+                                    *valuation, stock_id))
+                    continue
+                if stop_loss is None:
+                    if stop_pct is None:
+                        rejected.append((i, "新持仓缺少止损价"))
+                        continue
+                    stop_loss = round((cost_price or current_price) * (1 - stop_pct / 100), 4)
+                total_value, position, mode, pnl, pnl_percent = self._valuation(quantity, cost_price, current_price,
+                                                                                 capital)
+                inserts.append((name, code, mode, quantity, position, total_value, cost_price, stop_loss,
+                                current_price, hold_reason or None, pnl, pnl_percent))
+
+            # 按 id 顺序写，相邻的行多在同一页
+            updates.sort(key=lambda values: values[-1])
+            cursor.executemany("""
+                UPDATE stocks
+                SET name = ?, quantity = ?, cost_price = ?, stop_loss = IFNULL(?, stop_loss), current_price = ?,
+                    hold_reason = IFNULL(?, hold_reason),
+                    total_value = ?, position = ?, mode = ?,
+                    pnl = ?, pnl_percent = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, updates)
+            cursor.executemany("""
+                INSERT INTO stocks (name, code, mode, quantity, position, total_value,
+                                   cost_price, stop_loss, current_price, hold_reason, pnl, pnl_percent)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, inserts)
+            prices = [(values[-1], values[4]) for values in updates]
+            if inserts:
+                inserted = self._live_by_code(cursor, [values[1] for values in inserts])
+                for values in inserts:
+                    stock_id = inserted[values[1]][0][0]
+                    prices.append((stock_id, values[8]))
+                    trades.append((stock_id, trade_ts, "校正", values[3], values[6], "导入"))
+            stock_db.append_prices(cursor, prices, ts)
+            self._append_trades(cursor, trades)
+            self._snapshot(cursor)
+            return len(inserts), len(updates), rejected
+
+        return stock_db.run_write(self.conn, _upsert)
+
+    def update(self, stock_id, current_price, hold_reason=None, total_capital=None):
+        """更新现价（和持有理由），重新计算个股市值、仓位、盈亏和模式，返回更新后的 Holding"""
+        def _update(cursor):
+            # 在写事务内读取，避免并发写入时基于过期数据计算
+            cursor.execute("""
+                SELECT cost_price, quantity
+                FROM stocks
+                WHERE id = ? AND is_deleted = 0
+            """, (stock_id,))
+            stock = cursor.fetchone()
+            if not stock:
+                return None
+            cost_price, quantity = stock
+            total_value, position, mode, pnl, pnl_percent = self._valuation(quantity, cost_price, current_price,
+                                                                             self.capital(total_capital))
+            cursor.execute("""
+                UPDATE stocks
+                SET current_price = ?, hold_reason = IFNULL(?, hold_reason),
+                    total_value = ?, position = ?, mode = ?,
+                    pnl = ?, pnl_percent = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (current_price, hold_reason or None, total_value, position, mode, pnl, pnl_percent, stock_id))
+            stock_db.append_prices(cursor, [(stock_id, current_price)])
+            return self._select(cursor, stock_id)
+
+        return stock_db.run_write(self.conn, _update)
+
+    def update_prices(self, rows, by_code=False, total_capital=None, ts=None):
+        """一个事务批量更新现价，rows: [(id或代码, 现价[, 价格时间]), ...]
+
+        ts为没带价格时间的行用的时间（Unix秒，默认当前时间）；行情接入每个代码带自己的价格时间
+
+        返回 (已更新条数, 找不到的id/代码列表)
+        """
+        def _bulk_update(cursor):
+            # 一次性读出所有持仓，避免逐条SELECT
+            cursor.execute("""
+                SELECT id, code, cost_price, quantity
+                FROM stocks
+                WHERE is_deleted = 0
+            """)
+            holdings = {}
+            for stock_id, code, cost_price, quantity in cursor.fetchall():
+                key = code if by_code else stock_id
+                holdings.setdefault(key, []).append((stock_id, cost_price, quantity))
+
+            capital = self.capital(total_capital)
+            params, prices = [], []
+            missing = []
+            for key, current_price, *row_ts in rows:
+                matched = holdings.get(key)
+                if not matched:
+                    missing.append(key)
+                    continue
+                for stock_id, cost_price, quantity in matched:
+                    total_value, position, mode, pnl, pnl_percent = self._valuation(quantity, cost_price,
+                                                                                     current_price, capital)
+                    params.append((current_price, total_value, position, mode, pnl, pnl_percent, stock_id))
+                    prices.append((stock_id, current_price, row_ts[0] if row_ts else None))
+
+            cursor.executemany("""
+                UPDATE stocks
+                SET current_price = ?,
+                    total_value = ?, position = ?, mode = ?,
+                    pnl = ?, pnl_percent = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, params)
+            stock_db.append_prices(cursor, prices, ts)
+            return len(params), missing
+
+        return stock_db.run_write(self.conn, _bulk_update)
+
+    def delete(self, stock_id):
+        """软删除一只持仓，返回删除后的 Holding（is_deleted=1）"""
+        deleted, _ = self.delete_many([stock_id])
+        return deleted[0] if deleted else None
+
+    def delete_many(self, stock_ids):
+        """一个事务软删除多只持仓（交易流水里记一笔清零），返回 ([Holding, ...], 找不到的id列表)"""
+        def _delete(cursor):
+            deleted = []
+            missing = []
+            for stock_id in stock_ids:
+                cursor.execute("""
+                    UPDATE stocks
+                    SET is_deleted = 1, deleted_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND is_deleted = 0
+                """, (stock_id,))
+                if cursor.rowcount:
+                    deleted.append(self._select(cursor, stock_id))
+                else:
+                    missing.append(stock_id)
+            now = int(time.time())
+            self._append_trades(cursor, [(holding.id, now, "校正", 0, None, "删除") for holding in deleted])
+            self._snapshot(cursor)
+            return deleted, missing
+
+        return stock_db.run_write(self.conn, _delete)
+
+    # ---- 交易流水 ----
+
+    def _append_trades(self, cursor, trades):
+        """追加交易 [(stock_id, 成交时间, 类型, 数量, 价格(元，可以为None), 备注), ...]"""
+        scale = stock_db.PRICE_SCALE
+        cursor.executemany("""
+            INSERT INTO trades (stock_id, ts, kind, quantity, price, note) VALUES (?, ?, ?, ?, ?, ?)
+        """, [(stock_id, ts, kind, quantity, None if price is None else round(price * scale), note)
+              for stock_id, ts, kind, quantity, price, note in trades])
+
+    def _snapshot(self, cursor, every=SNAPSHOT_EVERY):
+        """最近的快照之后积累了足够多的交易时补存快照，返回新存的快照数
+
+        间隔为 every 和当前持仓只数中较大的一个（每个快照要写一遍全部持仓，摊到每笔交易不超过一行）；
+        每次写入后都会调用，平时只是两次索引查找；快照边界对齐到成交时间，同一秒的交易不会被拆开
+        """
+        latest = cursor.execute("SELECT id, ts, trade_id FROM trade_snapshots ORDER BY ts DESC LIMIT 1").fetchone()
+        snapshot_id, since, last_id = latest or (None, _TS_MIN, 0)
+        every = max(every, int(cursor.execute("SELECT TOTAL(holdings) FROM portfolio_totals").fetchone()[0]))
+        # 流水只追加、id 连续，快照之后的交易至少有这么多笔（补录会让快照作废，不会漏算）
+        if (cursor.execute("SELECT MAX(id) FROM trades").fetchone()[0] or 0) - last_id < every:
+            return 0
+        state = {}
+        if snapshot_id is not None:
+            cursor.execute("SELECT stock_id, quantity, cost_price FROM snapshot_positions WHERE snapshot_id = ?",
+                           (snapshot_id,))
+            state = {stock_id: (quantity, cost_price) for stock_id, quantity, cost_price in cursor.fetchall()}
+
+        def _save(ts, trade_id):
+            cursor.execute("INSERT INTO trade_snapshots (ts, trade_id) VALUES (?, ?)", (ts, trade_id))
+            snapshot_id = cursor.lastrowid
+            cursor.executemany("INSERT INTO snapshot_positions VALUES (?, ?, ?, ?)",
+                               [(snapshot_id, stock_id, quantity, cost_price)
+                                for stock_id, (quantity, cost_price) in state.items() if quantity > QUANTITY_EPSILON])
+
+        saved = count = 0
+        boundary = None
+        scale = stock_db.PRICE_SCALE
+        # 另开一个游标流式读取，不把全部交易读进内存
+        for trade_id, stock_id, ts, kind, quantity, price in self.conn.execute("""
+            SELECT id, stock_id, ts, kind, quantity, price FROM trades WHERE ts > ? ORDER BY ts, id
+        """, (since,)):
+            if boundary is not None and ts != boundary:
+                _save(boundary, last_id)
+                saved += 1
+                count, boundary = 0, None
+            held, cost_price = state.get(stock_id, (0.0, None))
+            state[stock_id] = apply_trade(held, cost_price, kind, quantity, None if price is None else price / scale)
+            last_id = max(last_id, trade_id)
+            count += 1
+            if count >= every:
+                boundary = ts
+        if boundary is not None:
+            _save(boundary, last_id)
+            saved += 1
+        return saved
+
+    def take_snapshots(self, every=SNAPSHOT_EVERY):
+        """补存快照，返回新存的快照数（写入时会自动调用，直接往 trades 批量写入之后才需要手动调用）"""
+        return stock_db.run_write(self.conn, lambda cursor: self._snapshot(cursor, every))
+
+    def _ledger_state(self, cursor, until=None, stock_ids=None):
+        """{stock_id: (持有数量, 成本价)}：成交时间不晚于 until（Unix秒，None为不限）的交易重放后的持仓
+
+        从 until 之前最近的快照开始，只重放快照之后的交易；stock_ids 只算这几只（走 idx_trades_stock）
+        """
+        until = _TS_MAX if until is None else int(until)
+        snapshot = cursor.execute("SELECT id, ts FROM trade_snapshots WHERE ts <= ? ORDER BY ts DESC LIMIT 1",
+                                  (until,)).fetchone()
+        snapshot_id, since = snapshot or (None, _TS_MIN)
+        state = {}
+        if stock_ids is None:
+            if snapshot_id is not None:
+                cursor.execute("SELECT stock_id, quantity, cost_price FROM snapshot_positions WHERE snapshot_id = ?",
+                               (snapshot_id,))
+                state = {stock_id: (quantity, cost_price) for stock_id, quantity, cost_price in cursor.fetchall()}
+            return _replay(state, cursor.execute("""
+                SELECT stock_id, kind, quantity, price FROM trades
+                WHERE ts > ? AND ts <= ?
+                ORDER BY ts, id
+            """, (since, until)).fetchall())
+        for stock_id in stock_ids:
+            if snapshot_id is not None:
+                row = cursor.execute("""
+                    SELECT quantity, cost_price FROM snapshot_positions WHERE snapshot_id = ? AND stock_id = ?
+                """, (snapshot_id, stock_id)).fetchone()
+                if row:
+                    state[stock_id] = row
+            _replay(state, cursor.execute("""
+                SELECT stock_id, kind, quantity, price FROM trades
+                WHERE stock_id = ? AND ts > ? AND ts <= ?
+                ORDER BY ts, id
+            """, (stock_id, since, until)).fetchall())
+        return state
+
+    def _names(self, cursor, stock_ids):
+        """{stock_id: (名称, 代码)}，已归档的持仓也查"""
+        names = {}
+        for table in ("stocks", "stocks_archive"):
+            missing = [stock_id for stock_id in stock_ids if stock_id not in names]
+            for start in range(0, len(missing), LOOKUP_CHUNK):
+                part = missing[start:start + LOOKUP_CHUNK]
+                cursor.execute(f"SELECT id, name, code FROM {table} WHERE id IN ({', '.join('?' * len(part))})", part)
+                names.update((stock_id, (name, code)) for stock_id, name, code in cursor.fetchall())
+        return names
+
+    def positions_at(self, ts=None, stock_id=None):
+        """某个时间点（Unix秒，None为最新）的持仓，按交易流水回溯，返回 [LedgerPosition, ...]（按 stock_id 排序）
+
+        代价是读一个快照 + 重放快照之后的交易（最多约 SNAPSHOT_EVERY 笔），与流水总长度无关；
+        已删除、已归档的持仓在删除之前的时间点照样能查到
+        """
+        cursor = self.conn.cursor()
+        # 快照和之后的交易在同一个读事务里读，中间有补录（快照作废重建）也不会对不上
+        own_read = not self.conn.in_transaction
+        if own_read:
+            cursor.execute("BEGIN")
+        try:
+            state = self._ledger_state(cursor, ts, None if stock_id is None else [stock_id])
+            held = sorted((stock_id, quantity, cost_price) for stock_id, (quantity, cost_price) in state.items()
+                          if quantity > QUANTITY_EPSILON)
+            names = self._names(cursor, [row[0] for row in held])
+        finally:
+            if own_read:
+                self.conn.rollback()
+        return [LedgerPosition(stock_id, *names.get(stock_id, (None, None)), quantity, cost_price)
+                for stock_id, quantity, cost_price in held]
+
+    def trade(self, stock_id, kind, quantity, price, ts=None, note=None, total_capital=None):
+        """记一笔买入/卖出，按流水重新推出这只持仓的数量和成本价，返回更新后的 Holding（找不到或已删除返回 None）
+
+        ts 为成交时间（Unix秒，默认当前时间），可以补录之前的交易；卖光时持仓软删除。
+        卖出超过当时的持有数量、或补录之后让后面的卖出超量时抛 ValueError（不写入）；
+        校正（添加/导入）直接设定数量和成本价，早于这只持仓最近一次校正的交易会被它覆盖，也抛 ValueError
+        """
+        if kind not in TRADE_KINDS:
+            raise ValueError(f"交易类型必须是 {'/'.join(TRADE_KINDS)}")
+        if quantity <= 0 or price <= 0:
+            raise ValueError("数量和价格必须大于0")
+        ts = int(time.time() if ts is None else ts)
+
+        def _trade(cursor):
+            cursor.execute("""
+                SELECT quantity, cost_price, current_price, CAST(strftime('%s', created_at) AS INTEGER)
+                FROM stocks
+                WHERE id = ? AND is_deleted = 0
+            """, (stock_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            old_quantity, old_cost, current_price, created_ts = row
+            if not cursor.execute("SELECT 1 FROM trades WHERE stock_id = ? LIMIT 1", (stock_id,)).fetchone():
+                # 没有流水的持仓（直接写库的数据）：先按当前数量、成本价补一笔期初校正
+                self._append_trades(cursor, [(stock_id, min(ts, created_ts or ts), "校正", old_quantity, old_cost,
+                                              "期初")])
+            corrected_ts, corrected_note = cursor.execute("""
+                SELECT ts, note FROM trades WHERE stock_id = ? AND kind = '校正' ORDER BY ts DESC, id DESC LIMIT 1
+            """, (stock_id,)).fetchone()
+            if ts < corrected_ts:
+                import trade_ledger
+                raise ValueError(f"成交时间早于最近一次校正（{trade_ledger.format_time(corrected_ts)}"
+                                 f"{' ' + corrected_note if corrected_note else ''}），校正按当时的数量和成本价重新设定持仓，"
+                                 "更早的交易不会生效（持仓有出入时重新导入）")
+            self._append_trades(cursor, [(stock_id, ts, kind, quantity, price, note)])
+            held, cost_price = self._ledger_state(cursor, stock_ids=[stock_id]).get(stock_id, (0.0, None))
+            cleared = held <= QUANTITY_EPSILON
+            if cleared:
+                # 卖光：数量清零，成本价保留最后的值方便在历史里查看
+                held, cost_price = 0.0, old_cost
+            total_value, position, mode, pnl, pnl_percent = self._valuation(held, cost_price, current_price,
+                                                                             self.capital(total_capital))
+            cursor.execute("""
+                UPDATE stocks
+                SET quantity = ?, cost_price = ?,
+                    total_value = ?, position = ?, mode = ?,
+                    pnl = ?, pnl_percent = ?, updated_at = CURRENT_TIMESTAMP,
+                    is_deleted = ?, deleted_at = CASE WHEN ? THEN CURRENT_TIMESTAMP END
+                WHERE id = ?
+            """, (held, cost_price, total_value, position, mode, pnl, pnl_percent, int(cleared), cleared, stock_id))
+            self._snapshot(cursor)
+            return self._select(cursor, stock_id)
+
+        return stock_db.run_write(self.conn, _trade)
+
+    # ---- 止损建议 ----
+
+    def stop_suggestions(self, stock_id=None, atr_multiple=None, target_risk=2):
+        """按滚动统计给未删除持仓（或指定的一只）算止损建议，返回 [StopSuggestion, ...]（按仓位从高到低）
+
+        每只持仓只读 price_stats 的一行，与价格历史长短无关；建议止损 = 现价 - atr_multiple × ATR，
+        建议仓位为这个止损价下的集中仓位（target_risk% 原则）
+        """
+        import volatility
+        atr_multiple = volatility.STOP_ATR_MULTIPLE if atr_multiple is None else atr_multiple
+        where = "s.is_deleted = 0" if stock_id is None else "s.id = ? AND s.is_deleted = 0"
+        rows = self.conn.execute(f"""
+            SELECT s.id, s.name, s.code, s.current_price, s.stop_loss, s.cost_price, s.position,
+                   {', '.join('p.' + c for c in volatility.RollingStats.COLUMNS)}
+            FROM stocks s LEFT JOIN price_stats p ON p.stock_id = s.id
+            WHERE {where}
+            ORDER BY s.position DESC, s.id
+        """, () if stock_id is None else (stock_id,)).fetchall()
+
+        suggestions = []
+        for sid, name, code, current_price, stop_loss, cost_price, position, *stats_row in rows:
+            suggestion = StopSuggestion(sid, name, code, current_price, stop_loss, position,
+                                        0, None, None, None, None, None, None)
+            suggestions.append(suggestion)
+            if stats_row[0] is None:
+                continue
+            stats = volatility.RollingStats.from_row(stats_row)
+            atr, daily_vol, suggestion.days = stats.current()
+            if suggestion.days < volatility.MIN_STATS_DAYS or not current_price or current_price <= 0:
+                continue
+            suggestion.atr = atr
+            if daily_vol is not None:
+                suggestion.volatility = daily_vol * math.sqrt(volatility.TRADING_DAYS) * 100
+            trough = stats.trough / stock_db.PRICE_SCALE
+            if cost_price:
+                suggestion.mae = max(0.0, (cost_price - trough) / cost_price * 100)
+            if atr > 0 and stop_loss:
+                suggestion.stop_atr = (current_price - stop_loss) / atr
+            suggested_stop = current_price - atr_multiple * atr
+            if atr > 0 and suggested_stop > 0:
+                suggestion.suggested_stop = suggested_stop
+                suggestion.suggested_position = size_position(current_price, suggested_stop, target_risk).position_pct
+        return suggestions
+
+    # ---- 归档 ----
+
+    def archivable(self, older_than_days=ARCHIVE_AFTER_DAYS):
+        """删除超过 older_than_days 天、还在 stocks 里的行数"""
+        return self.conn.execute("""
+            SELECT COUNT(*) FROM stocks
+            WHERE is_deleted = 1 AND deleted_at <= datetime('now', ?)
+        """, (f"-{older_than_days:g} days",)).fetchone()[0]
+
+    def archive(self, older_than_days=ARCHIVE_AFTER_DAYS, batch=ARCHIVE_BATCH):
+        """把删除超过 older_than_days 天的持仓整行搬到 stocks_archive，每批一个事务，返回搬走的行数
+
+        已删除的行不在 portfolio_totals 里，搬走不影响汇总；历史 会同时查两张表
+        """
+        columns = ", ".join(stock_db.STOCK_COLUMNS)
+
+        def _archive_batch(cursor):
+            # 指定部分索引：否则会走 (is_deleted, position) 索引读出全部已删除行再排序，每批都重来一遍
+            ids = [row[0] for row in cursor.execute("""
+                SELECT id FROM stocks INDEXED BY idx_stocks_deleted_at
+                WHERE is_deleted = 1 AND deleted_at <= datetime('now', ?)
+                ORDER BY deleted_at
+                LIMIT ?
+            """, (f"-{older_than_days:g} days", batch))]
+            if ids:
+                placeholders = ", ".join("?" * len(ids))
+                cursor.execute(f"""
+                    INSERT OR REPLACE INTO stocks_archive ({columns})
+                    SELECT {columns} FROM stocks WHERE id IN ({placeholders})
+                """, ids)
+                cursor.execute(f"DELETE FROM stocks WHERE id IN ({placeholders})", ids)
+            return len(ids)
+
+        archived = 0
+        while True:
+            moved = stock_db.run_write(self.conn, _archive_batch)
+            archived += moved
+            if moved < batch:
+                return archived
+
+    def free_pages(self):
+        """(空闲页数, 总页数)"""
+        return (self.conn.execute("PRAGMA freelist_count").fetchone()[0],
+                self.conn.execute("PRAGMA page_count").fetchone()[0])
+
+    def vacuum(self, min_free_pct=VACUUM_MIN_FREE_PCT, chunk_pages=VACUUM_CHUNK_PAGES):
+        """增量VACUUM：空闲页占比达到 min_free_pct 时，每个事务回收 chunk_pages 页，直到回收完，返回回收的页数
+
+        数据库没有开启 auto_vacuum=INCREMENTAL 时什么都不做（返回0）
+        """
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        free, total = self.free_pages()
+        if free == 0 or free * 100 < min_free_pct * total:
+            return 0
+
+        def _vacuum_chunk(cursor):
+            # 每回收一页返回一行，要读完才会全部执行
+            cursor.execute(f"PRAGMA incremental_vacuum({int(chunk_pages)})").fetchall()
+            return self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+        remaining = free
+        while remaining:
+            left = stock_db.run_write(self.conn, _vacuum_chunk)
+            if left >= remaining:
+                break
+            remaining = left
+        return free - remaining
+
+    # ---- 汇总 ----
+
+    def totals(self):
+        """各模式的汇总（直接读 portfolio_totals，与持仓数量无关），返回 [ModeTotals, ...]"""
+        rows = self.conn.execute("""
+            SELECT mode, holdings, total_value, position, pnl FROM portfolio_totals
+            WHERE holdings > 0
+            ORDER BY mode
+        """)
+        return [ModeTotals(*row) for row in rows]
+
+    def _recompute_totals(self):
+        """扫描 stocks 重新汇总：{模式: (只数, 总值, 仓位, 盈亏)}"""
+        rows = self.conn.execute("""
+            SELECT mode, COUNT(*), TOTAL(total_value), TOTAL(position), TOTAL(pnl)
+            FROM stocks WHERE is_deleted = 0 GROUP BY mode
+        """)
+        return {row[0]: row[1:] for row in rows}
+
+    def check_totals(self):
+        """全表重新汇总并与 portfolio_totals 对比，返回 [TotalsDrift, ...]（一致时为空）"""
+        stored = {t.mode: (t.holdings, t.total_value, t.position, t.pnl) for t in self.totals()}
+        actual = self._recompute_totals()
+        drifts = []
+        for mode in sorted(set(stored) | set(actual)):
+            zero = (0, 0.0, 0.0, 0.0)
+            for field, s, a in zip(TOTALS_FIELDS, stored.get(mode, zero), actual.get(mode, zero)):
+                if abs(s - a) > TOTALS_TOLERANCE * max(1.0, abs(a)):
+                    drifts.append(TotalsDrift(mode, field, s, a))
+        return drifts
+
+    def rebuild_totals(self):
+        """按当前持仓重建 portfolio_totals"""
+        def _rebuild(cursor):
+            cursor.execute("DELETE FROM portfolio_totals")
+            cursor.execute("""
+                INSERT INTO portfolio_totals (mode, holdings, total_value, position, pnl)
+                SELECT mode, COUNT(*), TOTAL(total_value), TOTAL(position), TOTAL(pnl)
+                FROM stocks WHERE is_deleted = 0 GROUP BY mode
+            """)
+
+        stock_db.run_write(self.conn, _rebuild)
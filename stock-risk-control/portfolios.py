@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 多组合汇总
+每个组合一个数据库（见 stock_db.portfolio_path），汇总 全部组合 用线程池并发读取各组合的 portfolio_totals 再合并；
+每个线程读完一个组合就关闭连接，同时打开的数据库不超过线程数
+"""
+
+import os
+import sqlite3
+import time
+
+import stock_db
+
+# 并发读取的线程数（每个组合只读一次汇总表，时间主要花在打开文件上，用线程就够了，不用进程）
+SUMMARY_WORKERS = 8
+
+def list_portfolios():
+    """全部组合：[(组合名, 数据库路径)]，默认组合（存在时）排在最前，其余按名称排序"""
+    found = []
+    if os.path.exists(stock_db.DB_PATH):
+        found.append((stock_db.DEFAULT_PORTFOLIO_NAMES[0], stock_db.DB_PATH))
+    if os.path.isdir(stock_db.PORTFOLIO_DIR):
+        for entry in sorted(os.listdir(stock_db.PORTFOLIO_DIR)):
+            name, ext = os.path.splitext(entry)
+            if ext == ".db" and not name.startswith("."):
+                found.append((name, os.path.join(stock_db.PORTFOLIO_DIR, entry)))
+    return found
+
+def summarize_portfolios(portfolios=None, workers=SUMMARY_WORKERS):
+    """并发读取各组合的汇总，返回 [(组合名, [ModeTotals, ...] 或 读取失败的异常)]，顺序与 portfolios 相同"""
+    from portfolio_store import PortfolioStore
+
+    portfolios = list_portfolios() if portfolios is None else portfolios
+
+    def read(portfolio):
+        name, path = portfolio
+        try:
+            with PortfolioStore(path) as store:
+                return name, store.totals()
+        except sqlite3.Error as e:
+            return name, e
+
+    if workers <= 1 or len(portfolios) <= 1:
+        return [read(p) for p in portfolios]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read, portfolios))
+
+def show_all_summary(workers=SUMMARY_WORKERS):
+    """汇总 全部组合 命令入口：每个组合一行，最后按模式合并；返回读取失败的组合数"""
+    start = time.perf_counter()
+    results = summarize_portfolios(workers=workers)
+    elapsed = time.perf_counter() - start
+
+    if not results:
+        print("📭 还没有任何组合（命令加 --portfolio 名称 即可新建组合）")
+        return 0
+
+    failed = [(name, e) for name, e in results if isinstance(e, Exception)]
+    merged = {}
+    print(f"📊 全部组合汇总（{len(results)} 个组合）")
+    print("=" * 64)
+    print(f"{'组合':<16} {'只数':<8} {'总值':<12} {'仓位':<10} {'盈亏':<12}")
+    print("-" * 64)
+    for name, totals in results:
+        if isinstance(totals, Exception):
+            continue
+        for t in totals:
+            row = merged.setdefault(stock_db.simplify_mode(t.mode), [0, 0.0, 0.0])
+            row[0] += t.holdings
+            row[1] += t.total_value
+            row[2] += t.pnl
+        print(f"{name:<16} {sum(t.holdings for t in totals):<8} {sum(t.total_value for t in totals):<12.0f} "
+              f"{f'{sum(t.position for t in totals):.1f}%':<10} {sum(t.pnl for t in totals):<12.0f}")
+    print("-" * 64)
+    # 各组合的总资金不同，仓位不能跨组合相加，合计只给只数、总值、盈亏
+    for mode, (holdings, total_value, pnl) in sorted(merged.items()):
+        print(f"{'合计·' + mode:<16} {holdings:<8} {total_value:<12.0f} {'-':<10} {pnl:<12.0f}")
+    print(f"{'合计':<16} {sum(r[0] for r in merged.values()):<8} {sum(r[1] for r in merged.values()):<12.0f} "
+          f"{'-':<10} {sum(r[2] for r in merged.values()):<12.0f}")
+    print("=" * 64)
+    print(f"耗时 {elapsed * 1000:.1f}ms（{min(workers, len(results))} 个线程并发读取）")
+    for name, e in failed:
+        print(f"⚠️ 组合 {name} 读取失败: {e}")
+    return len(failed)
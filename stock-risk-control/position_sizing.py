@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 批量仓位计算
+一次计算整份自选股（CSV：code,现价,止损价[,目标风险]）的止损跌幅和集中建议仓位，
+或者生成 现价 × 止损价 × 目标风险 的仓位网格；公式与 calculate_concentrated 一致，全部用NumPy向量化
+"""
+
+import sys
+import csv
+import json
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# 网格最多的格子数（现价数 × 止损价数 × 目标风险数）
+MAX_GRID_CELLS = 10000000
+
+def require_numpy():
+    """未安装NumPy时给出提示并退出"""
+    if not NUMPY_AVAILABLE:
+        print("❌ 需要安装 NumPy：pip install numpy")
+        sys.exit(1)
+
+def size_positions(price, stop_loss, target_risk=2):
+    """向量化计算 (止损跌幅%, 建议仓位%, 有效标记)
+
+    建议仓位 = 目标风险 / 止损跌幅；止损价不低于现价或现价≤0的行无效（仓位为NaN）
+    """
+    price = np.asarray(price, dtype=np.float64)
+    stop_loss = np.asarray(stop_loss, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stop_loss_drop = 1 - stop_loss / price
+        valid = (price > 0) & (stop_loss_drop > 0)
+        position_pct = np.where(valid, target_risk / (stop_loss_drop * 100) * 100, np.nan)
+    return stop_loss_drop * 100, position_pct, valid
+
+def read_sizing_rows(source="-", default_risk=2):
+    """读取 code,现价,止损价[,目标风险]（支持表头，'-'表示stdin）
+
+    返回 (代码列表, 现价数组, 止损价数组, 目标风险数组, [跳过的行])
+    """
+    f = sys.stdin if source in (None, "-") else open(source, "r", encoding="utf-8-sig", newline="")
+    codes, prices, stops, risks, skipped = [], [], [], [], []
+    try:
+        for line_no, fields in enumerate(csv.reader(f), 1):
+            if not fields or not fields[0].strip() or fields[0].startswith("#"):
+                continue
+            if line_no == 1 and fields[0].strip().lower() in ["code", "代码"]:
+                continue
+            try:
+                price, stop = float(fields[1]), float(fields[2])
+                risk = float(fields[3]) if len(fields) > 3 and fields[3].strip() else default_risk
+            except (ValueError, IndexError):
+                skipped.append((line_no, ",".join(fields)))
+                continue
+            codes.append(fields[0].strip())
+            prices.append(price)
+            stops.append(stop)
+            risks.append(risk)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return codes, np.array(prices, dtype=np.float64), np.array(stops, dtype=np.float64), \
+        np.array(risks, dtype=np.float64), skipped
+
+def batch_sizing(codes, price, stop_loss, target_risk, total_capital=None):
+    """整批计算，返回按列组织的结果（含模式；给了总资金时再算金额和整手股数）"""
+    drop_pct, position_pct, valid = size_positions(price, stop_loss, target_risk)
+    # 与 auto_adjust_mode 一致：仓位≤2% → 分散
+    result = {
+        "code": codes,
+        "price": price,
+        "stop_loss": stop_loss,
+        "target_risk": target_risk,
+        "stop_loss_drop_pct": drop_pct,
+        "position_pct": position_pct,
+        "mode": np.where(valid, np.where(position_pct <= 2, "分散", "集中"), "止损价必须小于现价"),
+    }
+    if total_capital:
+        amount = np.where(valid, total_capital * position_pct / 100, 0)
+        result["amount"] = amount
+        result["shares"] = np.floor(amount / np.where(valid, price, 1) / 100) * 100
+    return result
+
+def _column_text(column, output_format):
+    """一列 → 字符串列表：浮点数保留4位小数，NaN 输出为空（CSV）或 null（JSON）
+
+    逐值 json.dumps/csv.writer 的开销远大于计算本身，这里每列先整体转成文本再按行拼接
+    """
+    if isinstance(column, np.ndarray) and column.dtype.kind == "f":
+        text = list(map(repr, column.round(4).tolist()))
+        if np.isnan(column).any():
+            blank = "null" if output_format == "json" else ""
+            text = [blank if value == "nan" else value for value in text]
+        return text
+    if isinstance(column, np.ndarray) and column.dtype.kind in "iub":
+        return list(map(str, column.tolist()))
+    values = [str(value) for value in (column.tolist() if isinstance(column, np.ndarray) else column)]
+    # 常见情况：整列都没有需要转义的字符，直接用（JSON只加引号）
+    joined = "".join(values)
+    if not any(ch in joined for ch in ',"\\\r\n\t'):
+        return values if output_format != "json" else ['"%s"' % value for value in values]
+    # 否则逐值转义，重复的值（如模式列）只转义一次
+    cache = {}
+    if output_format == "json":
+        encode = lambda value: json.dumps(value, ensure_ascii=False)
+    else:
+        encode = _csv_field
+    return [cache[value] if value in cache else cache.setdefault(value, encode(value)) for value in values]
+
+def _csv_field(value):
+    if any(ch in value for ch in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def write_rows(result, output_format="csv", out=None):
+    """按列结果输出为 CSV 或 JSON 数组（逐行写出，不拼整个字符串）"""
+    out = out or sys.stdout
+    fields = list(result)
+    columns = [_column_text(result[name], output_format) for name in fields]
+    if output_format == "json":
+        template = "{" + ", ".join(json.dumps(name) + ": %s" for name in fields) + "}"
+        out.write("[")
+        for i, row in enumerate(zip(*columns)):
+            out.write(("," if i else "") + "\n  " + template % row)
+        out.write("\n]\n")
+    else:
+        out.write(",".join(fields) + "\n")
+        out.writelines(",".join(row) + "\n" for row in zip(*columns))
+
+def parse_range(text):
+    """'起:止:步长'（含终点）或 '值1,值2,...' → 数组"""
+    if ":" in text:
+        start, stop, step = (float(x) for x in text.split(":"))
+        if step <= 0 or stop < start:
+            raise ValueError(f"范围不正确: {text}")
+        return np.round(np.arange(start, stop + step / 2, step), 10)
+    return np.array([float(x) for x in text.split(",")])
+
+def grid_sizing(prices, stops, risks):
+    """现价 × 止损价 × 目标风险 的仓位网格，返回 (止损跌幅%, 建议仓位%)，形状为 (风险数, 现价数, 止损价数)"""
+    if len(prices) * len(stops) * len(risks) > MAX_GRID_CELLS:
+        raise ValueError(f"网格太大（超过 {MAX_GRID_CELLS} 格）")
+    drop_pct, position_pct, _ = size_positions(prices[None, :, None], stops[None, None, :], risks[:, None, None])
+    return np.broadcast_to(drop_pct, position_pct.shape), position_pct
+
+def print_grid(prices, stops, risks, position_pct):
+    """每个目标风险一张表：行是现价，列是止损价"""
+    for r, risk in enumerate(risks):
+        print(f"📊 {risk:g}%集中建议仓位（行：现价，列：止损价）")
+        print(f"{'现价':<10}" + "".join(f"{stop:<10g}" for stop in stops))
+        print("-" * (10 + 10 * len(stops)))
+        for p, price in enumerate(prices):
+            cells = (f"{value:.1f}%" if not np.isnan(value) else "-" for value in position_pct[r, p])
+            print(f"{price:<10g}" + "".join(f"{cell:<10}" for cell in cells))
+        print()
+
+def show_batch(source="-", default_risk=2, total_capital=None, output_format="csv"):
+    """批量仓位命令入口"""
+    require_numpy()
+    codes, price, stop_loss, target_risk, skipped = read_sizing_rows(source, default_risk)
+    result = batch_sizing(codes, price, stop_loss, target_risk, total_capital)
+    write_rows(result, output_format)
+    if skipped:
+        print(f"⚠️ 格式错误已跳过: 第 {', '.join(str(n) for n, _ in skipped)} 行", file=sys.stderr)
+
+def show_grid(prices, stops, risks, output_format="表格"):
+    """仓位网格命令入口"""
+    require_numpy()
+    drop_pct, position_pct = grid_sizing(prices, stops, risks)
+    if output_format == "表格":
+        print_grid(prices, stops, risks, position_pct)
+        return
+    risk_idx, price_idx, stop_idx = np.indices(position_pct.shape).reshape(3, -1)
+    write_rows({
+        "price": prices[price_idx],
+        "stop_loss": stops[stop_idx],
+        "target_risk": risks[risk_idx],
+        "stop_loss_drop_pct": drop_pct.reshape(-1),
+        "position_pct": position_pct.reshape(-1),
+    }, output_format)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 价格历史
+每次更新现价都会追加到 prices 表（整数价格，WITHOUT ROWID），并在同一事务里更新当天的日K线（price_bars）；
+查询只读日K线，超过保留天数的原始价格由压缩任务按原始价格校正K线后删除
+"""
+
+import time
+from itertools import groupby
+from operator import itemgetter
+
+import stock_db
+
+# 原始价格默认保留天数
+DEFAULT_KEEP_DAYS = 30
+
+def day_of(ts):
+    """Unix时间戳 → 交易日编号（北京时间的Unix天数）"""
+    return (int(ts) + stock_db.MARKET_UTC_OFFSET) // 86400
+
+def day_start(day):
+    """交易日编号 → 当天0点的Unix时间戳"""
+    return day * 86400 - stock_db.MARKET_UTC_OFFSET
+
+def format_day(day):
+    return time.strftime("%Y-%m-%d", time.gmtime(day * 86400))
+
+def compact_prices(keep_days=DEFAULT_KEEP_DAYS, now=None):
+    """把保留天数之前的原始价格合并成日K线并删除，返回 (删除的原始价格条数, 校正的K线数)
+
+    写入时已经增量更新了K线，但补录的旧价格会让开盘/收盘不准，这里按时间顺序重新计算；
+    截止点对齐到交易日0点，同一天的价格不会被拆开；
+    K线条数和原始价格条数对不上（该天的部分原始价格之前已被压缩）时保留增量K线
+    """
+    cutoff = day_start(day_of(time.time() if now is None else now) - keep_days)
+
+    def _compact(cursor):
+        cursor.execute("""
+            INSERT INTO price_bars (stock_id, day, open, high, low, close, ticks)
+            SELECT stock_id, day, MIN(open), MAX(price), MIN(price), MIN(close), COUNT(*)
+            FROM (
+                SELECT stock_id, (ts + :offset) / 86400 AS day, price,
+                       FIRST_VALUE(price) OVER w AS open,
+                       LAST_VALUE(price) OVER w AS close
+                FROM prices
+                WHERE ts < :cutoff
+                WINDOW w AS (PARTITION BY stock_id, (ts + :offset) / 86400 ORDER BY ts
+                             ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+            )
+            WHERE true
+            GROUP BY stock_id, day
+            ON CONFLICT (stock_id, day) DO UPDATE SET
+                open = excluded.open, high = excluded.high, low = excluded.low, close = excluded.close
+            WHERE ticks = excluded.ticks
+        """, {"offset": stock_db.MARKET_UTC_OFFSET, "cutoff": cutoff})
+        bars = cursor.rowcount
+        ticks = cursor.execute("DELETE FROM prices WHERE ts < ?", (cutoff,)).rowcount
+        return ticks, bars
+
+    conn = stock_db.get_conn()
+    try:
+        return stock_db.run_write(conn, _compact)
+    finally:
+        stock_db.release_conn(conn)
+
+def load_daily(conn, days, stock_id=None, now=None):
+    """最近N天的日K线（含今天），返回 {stock_id: [(day, open, high, low, close), ...]}，价格已换算回浮点数
+
+    按主键 (stock_id, day) 范围扫描，耗时只和N、持仓数有关，和历史总长度无关
+    """
+    start_day = day_of(time.time() if now is None else now) - days + 1
+    # +is_deleted：按rowid顺序扫持仓，结果天然按 (stock_id, day) 有序，省掉临时排序
+    where = "+s.is_deleted = 0" if stock_id is None else "s.id = :stock_id"
+    rows = conn.execute(f"""
+        SELECT b.stock_id, b.day, b.open * :unit, b.high * :unit, b.low * :unit, b.close * :unit
+        FROM stocks s JOIN price_bars b ON b.stock_id = s.id AND b.day >= :start_day
+        WHERE {where}
+        ORDER BY s.id, b.day
+    """, {"start_day": start_day, "stock_id": stock_id, "unit": 1 / stock_db.PRICE_SCALE})
+
+    series = {}
+    for sid, bars in groupby(rows, key=itemgetter(0)):
+        series[sid] = [bar[1:] for bar in bars]
+    return series
+
+def max_drawdown(bars):
+    """按日K线计算最大回撤（%）
+
+    日K线看不出当天最高和最低谁先出现：当天最低只和之前的高点（含当天开盘）比，比完再把当天最高计入高点
+    """
+    peak, worst = 0.0, 0.0
+    for _, open_, high, low, _ in bars:
+        peak = max(peak, open_)
+        if peak > 0:
+            worst = max(worst, (peak - low) / peak * 100)
+        peak = max(peak, high)
+    return worst
+
+def show_prices(days, stock_id=None):
+    """输出最近N天的价格走势：全部持仓汇总，或单只股票的日K线"""
+    conn = stock_db.get_conn()
+    try:
+        series = load_daily(conn, days, stock_id)
+        names = dict(conn.execute("SELECT id, name || '(' || IFNULL(code, '-') || ')' FROM stocks").fetchall())
+    finally:
+        stock_db.release_conn(conn)
+
+    if not series:
+        print(f"📭 最近 {days} 天没有价格记录")
+        return
+
+    if stock_id is not None:
+        print(f"📈 {names.get(stock_id, stock_id)} 最近 {days} 天日K线:")
+        print(f"{'日期':<12} {'开盘':<10} {'最高':<10} {'最低':<10} {'收盘':<10}")
+        print("-" * 56)
+        for day, open_, high, low, close in series[stock_id]:
+            print(f"{format_day(day):<12} {open_:<10.2f} {high:<10.2f} {low:<10.2f} {close:<10.2f}")
+        print(f"最大回撤: {max_drawdown(series[stock_id]):.1f}%")
+        return
+
+    print(f"📈 最近 {days} 天价格走势:")
+    print(f"{'股票':<20} {'天数':<6} {'起始':<10} {'最新':<10} {'涨跌':<10} {'最大回撤':<10}")
+    print("-" * 72)
+    for sid, bars in series.items():
+        first, last = bars[0][1], bars[-1][4]
+        change = (last - first) / first * 100 if first else 0
+        print(f"{names.get(sid, sid):<20} {len(bars):<6} {first:<10.2f} {last:<10.2f} "
+              f"{f'{change:+.1f}%':<10} {f'{max_drawdown(bars):.1f}%':<10}")
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 性能剖析
+给命令的各个阶段（启动、打开数据库、每条SQL、计算、输出）计时，每个阶段一行JSON（JSON Lines）：
+    {"run": "...", "cmd": "列表", "phase": "sql", "ms": 1.23, "sql": "SELECT id, name ..."}
+ms 为该阶段自身耗时（不含嵌套在里面的其他阶段），phase=command 的一行是整条命令的总耗时
+
+开启方式（默认关闭，关闭时只多一次判断）：
+    RISK_PROFILE=1 或 stderr   → 输出到stderr
+    RISK_PROFILE=文件路径       → 追加到文件（每条命令结束时一次写入）
+    命令行 --profile / --profile=文件 同上
+深度剖析（可选）：RISK_PROFILE_DUMP 或 --profile-dump=
+    cprofile[:文件.prof]        → 按累计耗时输出前25个函数到stderr（给了文件再保存pstats）
+    tracemalloc                 → 输出内存峰值和分配最多的代码行到stderr
+"""
+
+import sys
+import os
+import time
+import sqlite3
+
+ENV_VAR = "RISK_PROFILE"
+DUMP_ENV_VAR = "RISK_PROFILE_DUMP"
+
+DUMP_MODES = ["cprofile", "tracemalloc"]
+
+# 报告里阶段的顺序（其余阶段按名称排在后面）
+PHASE_ORDER = ["startup", "connect", "sql", "compute", "render", "other", "command"]
+
+# cProfile 输出的函数数、tracemalloc 输出的代码行数
+DUMP_TOP = 25
+
+# 记录里保留的SQL长度
+SQL_PREVIEW = 80
+
+# 输出目标：None 为关闭，"-" 为stderr，否则为文件路径
+_target = None
+# 当前命令：{"run": 编号, "cmd": 命令, "events": [...]}，不在命令内时为None
+_run = None
+# 未结束的阶段（嵌套时内层耗时从外层扣除）
+_stack = []
+# 启动耗时只在进程的第一条命令记录（常驻进程里后面的命令没有启动开销）
+_startup_recorded = False
+
+def enabled():
+    return _target is not None
+
+def _parse_target(value):
+    if value in ["1", "stderr", "-", "true", "on"]:
+        return "-"
+    if value in ["", "0", "false", "off"]:
+        return None
+    return value
+
+def configure(target=None):
+    """设置输出目标：target 为命令行 --profile 的值，没给时看环境变量"""
+    global _target
+    _target = _parse_target(os.environ.get(ENV_VAR, "") if target is None else target)
+    return _target
+
+def env_file():
+    """环境变量指定的记录文件（输出到stderr或关闭时为None）"""
+    target = _parse_target(os.environ.get(ENV_VAR, ""))
+    return target if target != "-" else None
+
+def pop_flags(argv):
+    """从参数里取出 --profile[=文件] 和 --profile-dump=模式，返回 (剩余参数, 输出目标, 剖析模式)"""
+    rest, target, dump = [], None, None
+    for arg in argv:
+        if arg == "--profile":
+            target = "-"
+        elif arg.startswith("--profile="):
+            target = arg.split("=", 1)[1] or "-"
+        elif arg.startswith("--profile-dump="):
+            dump = arg.split("=", 1)[1]
+        else:
+            rest.append(arg)
+    return rest, target, dump
+
+def _write(lines):
+    if _target == "-":
+        sys.stderr.write(lines)
+        sys.stderr.flush()
+    else:
+        # 追加写，一次write：多个进程同时写同一个文件时各行不会交错
+        with open(_target, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+def emit(phase, ms, **fields):
+    """记录一个阶段（在命令内先缓存，命令结束时统一写出）"""
+    if _target is None:
+        return
+    import json
+    event = {"run": _run["run"] if _run else None, "cmd": _run["cmd"] if _run else None,
+             "phase": phase, "ms": round(ms, 3)}
+    event.update(fields)
+    line = json.dumps(event, ensure_ascii=False) + "\n"
+    if _run is not None:
+        _run["events"].append(line)
+    else:
+        _write(line)
+
+class _Span:
+    """计时阶段：退出时记录自身耗时，并把总耗时计入外层阶段的子阶段耗时"""
+
+    __slots__ = ["phase", "fields", "start", "child"]
+
+    def __init__(self, phase, fields):
+        self.phase = phase
+        self.fields = fields
+        self.child = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        _stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        _stack.pop()
+        if _stack:
+            _stack[-1].child += elapsed
+        emit(self.phase, (elapsed - self.child) * 1000, **self.fields)
+        return False
+
+class _NullSpan:
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(phase, **fields):
+    """with span("render"): ... ；关闭时返回共享的空对象"""
+    if _target is None:
+        return _NULL_SPAN
+    return _Span(phase, fields)
+
+def timed_iter(phase, iterable):
+    """惰性迭代器计时：累计每次取下一项的耗时，迭代结束时记录一条（rows 为条数）
+
+    用在"边读边算边输出"的地方，把计算从外层的输出阶段里分出来
+    """
+    if _target is None:
+        return iterable
+    return _timed_iter(phase, iterable)
+
+def _timed_iter(phase, iterable):
+    total = 0.0
+    rows = 0
+    it = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                total += time.perf_counter() - start
+                break
+            total += time.perf_counter() - start
+            rows += 1
+            yield item
+    finally:
+        if _stack:
+            _stack[-1].child += total
+        emit(phase, total * 1000, rows=rows)
+
+def _sql_preview(sql):
+    return " ".join(sql.split())[:SQL_PREVIEW]
+
+class ProfiledCursor(sqlite3.Cursor):
+    """每次 execute/executemany/executescript 记录一个 sql 阶段（SELECT 只含执行到第一行，逐行读取计入外层）"""
+
+    def execute(self, sql, parameters=()):
+        with _Span("sql", {"sql": _sql_preview(sql)}):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with _Span("sql", {"sql": _sql_preview(sql), "many": True}):
+            return super().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        with _Span("sql", {"sql": _sql_preview(sql_script), "script": True}):
+            return super().executescript(sql_script)
+
+class ProfiledConnection(sqlite3.Connection):
+    """conn.execute 不经过 conn.cursor()，两边都要接管"""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+def connection_factory():
+    """sqlite3.connect 的 factory：开启时每条SQL计时，关闭时用原生连接（没有额外开销）"""
+    return ProfiledConnection if _target is not None else sqlite3.Connection
+
+def _new_run_id():
+    return f"{int(time.time() * 1000):x}-{os.getpid()}"
+
+def run(command, fn, dump=None):
+    """在计时下执行一条命令 fn()：记录启动、总耗时（含退出码），可选 cProfile/tracemalloc 剖析
+
+    sys.exit 照常向外抛出；关闭且没有剖析模式时直接执行
+    """
+    global _run, _startup_recorded
+    dump = dump or os.environ.get(DUMP_ENV_VAR) or None
+    dump_mode, _, dump_path = (dump or "").partition(":")
+    if dump_mode and dump_mode not in DUMP_MODES:
+        print(f"⚠️ 未知的剖析模式: {dump_mode}（可选: {', '.join(DUMP_MODES)}）", file=sys.stderr)
+        dump_mode = ""
+    if _target is None and not dump_mode:
+        return fn()
+
+    _run = {"run": _new_run_id(), "cmd": command, "events": []}
+    if not _startup_recorded:
+        # 解释器启动 + 导入模块都是CPU密集的，用进程CPU时间近似
+        emit("startup", time.process_time() * 1000)
+        _startup_recorded = True
+
+    profiler = None
+    if dump_mode == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+    elif dump_mode == "tracemalloc":
+        import tracemalloc
+        tracemalloc.start()
+
+    code = 0
+    start = time.perf_counter()
+    try:
+        if profiler:
+            profiler.enable()
+        try:
+            return fn()
+        finally:
+            if profiler:
+                profiler.disable()
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        raise
+    except BaseException:
+        code = 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        if dump_mode == "tracemalloc":
+            _dump_tracemalloc()
+        elif profiler:
+            _dump_cprofile(profiler, dump_path)
+        emit("command", elapsed * 1000, exit=code)
+        events, _run = _run["events"], None
+        del _stack[:]
+        if _target is not None and events:
+            _write("".join(events))
+
+def _dump_cprofile(profiler, path=None):
+    import pstats
+    if path:
+        profiler.dump_stats(path)
+        print(f"💾 cProfile 结果已保存: {path}（python -m pstats {path}）", file=sys.stderr)
+    print(f"📊 cProfile（按累计耗时前 {DUMP_TOP} 个函数）", file=sys.stderr)
+    pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(DUMP_TOP)
+
+def _dump_tracemalloc():
+    import tracemalloc
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    emit("memory", 0, current_kb=round(current / 1024, 1), peak_kb=round(peak / 1024, 1))
+    print(f"📊 tracemalloc：当前 {current / 1024:.1f}KB，峰值 {peak / 1024:.1f}KB（分配最多的 {DUMP_TOP} 行）",
+          file=sys.stderr)
+    for stat in snapshot.statistics("lineno")[:DUMP_TOP]:
+        print(f"   {stat}", file=sys.stderr)
+
+# ---------- 报告 ----------
+
+def load_events(sources):
+    """读取一个或多个 JSON Lines 文件（'-' 为stdin），返回 (记录列表, 跳过的行数)"""
+    import json
+    events, skipped = [], 0
+    for source in sources:
+        f = sys.stdin if source == "-" else open(source, "r", encoding="utf-8")
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                    event["ms"] = float(event["ms"])
+                    event["phase"]
+                except (ValueError, KeyError, TypeError):
+                    skipped += 1
+                    continue
+                events.append(event)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    return events, skipped
+
+def percentile(values, pct):
+    """线性插值百分位（values 已排序）"""
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def aggregate(events, command=None):
+    """按 (命令, 阶段) 汇总：同一次运行里同一阶段的多条（如多条SQL）先求和，再跨运行算分位数
+
+    返回 [{"cmd", "phase", "runs", "calls", "p50", "p95", "max", "mean"}, ...]
+    """
+    per_run = {}
+    calls = {}
+    # 每次运行里 command 总耗时减去各阶段之和 = 没有单独计时的部分（other）
+    untimed = {}
+    for event in events:
+        if event.get("phase") == "memory":
+            continue
+        cmd = event.get("cmd") or "-"
+        if command and cmd != command:
+            continue
+        key = (cmd, event["phase"])
+        run_key = event.get("run")
+        totals = per_run.setdefault(key, {})
+        totals[run_key] = totals.get(run_key, 0.0) + event["ms"]
+        calls[key] = calls.get(key, 0) + 1
+        if run_key is not None and event["phase"] != "startup":
+            sign = 1 if event["phase"] == "command" else -1
+            untimed[(cmd, run_key)] = untimed.get((cmd, run_key), 0.0) + sign * event["ms"]
+    for (cmd, run_key), ms in untimed.items():
+        if run_key in per_run.get((cmd, "command"), {}):
+            per_run.setdefault((cmd, "other"), {})[run_key] = max(ms, 0.0)
+            calls[(cmd, "other")] = calls.get((cmd, "other"), 0) + 1
+
+    def order(key):
+        cmd, phase = key
+        rank = PHASE_ORDER.index(phase) if phase in PHASE_ORDER else len(PHASE_ORDER) - 1
+        return cmd, rank, phase
+
+    rows = []
+    for key in sorted(per_run, key=order):
+        values = sorted(per_run[key].values())
+        rows.append({
+            "cmd": key[0],
+            "phase": key[1],
+            "runs": len(values),
+            "calls": calls[key],
+            "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "max": round(values[-1], 3),
+            "mean": round(sum(values) / len(values), 3),
+        })
+    return rows
+
+def show_report(sources, command=None, output_format="table"):
+    """性能报告命令入口"""
+    events, skipped = load_events(sources)
+    rows = aggregate(events, command)
+    if output_format == "json":
+        import json
+        json.dump(rows, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        return rows
+    if output_format == "csv":
+        import csv
+        writer = csv.DictWriter(sys.stdout, fieldnames=["cmd", "phase", "runs", "calls", "p50", "p95", "max", "mean"])
+        writer.writeheader()
+        writer.writerows(rows)
+        return rows
+    if not rows:
+        print("📭 没有性能记录（用 --profile=文件 或 RISK_PROFILE=文件 运行命令后再看）")
+        return rows
+
+    runs = len({event.get("run") for event in events})
+    print(f"📊 性能报告（{runs} 次运行，{len(events)} 条记录，单位ms，每次运行内同一阶段先求和）")
+    print("=" * 78)
+    print(f"{'命令':<10} {'阶段':<10} {'运行次数':<8} {'调用次数':<8} {'p50':<10} {'p95':<10} {'最大':<10} {'平均':<10}")
+    print("-" * 78)
+    last_cmd = None
+    for row in rows:
+        cmd = row["cmd"] if row["cmd"] != last_cmd else ""
+        last_cmd = row["cmd"]
+        print(f"{cmd:<10} {row['phase']:<10} {row['runs']:<8} {row['calls']:<8} {row['p50']:<10.2f} "
+              f"{row['p95']:<10.2f} {row['max']:<10.2f} {row['mean']:<10.2f}")
+    print("=" * 78)
+    print("   startup=解释器启动+导入（CPU时间） connect=打开数据库/迁移检查 sql=执行SQL")
+    print("   compute=读取行+计算建议 render=格式化输出 other=未单独计时（导入、计算等） command=整条命令总耗时")
+    if skipped:
+        print(f"   ⚠️ 格式错误已跳过 {skipped} 行")
+    return rows
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 调仓方案
+把 get_simple_suggestion 的"⚠️ 降低到x%"换算成整手股数：
+- 跌穿止损 → 全部卖出；超过集中建议仓位 → 卖到建议仓位以内（按整手，卖完不超过上限）
+- 仓位低于建议仓位的持仓（有止损、不在止损警戒内）→ 在现金预算内按整手买入，不超过建议仓位
+买入是有界整数分配：每只 0..可买手数，总金额不超过预算；先按缺口比例取整，再用剩余现金逐手补齐
+只给出方案，不修改持仓
+"""
+
+import sys
+import json
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+import stock_db
+
+# A股一手100股
+DEFAULT_LOT = 100
+
+# 与 get_simple_suggestion 一致：离止损价10%以内只提示注意，不加仓
+WARN_DROP_PCT = 10
+
+ACTION_SELL_ALL = "🆘 清仓"
+ACTION_REDUCE = "⚠️ 减仓"
+ACTION_BUY = "➕ 加仓"
+
+def require_numpy():
+    """未安装NumPy时给出提示并退出"""
+    if not NUMPY_AVAILABLE:
+        print("❌ 需要安装 NumPy：pip install numpy")
+        sys.exit(1)
+
+def load_holdings(conn):
+    """未删除持仓：(按列组织的数组, 名称列表, 代码列表)"""
+    rows = conn.execute("""
+        SELECT id, name, code, quantity, IFNULL(stop_loss, 0), current_price
+        FROM stocks
+        WHERE +is_deleted = 0
+        ORDER BY id
+    """).fetchall()
+    if not rows:
+        return None, [], []
+    ids, names, codes, quantity, stop_loss, current_price = zip(*rows)
+    holdings = {
+        "id": np.array(ids, dtype=np.int64),
+        "quantity": np.array(quantity, dtype=np.float64),
+        "stop_loss": np.array(stop_loss, dtype=np.float64),
+        "current_price": np.array(current_price, dtype=np.float64),
+    }
+    return holdings, list(names), list(codes)
+
+def allocate_lots(lot_cost, max_lots, budget):
+    """有界整数分配：每只买 0..max_lots 手，总金额 ≤ budget，尽量用满预算
+
+    先按"预算/总缺口"的比例取整（连续解向下取整），再按小数部分从大到小逐手补，
+    一轮补不动为止；剩下的现金不够任何一只再买一手
+    """
+    lots = np.zeros(len(lot_cost), dtype=np.int64)
+    need = float((lot_cost * max_lots).sum())
+    if need <= budget:
+        return max_lots.astype(np.int64)
+    if budget <= 0:
+        return lots
+    scaled = max_lots * (budget / need)
+    lots = np.floor(scaled).astype(np.int64)
+    remaining = budget - float((lots * lot_cost).sum())
+    order = np.argsort(lots - scaled, kind="stable")
+    lot_cost_list = lot_cost.tolist()
+    while True:
+        added = False
+        for i in order.tolist():
+            if lots[i] < max_lots[i] and lot_cost_list[i] <= remaining:
+                lots[i] += 1
+                remaining -= lot_cost_list[i]
+                added = True
+        if not added:
+            return lots
+
+def plan_rebalance(holdings, total_capital=stock_db.DEFAULT_TOTAL_CAPITAL, cash=None, lot=DEFAULT_LOT,
+                   allow_buy=True):
+    """计算每只持仓的股数调整，返回按列组织的方案（dict）
+
+    cash: 可用现金，默认为 总资金 - 持仓市值（不小于0）；卖出回收的资金也计入买入预算
+    """
+    quantity = holdings["quantity"]
+    price = holdings["current_price"]
+    stop_loss = holdings["stop_loss"]
+
+    valid = (stop_loss > 0) & (price > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # 与 calculate_2pct_concentrated_position 相同：2% / 止损跌幅
+        suggested = np.where(valid & (price > stop_loss), 2 / ((1 - stop_loss / price) * 100) * 100, 0.0)
+        max_shares = np.floor(total_capital * suggested / 100 / price / lot) * lot
+        drop_to_stop = (price - stop_loss) / price * 100
+    max_shares = np.where(valid, max_shares, quantity)
+    position = quantity * price / total_capital * 100
+
+    # 卖出：跌穿止损的清仓，超过建议仓位的卖到上限以内
+    cleared = valid & (price <= stop_loss)
+    over = valid & ~cleared & (quantity > max_shares)
+    target = np.where(cleared, 0, np.where(over, max_shares, quantity))
+    proceeds = float(((quantity - target) * price).sum())
+
+    # 买入：有止损、不在止损警戒内、离建议仓位至少还差一手
+    if cash is None:
+        cash = max(total_capital - float((quantity * price).sum()), 0.0)
+    budget = cash + proceeds
+    eligible = valid & ~cleared & ~over & (drop_to_stop > WARN_DROP_PCT)
+    headroom = np.where(eligible, np.floor((max_shares - quantity) / lot), 0).astype(np.int64)
+    headroom = np.maximum(headroom, 0)
+    if allow_buy and headroom.any():
+        buy_lots = allocate_lots(price * lot, headroom, budget)
+        target = target + buy_lots * lot
+
+    change = target - quantity
+    action = np.where(cleared & (change < 0), ACTION_SELL_ALL,
+                      np.where(change < 0, ACTION_REDUCE, np.where(change > 0, ACTION_BUY, "-")))
+    spent = float((np.maximum(change, 0) * price).sum())
+    return {
+        "quantity": quantity,
+        "target": target,
+        "change": change,
+        "amount": change * price,
+        "position": position,
+        "new_position": target * price / total_capital * 100,
+        "suggested_position": np.where(valid, suggested, np.nan),
+        "action": action,
+        "cash": cash,
+        "proceeds": proceeds,
+        "spent": spent,
+        "remaining": budget - spent,
+    }
+
+def write_plan(plan, names, codes, ids, output_format, out=None):
+    """有调整的持仓输出为 CSV 或 JSON"""
+    out = out or sys.stdout
+    records = []
+    for i in np.flatnonzero(plan["change"] != 0).tolist():
+        records.append({
+            "id": int(ids[i]),
+            "name": names[i],
+            "code": codes[i],
+            "action": str(plan["action"][i]),
+            "quantity": float(plan["quantity"][i]),
+            "change": float(plan["change"][i]),
+            "target": float(plan["target"][i]),
+            "amount": round(float(plan["amount"][i]), 2),
+            "position": round(float(plan["position"][i]), 4),
+            "new_position": round(float(plan["new_position"][i]), 4),
+            "suggested_position": round(float(plan["suggested_position"][i]), 4),
+        })
+    if output_format == "json":
+        json.dump(records, out, ensure_ascii=False, indent=2)
+        out.write("\n")
+    else:
+        import csv
+        fields = ["id", "name", "code", "action", "quantity", "change", "target", "amount",
+                  "position", "new_position", "suggested_position"]
+        writer = csv.DictWriter(out, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(records)
+
+def show_rebalance(total_capital=stock_db.DEFAULT_TOTAL_CAPITAL, cash=None, lot=DEFAULT_LOT, allow_buy=True,
+                   output_format="table"):
+    """调仓命令入口"""
+    require_numpy()
+    conn = stock_db.get_conn()
+    try:
+        holdings, names, codes = load_holdings(conn)
+    finally:
+        stock_db.release_conn(conn)
+    if holdings is None:
+        print("📭 暂无持仓股票")
+        return None
+
+    plan = plan_rebalance(holdings, total_capital, cash, lot, allow_buy)
+    if output_format in ["csv", "json"]:
+        write_plan(plan, names, codes, holdings["id"], output_format)
+        return plan
+
+    changed = np.flatnonzero(plan["change"] != 0)
+    if len(changed) == 0:
+        print(f"✅ 全部 {len(names)} 只持仓都在建议仓位以内，无需调仓")
+        return plan
+    # 先卖后买，各自按金额从大到小
+    changed = changed[np.lexsort((-np.abs(plan["amount"][changed]), plan["change"][changed] > 0))]
+    print(f"📊 调仓方案（总资金：{total_capital:.0f}元，每手 {lot} 股）")
+    print("=" * 100)
+    print(f"{'ID':<5} {'名称':<12} {'操作':<8} {'持有':<10} {'调整':<10} {'调整后':<10} {'金额':<12} "
+          f"{'仓位':<8} {'调整后仓位':<10} {'建议仓位':<8}")
+    print("-" * 100)
+    for i in changed.tolist():
+        position, new_position, suggested = (f"{plan[key][i]:.1f}%" for key in
+                                             ["position", "new_position", "suggested_position"])
+        print(f"{holdings['id'][i]:<5} {names[i]:<12} {plan['action'][i]:<8} {plan['quantity'][i]:<10.0f} "
+              f"{plan['change'][i]:<+10.0f} {plan['target'][i]:<10.0f} {plan['amount'][i]:<+12.0f} "
+              f"{position:<8} {new_position:<10} {suggested:<8}")
+    print("=" * 100)
+    print(f"   卖出回收: {plan['proceeds']:.0f}元，买入: {plan['spent']:.0f}元")
+    print(f"   可用现金: {plan['cash']:.0f}元 → 调仓后剩余 {plan['remaining']:.0f}元")
+    print(f"   共调整 {len(changed)} 只，其余 {len(names) - len(changed)} 只不变（注：只给出方案，不修改持仓）")
+    return plan
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 组合风险模拟
+对当前持仓做蒙特卡洛模拟：按交易日整体抽样历史收益率（保留股票之间的相关性），
+每只持仓跌到止损价就按当天收盘价卖出，统计组合层面的 VaR、CVaR 和最大回撤
+单只股票的2%规则管住了每只的风险，这里回答"几只同时止损时组合会亏多少"
+"""
+
+import sys
+import csv
+import math
+import time
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+import stock_db
+
+DEFAULT_PATHS = 100000
+DEFAULT_HORIZON = 10
+
+# 从价格历史估计收益率时回看的天数，以及至少需要的收益率天数
+DEFAULT_LOOKBACK_DAYS = 250
+MIN_RETURN_DAYS = 20
+
+# 单个进程一次模拟的路径数：每个数组 路径数 × 持仓数 × 4字节，控制在CPU缓存能装下的量级
+CHUNK_PATHS = 5000
+
+CONFIDENCE_LEVELS = [95, 99]
+
+def require_numpy():
+    """未安装NumPy时给出提示并退出"""
+    if not NUMPY_AVAILABLE:
+        print("❌ 需要安装 NumPy：pip install numpy")
+        sys.exit(1)
+
+def load_holdings(conn):
+    """当前持仓：[(id, 名称, 代码, 数量, 现价, 止损价), ...]"""
+    return conn.execute("""
+        SELECT id, name, code, quantity, current_price, IFNULL(stop_loss, 0)
+        FROM stocks
+        WHERE is_deleted = 0 AND quantity > 0 AND current_price > 0
+        ORDER BY id
+    """).fetchall()
+
+def returns_from_history(conn, holdings, lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """从日K线收盘价计算日收益率，返回 (交易日 × 持仓) 的毛收益率矩阵（1 + 收益率）
+
+    某只股票某天没有K线时沿用前一天收盘价（当天收益率为0）
+    """
+    import price_history
+
+    start_day = price_history.day_of(time.time()) - lookback_days
+    ids = [h[0] for h in holdings]
+    column = {stock_id: i for i, stock_id in enumerate(ids)}
+    rows = conn.execute(f"""
+        SELECT stock_id, day, close FROM price_bars
+        WHERE stock_id IN ({",".join("?" * len(ids))}) AND day >= ?
+    """, ids + [start_day]).fetchall()
+    if not rows:
+        return None
+
+    days = sorted({day for _, day, _ in rows})
+    row_of = {day: i for i, day in enumerate(days)}
+    closes = np.full((len(days), len(ids)), np.nan)
+    for stock_id, day, close in rows:
+        closes[row_of[day], column[stock_id]] = close
+    # 向前填充缺失的收盘价
+    for t in range(1, len(days)):
+        missing = np.isnan(closes[t])
+        closes[t, missing] = closes[t - 1, missing]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        gross = closes[1:] / closes[:-1]
+    return np.nan_to_num(gross, nan=1.0, posinf=1.0, neginf=1.0)
+
+def returns_from_csv(path, holdings):
+    """读取收益率CSV（宽表：表头为股票代码，第一列可以是日期，数值为日收益率，如 -0.021）
+
+    返回 (毛收益率矩阵, CSV里找不到的代码列表)；数值不是有限的数字时抛 ValueError（带行号和列名）
+    """
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = [x.strip() for x in next(reader)]
+        # (文件行号, 行)：报错时指出是哪一行
+        data = [(reader.line_num, row) for row in reader if row and row[0].strip()]
+    first = 1 if header and header[0].lower() in ["date", "日期", "day"] else 0
+    columns = {code: i for i, code in enumerate(header) if i >= first}
+    gross = np.ones((len(data), len(holdings)))
+    missing = []
+    for j, (_, _, code, _, _, _) in enumerate(holdings):
+        if code not in columns:
+            missing.append(code)
+            continue
+        i = columns[code]
+        for k, (line, row) in enumerate(data):
+            if i < len(row) and row[i].strip():
+                gross[k, j] = 1 + _return_value(row[i], line, code)
+    return gross, missing
+
+def _return_value(text, line, code):
+    """收益率单元格 → float，不是有限的数字时抛 ValueError"""
+    try:
+        value = float(text)
+    except ValueError:
+        value = math.nan
+    if not math.isfinite(value):
+        raise ValueError(f"第 {line} 行 {code} 列的收益率不是数字: {text.strip()!r}")
+    return value
+
+def simulate_chunk(gross, values, stop_ratio, n_paths, horizon, seed):
+    """模拟一批路径，返回 (期末亏损, 最大回撤比例, 触发止损只数)，都是长度 n_paths 的数组
+
+    gross: (交易日 × 持仓) 毛收益率；values: 每只持仓当前市值；stop_ratio: 止损价/现价（无止损为0）
+    每天从历史中整体抽一天，持仓价格比例 ratio 连乘；跌破止损比例后冻结在当天收盘价（已卖出）
+    """
+    rng = np.random.default_rng(seed)
+    gross = gross.astype(np.float32)
+    values = values.astype(np.float32)
+    stop_ratio = stop_ratio.astype(np.float32)
+    n = len(values)
+
+    ratio = np.ones((n_paths, n), dtype=np.float32)
+    exited = np.empty((n_paths, n), dtype=bool)
+    np.less_equal(ratio, stop_ratio, out=exited)
+    step = np.empty((n_paths, n), dtype=np.float32)
+    start_value = float(values.sum())
+    peak = np.full(n_paths, start_value, dtype=np.float32)
+    drawdown = np.zeros(n_paths, dtype=np.float32)
+    portfolio = peak
+
+    for day_index in rng.integers(0, len(gross), size=(horizon, n_paths)):
+        # mode="clip" 让 take 直接写入 out，不额外缓冲一份（下标本来就在范围内）
+        np.take(gross, day_index, axis=0, out=step, mode="clip")
+        # 已止损的持仓不再变动
+        np.copyto(step, 1, where=exited)
+        ratio *= step
+        # 止损后价格比例冻结在止损线以下，所以"已止损"就等于"比例≤止损比例"，不用再和上一步取并集
+        np.less_equal(ratio, stop_ratio, out=exited)
+        portfolio = ratio @ values
+        np.maximum(peak, portfolio, out=peak)
+        np.maximum(drawdown, (peak - portfolio) / peak, out=drawdown)
+
+    stops_hit = exited.sum(axis=1) - int((stop_ratio >= 1).sum())
+    return start_value - portfolio, drawdown, stops_hit
+
+def _simulate_worker(args):
+    return simulate_chunk(*args)
+
+def run_simulation(gross, values, stop_ratio, paths=DEFAULT_PATHS, horizon=DEFAULT_HORIZON,
+                   workers=1, seed=None):
+    """按 CHUNK_PATHS 切分路径，单进程顺序跑或分给进程池并行，合并结果"""
+    seeds = np.random.SeedSequence(seed).spawn((paths + CHUNK_PATHS - 1) // CHUNK_PATHS)
+    tasks = []
+    for i, child in enumerate(seeds):
+        n = min(CHUNK_PATHS, paths - i * CHUNK_PATHS)
+        tasks.append((gross, values, stop_ratio, n, horizon, child))
+    if workers > 1:
+        from multiprocessing import Pool
+        with Pool(workers) as pool:
+            results = pool.map(_simulate_worker, tasks)
+    else:
+        results = [simulate_chunk(*task) for task in tasks]
+    losses, drawdowns, stops_hit = (np.concatenate(parts) for parts in zip(*results))
+    return losses, drawdowns, stops_hit
+
+def summarize(losses, drawdowns, stops_hit):
+    """VaR / CVaR（按置信度）、最大回撤和止损只数统计"""
+    summary = {"var": {}, "cvar": {}}
+    for level in CONFIDENCE_LEVELS:
+        var = float(np.percentile(losses, level))
+        tail = losses[losses >= var]
+        summary["var"][level] = var
+        summary["cvar"][level] = float(tail.mean()) if len(tail) else var
+    worst = losses >= summary["var"][CONFIDENCE_LEVELS[0]]
+    summary["expected_drawdown"] = float(drawdowns.mean()) * 100
+    summary["drawdown_p95"] = float(np.percentile(drawdowns, 95)) * 100
+    summary["expected_loss"] = float(losses.mean())
+    summary["stops_mean"] = float(stops_hit.mean())
+    summary["stops_tail"] = float(stops_hit[worst].mean()) if worst.any() else 0.0
+    return summary
+
+def simulate_portfolio(paths=DEFAULT_PATHS, horizon=DEFAULT_HORIZON, returns_path=None,
+                       workers=1, total_capital=stock_db.DEFAULT_TOTAL_CAPITAL, seed=None):
+    """读取持仓和收益率，运行模拟并输出结果"""
+    require_numpy()
+    conn = stock_db.get_conn()
+    try:
+        holdings = load_holdings(conn)
+        if not holdings:
+            print("📭 暂无持仓股票")
+            return None
+        if returns_path:
+            gross, missing = returns_from_csv(returns_path, holdings)
+            source = f"{returns_path}（{len(gross)} 天）"
+        else:
+            gross, missing = returns_from_history(conn, holdings), []
+            source = f"价格历史（{0 if gross is None else len(gross)} 天）"
+    finally:
+        stock_db.release_conn(conn)
+
+    if gross is None or len(gross) < MIN_RETURN_DAYS:
+        print(f"❌ 收益率数据不足（至少需要 {MIN_RETURN_DAYS} 个交易日）")
+        print("请先积累价格历史，或用 --returns 指定收益率CSV")
+        sys.exit(1)
+
+    quantity = np.array([h[3] for h in holdings], dtype=np.float64)
+    price = np.array([h[4] for h in holdings], dtype=np.float64)
+    stop_loss = np.array([h[5] for h in holdings], dtype=np.float64)
+    values = quantity * price
+    stop_ratio = np.where(stop_loss > 0, stop_loss / price, 0.0)
+
+    start = time.perf_counter()
+    losses, drawdowns, stops_hit = run_simulation(gross, values, stop_ratio, paths, horizon, workers, seed)
+    elapsed = time.perf_counter() - start
+    summary = summarize(losses, drawdowns, stops_hit)
+
+    total_value = values.sum()
+    print(f"📊 组合风险模拟（{len(holdings)} 只持仓，{paths} 条路径 × {horizon} 个交易日）")
+    print(f"   收益率来源: {source}")
+    print(f"   持仓市值: {total_value:.0f}元（总资金：{total_capital:.0f}元）")
+    for level in CONFIDENCE_LEVELS:
+        var, cvar = summary["var"][level], summary["cvar"][level]
+        print(f"   VaR {level}%: {var:.0f}元（{var / total_capital * 100:.1f}%总资金）"
+              f"，CVaR {level}%: {cvar:.0f}元（{cvar / total_capital * 100:.1f}%总资金）")
+    print(f"   预期最大回撤: {summary['expected_drawdown']:.1f}%（95%分位 {summary['drawdown_p95']:.1f}%）")
+    print(f"   触发止损: 平均 {summary['stops_mean']:.1f} 只，最差{100 - CONFIDENCE_LEVELS[0]}%路径平均 "
+          f"{summary['stops_tail']:.1f} 只")
+    print(f"   耗时: {elapsed * 1000:.0f}ms")
+    if missing:
+        print(f"   ⚠️ 收益率CSV里没有这些代码（按不涨不跌处理）: {', '.join(str(c) for c in missing)}")
+    return summary
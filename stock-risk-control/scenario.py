@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 情景分析
+把几百个价格冲击情景（整体涨跌、按代码、按标签/行业）组成 情景数 × 持仓数 的冲击矩阵，
+一次广播算出每个情景下的市值变化、仓位、盈亏和跌穿止损的持仓
+市值、仓位、盈亏和建议的规则与 stock_db 一致（向量化部分复用 portfolio_engine.compute）
+
+情景文件（JSON）：
+    {
+      "tags": {"半导体": ["688008", "603986"]},
+      "scenarios": [
+        {"name": "指数-10%", "shock": -10},
+        {"name": "半导体-15%", "tags": {"半导体": -15}},
+        {"name": "指数-5% 茅台-20%", "shock": -5, "codes": {"600519": -20}}
+      ]
+    }
+shock 为百分比；同一只持仓同时命中多项时，最具体的生效：代码 > 标签 > 整体
+"""
+
+import sys
+import json
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+import stock_db
+import portfolio_engine
+
+# 每批计算的 情景数 × 持仓数 上限，控制中间数组的内存
+CHUNK_CELLS = 1000000
+
+DEFAULT_TOP = 20
+
+def require_numpy():
+    """未安装NumPy时给出提示并退出"""
+    if not NUMPY_AVAILABLE:
+        print("❌ 需要安装 NumPy：pip install numpy")
+        sys.exit(1)
+
+def load_holdings(conn):
+    """读取未删除持仓，返回 (按列组织的数组, 名称列表, 代码列表)"""
+    rows = conn.execute("""
+        SELECT id, name, code, quantity, IFNULL(cost_price, 0), IFNULL(stop_loss, 0), current_price,
+               hold_reason IS NOT NULL AND TRIM(hold_reason) != ''
+        FROM stocks
+        WHERE +is_deleted = 0
+        ORDER BY id
+    """).fetchall()
+    if not rows:
+        return None, [], []
+    ids, names, codes, quantity, cost_price, stop_loss, current_price, has_reason = zip(*rows)
+    holdings = {
+        "id": np.array(ids, dtype=np.int64),
+        "quantity": np.array(quantity, dtype=np.float64),
+        "cost_price": np.array(cost_price, dtype=np.float64),
+        "stop_loss": np.array(stop_loss, dtype=np.float64),
+        "current_price": np.array(current_price, dtype=np.float64),
+        "has_reason": np.array(has_reason, dtype=bool),
+    }
+    return holdings, list(names), list(codes)
+
+def _check_shock(name, value):
+    value = float(value)
+    if value <= -100:
+        raise ValueError(f"情景「{name}」的跌幅不能达到或超过100%")
+    return value
+
+def parse_scenarios(data):
+    """情景JSON（dict 或直接是情景数组）→ (情景列表, 标签表)
+
+    情景：{"name", "shock", "tags": {标签: 涨跌%}, "codes": {代码: 涨跌%}}
+    """
+    if isinstance(data, list):
+        data = {"scenarios": data}
+    tags = {str(tag): [str(code) for code in codes] for tag, codes in data.get("tags", {}).items()}
+    scenarios = []
+    for i, item in enumerate(data.get("scenarios", []), 1):
+        if not isinstance(item, dict):
+            raise ValueError(f"第 {i} 个情景格式不正确（应为对象）")
+        name = str(item.get("name", f"情景{i}"))
+        scenario = {
+            "name": name,
+            "shock": _check_shock(name, item.get("shock", 0)),
+            "tags": {str(tag): _check_shock(name, v) for tag, v in item.get("tags", {}).items()},
+            "codes": {str(code): _check_shock(name, v) for code, v in item.get("codes", {}).items()},
+        }
+        unknown = [tag for tag in scenario["tags"] if tag not in tags]
+        if unknown:
+            raise ValueError(f"情景「{name}」用到了未定义的标签: {', '.join(unknown)}")
+        scenarios.append(scenario)
+    if not scenarios:
+        raise ValueError("情景文件里没有情景")
+    return scenarios, tags
+
+def load_scenarios(path):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        return parse_scenarios(json.load(f))
+
+def uniform_scenarios(shocks):
+    """命令行直接给出的整体涨跌幅 → 情景列表"""
+    return [{"name": f"整体{shock:+g}%", "shock": _check_shock(f"整体{shock:+g}%", shock), "tags": {}, "codes": {}}
+            for shock in shocks]
+
+def build_shocks(scenarios, codes, tags):
+    """情景 → 冲击矩阵（情景数 × 持仓数，百分比），返回 (矩阵, 持仓里找不到的代码)
+
+    逐项填矩阵：先整列广播整体冲击，再按标签整块赋值，最后按代码散点赋值（后写的覆盖先写的）
+    """
+    shocks = np.repeat(np.array([s["shock"] for s in scenarios])[:, None], len(codes), axis=1)
+
+    columns = {}
+    for j, code in enumerate(codes):
+        columns.setdefault(code, []).append(j)
+
+    for tag, members in tags.items():
+        tag_columns = sorted(j for code in members for j in columns.get(code, []))
+        rows = [i for i, s in enumerate(scenarios) if tag in s["tags"]]
+        if rows and tag_columns:
+            values = np.array([scenarios[i]["tags"][tag] for i in rows])
+            shocks[np.ix_(rows, tag_columns)] = values[:, None]
+
+    rows, cols, values = [], [], []
+    missing = set()
+    for i, scenario in enumerate(scenarios):
+        for code, value in scenario["codes"].items():
+            if code not in columns:
+                missing.add(code)
+                continue
+            for j in columns[code]:
+                rows.append(i)
+                cols.append(j)
+                values.append(value)
+    if rows:
+        shocks[rows, cols] = values
+    return shocks, sorted(missing)
+
+def run_scenarios(holdings, shocks, total_capital=stock_db.DEFAULT_TOTAL_CAPITAL):
+    """按批广播计算所有情景，返回每个情景一项的汇总数组（dict）"""
+    base = portfolio_engine.compute(holdings, total_capital)
+    base_value = base["total_value"].sum()
+    n_scenarios, n = shocks.shape
+    summary = {
+        "value_change": np.empty(n_scenarios),
+        "pnl": np.empty(n_scenarios),
+        "position": np.empty(n_scenarios),
+        "stops": np.empty(n_scenarios, dtype=np.int64),
+        "warnings": np.empty(n_scenarios, dtype=np.int64),
+    }
+    was_clear = base["suggestion"] == portfolio_engine.SUGGEST_CLEAR
+    was_warn = base["suggestion"] == portfolio_engine.SUGGEST_WATCH_STOP
+    step = max(CHUNK_CELLS // max(n, 1), 1)
+    for start in range(0, n_scenarios, step):
+        end = min(start + step, n_scenarios)
+        price = holdings["current_price"] * (1 + shocks[start:end] / 100)
+        result = portfolio_engine.compute(dict(holdings, current_price=price), total_capital)
+        suggestion = result["suggestion"]
+        summary["value_change"][start:end] = result["total_value"].sum(axis=1) - base_value
+        summary["pnl"][start:end] = result["pnl"].sum(axis=1)
+        summary["position"][start:end] = result["position"].sum(axis=1)
+        summary["stops"][start:end] = ((suggestion == portfolio_engine.SUGGEST_CLEAR) & ~was_clear).sum(axis=1)
+        summary["warnings"][start:end] = ((suggestion == portfolio_engine.SUGGEST_WATCH_STOP) & ~was_warn).sum(axis=1)
+    return base, summary
+
+def stop_crossings(holdings, shock_row):
+    """某个情景下新跌穿止损的持仓：[(列下标, 新价格), ...]"""
+    price = holdings["current_price"] * (1 + shock_row / 100)
+    stop_loss = holdings["stop_loss"]
+    crossed = (stop_loss > 0) & (price <= stop_loss) & (holdings["current_price"] > stop_loss)
+    return [(j, price[j]) for j in np.flatnonzero(crossed)]
+
+def write_summary(scenarios, summary, order, total_capital, output_format, out=None):
+    """全部情景（按市值变化从差到好）输出为 CSV 或 JSON"""
+    out = out or sys.stdout
+    records = [{
+        "rank": rank,
+        "scenario": scenarios[i]["name"],
+        "value_change": round(float(summary["value_change"][i]), 2),
+        "value_change_pct": round(float(summary["value_change"][i] / total_capital * 100), 4),
+        "position": round(float(summary["position"][i]), 4),
+        "pnl": round(float(summary["pnl"][i]), 2),
+        "stops": int(summary["stops"][i]),
+        "warnings": int(summary["warnings"][i]),
+    } for rank, i in enumerate(order, 1)]
+    if output_format == "json":
+        json.dump(records, out, ensure_ascii=False, indent=2)
+        out.write("\n")
+    else:
+        import csv
+        writer = csv.DictWriter(out, fieldnames=list(records[0]))
+        writer.writeheader()
+        writer.writerows(records)
+
+def show_scenarios(scenarios, tags=None, total_capital=stock_db.DEFAULT_TOTAL_CAPITAL, top=DEFAULT_TOP,
+                   output_format="table"):
+    """情景分析命令入口"""
+    require_numpy()
+    conn = stock_db.get_conn()
+    try:
+        holdings, names, codes = load_holdings(conn)
+    finally:
+        stock_db.release_conn(conn)
+    if holdings is None:
+        print("📭 暂无持仓股票")
+        return None
+
+    shocks, missing = build_shocks(scenarios, codes, tags or {})
+    base, summary = run_scenarios(holdings, shocks, total_capital)
+    # 按市值变化从差到好排序
+    order = np.argsort(summary["value_change"], kind="stable")
+
+    if output_format in ["csv", "json"]:
+        write_summary(scenarios, summary, order, total_capital, output_format)
+        return summary
+
+    base_value = base["total_value"].sum()
+    print(f"📊 情景分析（{len(codes)} 只持仓，{len(scenarios)} 个情景，总资金：{total_capital:.0f}元）")
+    print(f"   当前: 总市值 {base_value:.0f}元，总仓位 {base['position'].sum():.1f}%，总盈亏 {base['pnl'].sum():+.0f}元")
+    print("=" * 92)
+    print(f"{'排名':<4} {'情景':<22} {'市值变化':<12} {'占总资金':<9} {'总仓位':<9} {'总盈亏':<12} {'跌穿止损':<8} {'进入警戒':<8}")
+    print("-" * 92)
+    for rank, i in enumerate(order[:top], 1):
+        change = summary["value_change"][i]
+        change_pct = f"{change / total_capital * 100:+.2f}%"
+        position = f"{summary['position'][i]:.1f}%"
+        print(f"{rank:<4} {scenarios[i]['name']:<22} {change:<+12.0f} {change_pct:<9} {position:<9} "
+              f"{summary['pnl'][i]:<+12.0f} {summary['stops'][i]:<8} {summary['warnings'][i]:<8}")
+    print("=" * 92)
+    if len(order) > top:
+        print(f"   （只显示最差的 {top} 个，全部情景用 csv/json 输出）")
+
+    worst = order[0]
+    crossings = stop_crossings(holdings, shocks[worst])
+    if crossings:
+        print(f"🆘 最差情景「{scenarios[worst]['name']}」下跌穿止损:")
+        for j, price in crossings:
+            print(f"   {names[j]}({codes[j] or '-'}) 现价 {holdings['current_price'][j]:.2f} → {price:.2f}"
+                  f"（止损价 {holdings['stop_loss'][j]:.2f}）")
+    if missing:
+        print(f"   ⚠️ 持仓里没有这些代码（已忽略）: {', '.join(missing)}")
+    return summary
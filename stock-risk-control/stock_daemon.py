@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 常驻服务
+常驻进程保持数据库连接和查询结果缓存，/risk 命令通过Unix socket转发，省掉每次的解释器启动和数据库初始化；
+多组合（--portfolio）的连接放在有上限的连接池里，结果缓存按组合分开
+"""
+
+import sys
+import os
+import io
+import json
+import socket
+import time
+from collections import OrderedDict
+
+# Unix socket路径
+SOCKET_PATH = "$DATA_DIR/stock_db.sock"
+
+# 客户端等待响应的超时（秒）
+CLIENT_TIMEOUT = 30
+
+# 只读命令（结果可缓存，数据库未变化时直接返回）
+READ_ONLY_COMMANDS = ["列表", "历史", "集中", "分散", "2%分散"]
+
+# 每个组合最多缓存的命令结果条数（按最近使用淘汰；集中/分散的参数各不相同，不设上限会一直涨）
+OUTPUT_CACHE_SIZE = 256
+
+# 耗时长的命令（秒级到分钟级，或一直读价格流）：服务交回客户端在本地执行，不占住常驻服务让其他客户端排队
+LOCAL_COMMANDS = ["行情接入", "ingest", "风险模拟", "simulate", "回测", "backtest",
+                  "导入", "import", "归档", "archive", "压缩行情", "compact-prices"]
+
+class _NeedsStdin(BaseException):
+    """命令要读stdin（批量更新 -、导入 -、行情接入 - 等）：常驻服务拿不到客户端的stdin，交回客户端本地执行
+
+    继承 BaseException：命令里的 except Exception 不会把它吞掉
+    """
+
+class _NoStdin:
+    """常驻服务里命令看到的stdin：读取、迭代、取 buffer/fileno 都抛 _NeedsStdin
+
+    各命令都是先读输入再写数据库，抛出时还没有任何写入，客户端重新执行不会重复
+    """
+
+    def __getattr__(self, name):
+        raise _NeedsStdin()
+
+    def __iter__(self):
+        raise _NeedsStdin()
+
+def _recv_line(sock):
+    """读取一行（以\\n结尾的JSON）"""
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            break
+    return b"".join(chunks)
+
+def _send_json(sock, obj):
+    sock.sendall(json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n")
+
+class StockDaemon:
+    """常驻服务：单线程顺序处理请求，每个组合复用一个数据库连接（连接池有上限）
+
+    sqlite3 连接不能跨线程，所以只在一个线程里执行命令；耗时长的命令（LOCAL_COMMANDS）和要读stdin的命令
+    交回客户端本地执行，服务里只跑毫秒级的命令
+    """
+
+    def __init__(self, socket_path=SOCKET_PATH):
+        import stock_db
+        self.stock_db = stock_db
+        self.socket_path = socket_path
+        stock_db.keep_conn_open()
+        # 只读命令结果缓存，按组合分开：数据库路径 -> [data_version, OrderedDict{(cwd, argv): (退出码, 输出, 错误输出)}]，
+        # 和连接池一样只保留最近用过的组合，每个组合最多 OUTPUT_CACHE_SIZE 条
+        self.caches = OrderedDict()
+        self.stats = {"requests": 0, "cache_hits": 0, "local": 0, "started_at": time.time()}
+        self.running = False
+
+    def _output_cache(self, argv):
+        """这条命令所在组合的结果缓存（其他进程提交写入后 data_version 会变化，缓存清空）；组合名无效时返回 None"""
+        try:
+            conn = self.stock_db.use_portfolio(self.stock_db.pop_portfolio_flag(argv)[1])
+        except ValueError:
+            return None
+        path = self.stock_db.current_db_path()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        entry = self.caches.get(path)
+        if entry is None or entry[0] != version:
+            entry = self.caches[path] = [version, OrderedDict()]
+        self.caches.move_to_end(path)
+        while len(self.caches) > self.stock_db.CONN_POOL_SIZE:
+            self.caches.popitem(last=False)
+        return entry[1]
+
+    def run_command(self, argv, cwd=None):
+        """执行一条命令，返回 (退出码, 输出, 错误输出)；耗时长或要读stdin的命令返回 None（交回客户端本地执行）"""
+        command = argv[1] if len(argv) > 1 else None
+        if command in LOCAL_COMMANDS:
+            self.stats["local"] += 1
+            return None
+        self.stats["requests"] += 1
+
+        cache = self._output_cache(argv)
+        key = (cwd, tuple(argv))
+        if command in READ_ONLY_COMMANDS and cache is not None and key in cache:
+            self.stats["cache_hits"] += 1
+            cache.move_to_end(key)
+            return cache[key]
+
+        if cwd:
+            os.chdir(cwd)
+        out, err = io.StringIO(), io.StringIO()
+        old_stdout, old_stderr, old_stdin = sys.stdout, sys.stderr, sys.stdin
+        sys.stdout, sys.stderr = out, err
+        sys.stdin = _NoStdin()
+        code = 0
+        try:
+            self.stock_db.main(argv)
+        except _NeedsStdin:
+            self.stats["local"] += 1
+            return None
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception as e:
+            out.write(f"❌ 执行失败: {e}\n")
+            code = 1
+        finally:
+            sys.stdout, sys.stderr, sys.stdin = old_stdout, old_stderr, old_stdin
+
+        result = (code, out.getvalue(), err.getvalue())
+        if cache is None:
+            return result
+        if command in READ_ONLY_COMMANDS:
+            cache[key] = result
+            if len(cache) > OUTPUT_CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            # 写命令由本连接提交，data_version不会变，直接清空这个组合的缓存
+            cache.clear()
+        return result
+
+    def _holdings_cache_line(self):
+        """持仓缓存的命中情况（还没用到持仓库时为空）"""
+        portfolio_store = sys.modules.get("portfolio_store")
+        if portfolio_store is None:
+            return ""
+        stats = portfolio_store.HOLDINGS_CACHE.stats
+        return f"   持仓缓存: 命中 {stats['hits']}，未命中 {stats['misses']}，淘汰 {stats['evictions']}\n"
+
+    def _pool_line(self):
+        """组合连接池的使用情况"""
+        pool = self.stock_db._conn_pool
+        return (f"   组合连接: 打开 {len(pool)}/{pool.size}（累计打开 {pool.stats['opened']}，"
+                f"复用 {pool.stats['reused']}，关闭 {pool.stats['closed']}）\n")
+
+    def handle(self, sock):
+        request = json.loads(_recv_line(sock).decode("utf-8") or "{}")
+        if request.get("cmd") == "shutdown":
+            self.running = False
+            _send_json(sock, {"code": 0, "output": "✅ 常驻服务已停止\n"})
+            return
+        if request.get("cmd") == "status":
+            uptime = time.time() - self.stats["started_at"]
+            output = (f"✅ 常驻服务运行中（PID {os.getpid()}）\n"
+                      f"   数据库: {self.stock_db.DB_PATH}（其他组合: {self.stock_db.PORTFOLIO_DIR}）\n"
+                      f"   运行时间: {uptime:.0f}秒\n"
+                      f"   请求数: {self.stats['requests']}（缓存命中 {self.stats['cache_hits']}，"
+                      f"交回客户端本地执行 {self.stats['local']}）\n"
+                      + self._pool_line() + self._holdings_cache_line())
+            _send_json(sock, {"code": 0, "output": output})
+            return
+        result = self.run_command(request.get("argv", ["stock_db.py"]), request.get("cwd"))
+        if result is None:
+            _send_json(sock, {"local": True})
+            return
+        code, output, errors = result
+        _send_json(sock, {"code": code, "output": output, "errors": errors})
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(16)
+        self.running = True
+        print(f"✅ 常驻服务已启动（PID {os.getpid()}）")
+        print(f"   Socket: {self.socket_path}")
+        sys.stdout.flush()
+        try:
+            while self.running:
+                sock, _ = server.accept()
+                # 客户端迟迟不发请求或不收响应时不能一直占着服务
+                sock.settimeout(CLIENT_TIMEOUT)
+                with sock:
+                    try:
+                        self.handle(sock)
+                    except (OSError, ValueError) as e:
+                        print(f"⚠️ 请求处理失败: {e}", file=sys.stderr)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.stock_db.close_conn_pool()
+
+def request(obj, socket_path=SOCKET_PATH):
+    """发送请求给常驻服务，服务未运行时返回None
+
+    连上之后 CLIENT_TIMEOUT 秒内没有响应抛 socket.timeout，响应前断开抛 ConnectionError
+    """
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CLIENT_TIMEOUT)
+        sock.connect(socket_path)
+    except OSError:
+        return None
+    with sock:
+        _send_json(sock, obj)
+        line = _recv_line(sock)
+        if not line:
+            raise ConnectionError("常驻服务断开了连接")
+        return json.loads(line.decode("utf-8"))
+
+def _request_or_exit(obj, socket_path=SOCKET_PATH):
+    """request()，超时或断开时输出错误并退出（命令可能已经在服务里执行，不能在本地重新执行一遍）"""
+    try:
+        return request(obj, socket_path)
+    except socket.timeout:
+        print(f"❌ 常驻服务 {CLIENT_TIMEOUT} 秒内没有响应")
+    except ConnectionError as e:
+        print(f"❌ {e}")
+    print("命令可能已经在服务里执行（写入已提交），先确认结果再决定是否重试")
+    sys.exit(1)
+
+def forward(argv, socket_path=SOCKET_PATH):
+    """客户端：把命令转发给常驻服务；服务未运行、或服务交回（耗时长、要读stdin）时在本进程直接执行
+
+    stdin 不转发：本地执行时命令直接读管道，行情接入可以一直流式读，导入 - 也能读二进制的xlsx
+    """
+    # 客户端环境变量选的组合要跟着命令走（服务进程的环境变量是启动时的）
+    portfolio = os.environ.get("RISK_PORTFOLIO")
+    if portfolio and not any(a == "--portfolio" or a.startswith("--portfolio=") for a in argv):
+        argv = argv + [f"--portfolio={portfolio}"]
+
+    response = _request_or_exit({"argv": argv, "cwd": os.getcwd()}, socket_path)
+    if response is None or response.get("local"):
+        import stock_db
+        stock_db.main(argv)
+        return 0
+
+    sys.stdout.write(response["output"])
+    sys.stderr.write(response.get("errors", ""))
+    return response["code"]
+
+def show_help():
+    """显示帮助"""
+    print("📊 股票风险控制策略 - 常驻服务")
+    print("==============================")
+    print()
+    print("用法:")
+    print("  python3 stock_daemon.py 启动        - 前台启动常驻服务（可用 nohup ... & 放到后台）")
+    print("  python3 stock_daemon.py 停止        - 停止常驻服务")
+    print("  python3 stock_daemon.py 状态        - 查看常驻服务状态")
+    print("  python3 stock_daemon.py <命令...>   - 转发 stock_db.py 命令（如 列表 显示ID），服务未运行时直接本地执行")
+    print()
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        show_help()
+        sys.exit(0)
+
+    command = sys.argv[1]
+
+    if command in ["启动", "start"]:
+        StockDaemon().serve_forever()
+
+    elif command in ["停止", "stop"]:
+        response = _request_or_exit({"cmd": "shutdown"})
+        print(response["output"].rstrip() if response else "📭 常驻服务未运行")
+
+    elif command in ["状态", "status"]:
+        response = _request_or_exit({"cmd": "status"})
+        print(response["output"].rstrip() if response else "📭 常驻服务未运行")
+
+    else:
+        sys.exit(forward(["stock_db.py"] + sys.argv[1:]))
@@ -6,36 +6,604 @@
 
 import sys
 import os
+import random
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 
+import profiling
+
 # 数据库路径
 DB_PATH = "$DATA_DIR/stock_risk_control.db"
 
+# 多组合：--portfolio 名称（或环境变量 RISK_PORTFOLIO）使用 PORTFOLIO_DIR/名称.db，不指定时用 DB_PATH
+PORTFOLIO_DIR = "$DATA_DIR/portfolios"
+PORTFOLIO_ENV_VAR = "RISK_PORTFOLIO"
+DEFAULT_PORTFOLIO_NAMES = ("默认", "default")
+PORTFOLIO_NAME_MAX = 64
+
+# 常驻进程同时打开的组合数据库上限（每个WAL连接占3个文件句柄），超出时关闭最久没用的
+CONN_POOL_SIZE = 64
+
+# 建表脚本路径
+SCHEMA_PATH = "$SKILL_DIR/init_db.sql"
+
 # 默认总资金
 DEFAULT_TOTAL_CAPITAL = 100000
 
-def init_db():
-    """初始化数据库"""
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    
-    if not os.path.exists(DB_PATH):
-        print("📦 初始化数据库...")
-        with open("$SKILL_DIR/init_db.sql", "r") as f:
-            schema = f.read()
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.executescript(schema)
+# 价格历史按整数存储：价格 × PRICE_SCALE
+PRICE_SCALE = 10000
+
+# 日K线按北京时间划分交易日
+MARKET_UTC_OFFSET = 8 * 3600
+
+# 连接参数：等锁超时（毫秒）、写入重试次数、退避基数（秒）
+BUSY_TIMEOUT_MS = 5000
+WRITE_RETRIES = 5
+WRITE_BACKOFF = 0.05
+
+# 进程内写入串行化
+_write_lock = threading.Lock()
+
+# 写入统计（压力测试用）
+WRITE_STATS = {"commits": 0, "retries": 0, "failures": 0}
+
+# 已确认结构为最新版本的数据库路径（每个进程对同一个数据库只检查一次 user_version）
+_ready_db_paths = set()
+
+# 常驻进程复用的连接（见 keep_conn_open）：_shared_conn 是当前组合的连接，_conn_pool 按数据库路径保存各组合的连接
+_shared_conn = None
+_conn_pool = None
+
+# 当前组合（None 为默认组合 DB_PATH，见 use_portfolio）
+_portfolio = None
+
+def _migrate_base_schema(conn):
+    """v1：基础表结构（init_db.sql，全部 IF NOT EXISTS）"""
+    with open(SCHEMA_PATH, "r") as f:
+        conn.executescript(f.read())
+
+def _migrate_mode_check(conn):
+    """v2：旧库的 mode CHECK 只允许 '2%集中'/'2%分散'，而程序写入的是 '集中'，重建表放开约束"""
+    conn.execute("BEGIN IMMEDIATE")
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'stocks'").fetchone()[0]
+    old_check = "CHECK(mode IN ('2%集中', '2%分散'))"
+    if old_check not in sql:
+        conn.rollback()
+        return
+    new_sql = sql.replace(old_check, "CHECK(mode IN ('集中', '2%集中', '2%分散'))", 1)
+    new_sql = new_sql.replace("CREATE TABLE stocks", "CREATE TABLE stocks_new", 1)
+    conn.execute(new_sql)
+    conn.execute("INSERT INTO stocks_new SELECT * FROM stocks")
+    conn.execute("DROP TABLE stocks")
+    conn.execute("ALTER TABLE stocks_new RENAME TO stocks")
+    conn.commit()
+    # 重建表会丢掉索引，重新执行建表脚本把索引补回来
+    _migrate_base_schema(conn)
+
+# stocks 表的全部字段（归档时整行搬到 stocks_archive，两表字段一致）
+STOCK_COLUMNS = ("id", "name", "code", "mode", "quantity", "position", "total_value", "cost_price", "stop_loss",
+                 "current_price", "hold_reason", "pnl", "pnl_percent", "created_at", "updated_at", "is_deleted",
+                 "deleted_at")
+
+def _migrate_archive(conn):
+    """v6：已删除持仓的归档表；数据库改为增量VACUUM（归档后逐批回收空闲页，见 PortfolioStore.vacuum）"""
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS stocks_archive (
+            id INTEGER PRIMARY KEY,    -- 沿用 stocks 里的id（AUTOINCREMENT，不会重复）
+            name TEXT NOT NULL,
+            code TEXT,
+            mode TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            position REAL NOT NULL,
+            total_value REAL NOT NULL,
+            cost_price REAL,
+            stop_loss REAL NOT NULL,
+            current_price REAL NOT NULL,
+            hold_reason TEXT,
+            pnl REAL,
+            pnl_percent REAL,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            is_deleted INTEGER DEFAULT 1,
+            deleted_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        -- 历史按 (仓位 DESC, id) 归并两张表，两边都走索引
+        CREATE INDEX IF NOT EXISTS idx_archive_position ON stocks_archive(position DESC, id);
+        -- 只索引已删除的行，找可归档的行不用扫全表
+        CREATE INDEX IF NOT EXISTS idx_stocks_deleted_at ON stocks(deleted_at) WHERE is_deleted = 1;
+    """)
+    # auto_vacuum 要在 VACUUM 之后才生效；新库此时还很小，旧库只在升级时整理这一次
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+# 持有理由全文索引：按相邻两字切分，unicode61 再去掉标点、统一大小写，中文不需要分词词典；
+# 查询时关键词也按相邻两字拆成短语，相当于带索引的子串匹配
+def reason_tokens(text):
+    """持有理由 → 索引内容：每个位置起的两个字（最后一个字单独一项），空格分隔
+
+    中文不分词，按相邻两字建索引后任意长度的子串都能查：两字以上查相邻的两字组成的短语，单字查前缀
+    """
+    return " ".join(text[i:i + 2] for i in range(len(text)))
+
+# 触发器里的 reason_tokens（SQL版）；理由为空时不插入
+_REASON_TOKENS_SQL = """
+            SELECT id, reason FROM (
+                SELECT NEW.id AS id, group_concat(substr(NEW.hold_reason, i, 2), ' ') AS reason FROM (
+                    WITH RECURSIVE chars(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM chars WHERE i < length(NEW.hold_reason))
+                    SELECT i FROM chars
+                )
+            )
+            WHERE TRIM(IFNULL(NEW.hold_reason, '')) != ''"""
+
+def _migrate_reason_fts(conn):
+    """v7：持有理由全文索引（FTS5），stocks 上的触发器同步，已有的持有理由（含归档）一次性补进索引"""
+    conn.executescript(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS reason_fts USING fts5(reason, tokenize = 'unicode61', prefix = '1');
+
+        CREATE TRIGGER IF NOT EXISTS trg_reason_insert AFTER INSERT ON stocks
+        WHEN TRIM(IFNULL(NEW.hold_reason, '')) != ''
+        BEGIN
+            INSERT INTO reason_fts (rowid, reason) {_REASON_TOKENS_SQL};
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_reason_update AFTER UPDATE OF hold_reason ON stocks
+        BEGIN
+            DELETE FROM reason_fts WHERE rowid = OLD.id;
+            INSERT INTO reason_fts (rowid, reason) {_REASON_TOKENS_SQL};
+        END;
+
+        -- 归档是先写 stocks_archive 再从 stocks 删除，已归档的行保留索引
+        CREATE TRIGGER IF NOT EXISTS trg_reason_delete AFTER DELETE ON stocks
+        WHEN NOT EXISTS (SELECT 1 FROM stocks_archive WHERE id = OLD.id)
+        BEGIN
+            DELETE FROM reason_fts WHERE rowid = OLD.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_reason_archive_delete AFTER DELETE ON stocks_archive
+        WHEN NOT EXISTS (SELECT 1 FROM stocks WHERE id = OLD.id)
+        BEGIN
+            DELETE FROM reason_fts WHERE rowid = OLD.id;
+        END;
+    """)
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("DELETE FROM reason_fts")
+    rows = conn.execute("""
+        SELECT id, hold_reason FROM stocks WHERE TRIM(IFNULL(hold_reason, '')) != ''
+        UNION ALL
+        SELECT id, hold_reason FROM stocks_archive WHERE TRIM(IFNULL(hold_reason, '')) != ''
+    """).fetchall()
+    conn.executemany("INSERT INTO reason_fts (rowid, reason) VALUES (?, ?)",
+                     [(stock_id, reason_tokens(reason)) for stock_id, reason in rows])
+    conn.commit()
+
+def _migrate_live_code(conn):
+    """v8：按代码查找未删除持仓的索引；持有理由没变时不再重建全文索引（批量更新会带上 hold_reason 列）"""
+    conn.executescript(f"""
+        CREATE INDEX IF NOT EXISTS idx_stocks_live_code ON stocks(code) WHERE is_deleted = 0;
+
+        DROP TRIGGER IF EXISTS trg_reason_update;
+        CREATE TRIGGER trg_reason_update AFTER UPDATE OF hold_reason ON stocks
+        WHEN NEW.hold_reason IS NOT OLD.hold_reason
+        BEGIN
+            DELETE FROM reason_fts WHERE rowid = OLD.id;
+            INSERT INTO reason_fts (rowid, reason) {_REASON_TOKENS_SQL};
+        END;
+    """)
+
+def _migrate_trades(conn):
+    """v9：交易流水（只追加）和持仓快照，stocks 的数量/成本价由流水推出
+
+    已有持仓各补一笔期初校正（建仓时间），已删除的再补一笔清零（删除时间），之后按某个时间点回溯能得到当时的持仓
+    """
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS trades (
+            id INTEGER PRIMARY KEY,
+            stock_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,       -- 成交时间（Unix秒）
+            kind TEXT NOT NULL CHECK(kind IN ('买入', '卖出', '校正')),
+            quantity REAL NOT NULL,    -- 买入/卖出为成交数量；校正为校正后的持有数量
+            price INTEGER,             -- 成交价 × PRICE_SCALE；校正为校正后的成本价（可以为空，同 stocks.cost_price）
+            note TEXT
+        );
+        -- 回溯按 (ts, id) 重放全部持仓，单只持仓按 (stock_id, ts, id) 重放
+        CREATE INDEX IF NOT EXISTS idx_trades_ts ON trades(ts);
+        CREATE INDEX IF NOT EXISTS idx_trades_stock ON trades(stock_id, ts);
+
+        -- 快照：ts 及之前全部交易重放后的持仓（只存数量不为0的），回溯从最近的快照开始重放
+        CREATE TABLE IF NOT EXISTS trade_snapshots (
+            id INTEGER PRIMARY KEY,
+            ts INTEGER NOT NULL UNIQUE,
+            trade_id INTEGER NOT NULL  -- 快照包含的最大交易id：id 更大的交易成交时间都更晚（否则快照已作废）
+        );
+        CREATE TABLE IF NOT EXISTS snapshot_positions (
+            snapshot_id INTEGER NOT NULL,
+            stock_id INTEGER NOT NULL,
+            quantity REAL NOT NULL,
+            cost_price REAL,
+            PRIMARY KEY (snapshot_id, stock_id)
+        ) WITHOUT ROWID;
+
+        -- 补录的交易（成交时间不晚于已有快照）让之后的快照作废，下次写入时重新生成
+        CREATE TRIGGER IF NOT EXISTS trg_trades_backfill AFTER INSERT ON trades
+        WHEN NEW.ts <= (SELECT MAX(ts) FROM trade_snapshots)
+        BEGIN
+            DELETE FROM snapshot_positions
+            WHERE snapshot_id IN (SELECT id FROM trade_snapshots WHERE ts >= NEW.ts);
+            DELETE FROM trade_snapshots WHERE ts >= NEW.ts;
+        END;
+
+        -- 流水只追加，记错了用新的交易或校正冲回
+        CREATE TRIGGER IF NOT EXISTS trg_trades_update BEFORE UPDATE ON trades
+        BEGIN
+            SELECT RAISE(ABORT, '交易流水只能追加');
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_trades_delete BEFORE DELETE ON trades
+        BEGIN
+            SELECT RAISE(ABORT, '交易流水只能追加');
+        END;
+    """)
+    if conn.execute("SELECT 1 FROM trades LIMIT 1").fetchone():
+        return
+    with conn:
+        conn.execute(f"""
+            INSERT INTO trades (stock_id, ts, kind, quantity, price, note)
+            SELECT id, ts, '校正', quantity, price, note FROM (
+                SELECT id, CAST(strftime('%s', IFNULL(created_at, 'now')) AS INTEGER) AS ts, quantity,
+                       CAST(ROUND(cost_price * {PRICE_SCALE}) AS INTEGER) AS price, '期初' AS note
+                FROM (SELECT id, created_at, quantity, cost_price FROM stocks
+                      UNION ALL
+                      SELECT id, created_at, quantity, cost_price FROM stocks_archive)
+                UNION ALL
+                SELECT id, CAST(strftime('%s', IFNULL(deleted_at, IFNULL(created_at, 'now'))) AS INTEGER), 0, NULL, '删除'
+                FROM (SELECT id, created_at, deleted_at FROM stocks WHERE is_deleted = 1
+                      UNION ALL
+                      SELECT id, created_at, deleted_at FROM stocks_archive)
+            )
+            ORDER BY ts, id, note = '删除'
+        """)
+
+def _migrate_price_stats(conn):
+    """v10：价格滚动统计（ATR、波动率，写入价格时增量更新），已有的日K线按顺序重算一遍"""
+    import volatility
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS price_stats (
+            stock_id INTEGER PRIMARY KEY,
+            day INTEGER NOT NULL,          -- 当前交易日（北京时间，Unix天数）
+            high INTEGER NOT NULL,         -- 当前交易日的最高/最低/最新价 × PRICE_SCALE
+            low INTEGER NOT NULL,
+            close INTEGER NOT NULL,
+            prev_close INTEGER,            -- 上一个交易日的收盘价 × PRICE_SCALE（第一天为空）
+            trough INTEGER NOT NULL,       -- 有价格记录以来的最低价 × PRICE_SCALE
+            days INTEGER NOT NULL,         -- 环形缓冲里的完整交易日数（最多 volatility.STATS_WINDOW）
+            ret_days INTEGER NOT NULL,     -- 其中有对数收益的天数
+            pos INTEGER NOT NULL,          -- 下一个写入位置
+            tr_sum REAL NOT NULL,          -- 缓冲里的真实波幅之和（元）
+            ret_sum REAL NOT NULL,         -- 缓冲里的对数收益之和、平方和
+            ret_sq_sum REAL NOT NULL,
+            ring BLOB NOT NULL             -- 环形缓冲：每天 (真实波幅, 对数收益) 两个float64
+        );
+    """)
+    with conn:
+        volatility.rebuild_stats(conn.cursor())
+
+# 数据库迁移：按顺序执行，PRAGMA user_version 记录已执行到第几步
+# 每一步都必须可重复执行（IF NOT EXISTS 或先检查再改），新迁移只能追加到末尾
+MIGRATIONS = [
+    ("基础表结构", _migrate_base_schema),
+    ("模式约束兼容'集中'", _migrate_mode_check),
+    ("列表/历史复合索引", """
+        CREATE INDEX IF NOT EXISTS idx_stocks_live_position ON stocks(is_deleted, position DESC, id);
+        CREATE INDEX IF NOT EXISTS idx_stocks_position ON stocks(position DESC, id);
+        DROP INDEX IF EXISTS idx_stocks_is_deleted;
+    """),
+    ("价格历史表（原始价格 + 日K线）", """
+        CREATE TABLE IF NOT EXISTS prices (
+            stock_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,       -- Unix时间戳（秒）
+            price INTEGER NOT NULL,    -- 价格 × PRICE_SCALE
+            PRIMARY KEY (stock_id, ts)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS price_bars (
+            stock_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,      -- 交易日（北京时间，Unix天数）
+            open INTEGER NOT NULL,
+            high INTEGER NOT NULL,
+            low INTEGER NOT NULL,
+            close INTEGER NOT NULL,
+            ticks INTEGER NOT NULL,    -- 合并的原始价格条数
+            PRIMARY KEY (stock_id, day)
+        ) WITHOUT ROWID;
+    """),
+    ("持仓汇总表（触发器维护）", """
+        -- 未删除持仓按模式汇总，stocks 的插入/更新/删除（含软删除）由触发器同步，汇总查询不用扫表
+        CREATE TABLE IF NOT EXISTS portfolio_totals (
+            mode TEXT PRIMARY KEY,
+            holdings INTEGER NOT NULL,    -- 只数
+            total_value REAL NOT NULL,    -- 个股市值合计
+            position REAL NOT NULL,       -- 仓位合计（%）
+            pnl REAL NOT NULL             -- 盈亏合计
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS trg_totals_insert AFTER INSERT ON stocks
+        WHEN NEW.is_deleted = 0
+        BEGIN
+            INSERT INTO portfolio_totals (mode, holdings, total_value, position, pnl)
+            VALUES (NEW.mode, 1, NEW.total_value, NEW.position, IFNULL(NEW.pnl, 0))
+            ON CONFLICT (mode) DO UPDATE SET
+                holdings = holdings + 1,
+                total_value = total_value + excluded.total_value,
+                position = position + excluded.position,
+                pnl = pnl + excluded.pnl;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_totals_delete AFTER DELETE ON stocks
+        WHEN OLD.is_deleted = 0
+        BEGIN
+            UPDATE portfolio_totals SET
+                holdings = holdings - 1,
+                total_value = total_value - OLD.total_value,
+                position = position - OLD.position,
+                pnl = pnl - IFNULL(OLD.pnl, 0)
+            WHERE mode = OLD.mode;
+        END;
+
+        -- 最常见的情况：更新现价，模式不变，只改一行汇总
+        CREATE TRIGGER IF NOT EXISTS trg_totals_update AFTER UPDATE OF mode, total_value, position, pnl, is_deleted ON stocks
+        WHEN OLD.is_deleted = 0 AND NEW.is_deleted = 0 AND OLD.mode = NEW.mode
+        BEGIN
+            UPDATE portfolio_totals SET
+                total_value = total_value + NEW.total_value - OLD.total_value,
+                position = position + NEW.position - OLD.position,
+                pnl = pnl + IFNULL(NEW.pnl, 0) - IFNULL(OLD.pnl, 0)
+            WHERE mode = NEW.mode;
+        END;
+
+        -- 模式变化、软删除（is_deleted 0 → 1）或恢复：从旧模式减去，加到新模式
+        CREATE TRIGGER IF NOT EXISTS trg_totals_move AFTER UPDATE OF mode, total_value, position, pnl, is_deleted ON stocks
+        WHEN NOT (OLD.is_deleted = 0 AND NEW.is_deleted = 0 AND OLD.mode = NEW.mode)
+        BEGIN
+            UPDATE portfolio_totals SET
+                holdings = holdings - 1,
+                total_value = total_value - OLD.total_value,
+                position = position - OLD.position,
+                pnl = pnl - IFNULL(OLD.pnl, 0)
+            WHERE mode = OLD.mode AND OLD.is_deleted = 0;
+            INSERT INTO portfolio_totals (mode, holdings, total_value, position, pnl)
+            SELECT NEW.mode, 1, NEW.total_value, NEW.position, IFNULL(NEW.pnl, 0)
+            WHERE NEW.is_deleted = 0
+            ON CONFLICT (mode) DO UPDATE SET
+                holdings = holdings + 1,
+                total_value = total_value + excluded.total_value,
+                position = position + excluded.position,
+                pnl = pnl + excluded.pnl;
+        END;
+
+        -- 已有数据：按当前持仓重新汇总
+        DELETE FROM portfolio_totals;
+        INSERT INTO portfolio_totals (mode, holdings, total_value, position, pnl)
+        SELECT mode, COUNT(*), TOTAL(total_value), TOTAL(position), TOTAL(pnl)
+        FROM stocks WHERE is_deleted = 0 GROUP BY mode;
+    """),
+    ("已删除持仓归档表（增量VACUUM）", _migrate_archive),
+    ("持有理由全文索引（FTS5）", _migrate_reason_fts),
+    ("按代码查找未删除持仓的索引（导入按代码合并）", _migrate_live_code),
+    ("交易流水和持仓快照（按时间点回溯持仓）", _migrate_trades),
+    ("价格滚动统计（ATR、波动率，止损建议）", _migrate_price_stats),
+    ("组合设置（总资金，重算时保存）", """
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value NOT NULL
+        ) WITHOUT ROWID;
+    """),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn, verbose=True):
+    """执行尚未执行的迁移步骤，返回执行的步骤数（提示信息输出到stderr，不影响json/csv输出）"""
+    applied = 0
+    while True:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            break
+        description, step = MIGRATIONS[version]
+        if applied == 0 and verbose:
+            is_new = version == 0 and not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'stocks'").fetchone()
+            print("📦 初始化数据库..." if is_new else f"📦 升级数据库（v{version} → v{SCHEMA_VERSION}）...", file=sys.stderr)
+        if callable(step):
+            step(conn)
+        else:
+            # CREATE INDEX 在WAL模式下只阻塞写入，读取照常进行
+            conn.executescript(step)
+        conn.execute(f"PRAGMA user_version = {version + 1}")
         conn.commit()
+        if verbose:
+            print(f"   v{version + 1}: {description}", file=sys.stderr)
+        applied += 1
+    if applied and verbose:
+        print("✅ 数据库初始化完成！", file=sys.stderr)
+    return applied
+
+def _open_conn(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, factory=profiling.connection_factory())
+    # WAL：读写互不阻塞，多个会话同时读写不再报 database is locked
+    conn.execute("PRAGMA journal_mode = WAL")
+    return conn
+
+def open_db(path, verbose=True):
+    """打开数据库连接（WAL模式、synchronous=NORMAL、等锁超时），每个数据库首次打开时检查并执行迁移
+
+    verbose=False 时迁移不输出提示（嵌入到其他程序里使用时）
+    """
+    with profiling.span("connect"):
+        try:
+            conn = _open_conn(path)
+        except sqlite3.OperationalError:
+            # 数据目录还不存在
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            conn = _open_conn(path)
+        # WAL下NORMAL只在checkpoint时fsync，掉电最多丢最近的事务，不会损坏数据库
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        if path not in _ready_db_paths:
+            migrate(conn, verbose)
+            _ready_db_paths.add(path)
+    return conn
+
+def portfolio_path(name=None):
+    """组合名 → 数据库路径（None/默认 为 DB_PATH）；名称只能用字母、数字、汉字和 _ - .，不能以 . 开头"""
+    if name is None or name in DEFAULT_PORTFOLIO_NAMES:
+        return DB_PATH
+    if len(name) > PORTFOLIO_NAME_MAX or name.startswith(".") or not all(c.isalnum() or c in "_-." for c in name):
+        raise ValueError(f"组合名无效: {name!r}（只能用字母、数字、汉字和 _ - .，不能以 . 开头，最长{PORTFOLIO_NAME_MAX}个字符）")
+    return os.path.join(PORTFOLIO_DIR, f"{name}.db")
+
+def pop_portfolio_flag(argv):
+    """从参数里取出 --portfolio 名称 / --portfolio=名称（没给时看环境变量 RISK_PORTFOLIO），返回 (剩余参数, 组合名或None)"""
+    rest, name = [], None
+    args = iter(argv)
+    for arg in args:
+        if arg == "--portfolio":
+            name = next(args, None)
+            if name is None:
+                raise ValueError("--portfolio 缺少参数值")
+        elif arg.startswith("--portfolio="):
+            name = arg.split("=", 1)[1]
+        else:
+            rest.append(arg)
+    return rest, name if name is not None else (os.environ.get(PORTFOLIO_ENV_VAR) or None)
+
+def use_portfolio(name=None):
+    """切换当前组合（之后 get_conn() 打开这个组合的数据库）；常驻进程从连接池取出这个组合的连接并返回"""
+    global _portfolio, _shared_conn
+    path = portfolio_path(name)
+    _portfolio = None if name in DEFAULT_PORTFOLIO_NAMES else name
+    if _conn_pool is not None:
+        _shared_conn = _conn_pool.acquire(path)
+    return _shared_conn
+
+def current_db_path():
+    """当前组合的数据库路径"""
+    return portfolio_path(_portfolio)
+
+class ConnectionPool:
+    """按数据库路径复用连接（常驻进程用），LRU：超过 size 个时关闭最久没用的连接
+
+    单线程使用（sqlite3 连接默认不能跨线程）；关闭连接时顺带丢掉持仓缓存里这个连接的条目
+    """
+
+    def __init__(self, size=CONN_POOL_SIZE):
+        self.size = size
+        self._conns = OrderedDict()
+        self.stats = {"opened": 0, "reused": 0, "closed": 0}
+
+    def __len__(self):
+        return len(self._conns)
+
+    def acquire(self, path):
+        conn = self._conns.get(path)
+        if conn is not None:
+            self._conns.move_to_end(path)
+            self.stats["reused"] += 1
+            return conn
+        conn = self._conns[path] = open_db(path)
+        self.stats["opened"] += 1
+        while len(self._conns) > self.size:
+            self._close(self._conns.popitem(last=False)[1])
+        return conn
+
+    def _close(self, conn):
+        portfolio_store = sys.modules.get("portfolio_store")
+        if portfolio_store is not None:
+            portfolio_store.HOLDINGS_CACHE.discard(conn)
         conn.close()
-        print("✅ 数据库初始化完成！")
-    else:
-        pass
+        self.stats["closed"] += 1
+
+    def close_all(self):
+        while self._conns:
+            self._close(self._conns.popitem(last=False)[1])
 
 def get_conn():
-    """获取数据库连接"""
-    return sqlite3.connect(DB_PATH)
+    """获取数据库连接：常驻进程返回当前组合的共享连接，否则打开当前组合的数据库"""
+    if _shared_conn is not None:
+        return _shared_conn
+    return open_db(current_db_path())
+
+def init_db():
+    """初始化/升级数据库（get_conn首次打开时会自动执行，这里只是显式入口）"""
+    release_conn(get_conn())
+
+def release_conn(conn):
+    """归还连接：常驻进程的共享连接保持打开，其余直接关闭"""
+    if conn is not _shared_conn:
+        conn.close()
+
+def load_total_capital(conn):
+    """组合保存的总资金（重算时保存），没有保存过时为 DEFAULT_TOTAL_CAPITAL"""
+    row = conn.execute("SELECT value FROM settings WHERE key = 'total_capital'").fetchone()
+    return float(row[0]) if row else DEFAULT_TOTAL_CAPITAL
+
+def save_total_capital(cursor, total_capital):
+    """保存组合的总资金（在调用方的写事务内执行）"""
+    cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('total_capital', ?)", (total_capital,))
+
+def get_total_capital():
+    """当前组合的总资金（命令行没给 --capital 时用）"""
+    conn = get_conn()
+    try:
+        return load_total_capital(conn)
+    finally:
+        release_conn(conn)
+
+def keep_conn_open(pool_size=CONN_POOL_SIZE):
+    """常驻模式：建立连接池并打开当前组合的共享连接，之后get_conn()都返回当前组合的连接（见 use_portfolio）"""
+    global _conn_pool
+    if _conn_pool is None:
+        _conn_pool = ConnectionPool(pool_size)
+    return use_portfolio(_portfolio)
+
+def close_conn_pool():
+    """退出常驻模式：关闭连接池里的所有连接"""
+    global _conn_pool, _shared_conn
+    if _conn_pool is not None:
+        _conn_pool.close_all()
+    _conn_pool = _shared_conn = None
+
+def _is_lock_error(e):
+    """是否为锁冲突错误（可重试）"""
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+def run_write(conn, write_fn):
+    """串行写入：进程内加锁 + BEGIN IMMEDIATE 抢写锁，锁冲突时有限次指数退避重试
+
+    write_fn(cursor) 在事务内执行（不要自己commit），返回值原样返回
+    """
+    for attempt in range(WRITE_RETRIES + 1):
+        with _write_lock:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                result = write_fn(conn.cursor())
+                conn.commit()
+                WRITE_STATS["commits"] += 1
+                return result
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if not _is_lock_error(e) or attempt == WRITE_RETRIES:
+                    WRITE_STATS["failures"] += 1
+                    raise
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+        WRITE_STATS["retries"] += 1
+        time.sleep(WRITE_BACKOFF * (2 ** attempt) * (0.5 + random.random()))
 
 def show_help():
     """显示帮助"""
@@ -47,12 +615,46 @@ def show_help():
     print("  /risk 列表 显示总值                                 - 查看所有持仓股票（显示总值，不显示ID）")
     print("  /risk 列表 显示ID                                   - 查看所有持仓股票（不显示总值，显示ID）")
     print("  /risk 列表 显示总值 显示ID                         - 查看所有持仓股票（显示总值和ID）")
+    print("  /risk 列表 [显示...] json|csv                        - 机器可读输出（json/csv包含全部字段）")
     print("  /risk 添加 <名称> <代码> <模式> <持有数量> <成本价> <止损价> <现价> [总资金] [持有理由]")
     print("  /risk 更新 <id> <现价> [持有理由]                   - 更新现价（每日更新）")
+    print("  /risk 批量更新 [文件|-] [按代码] [总资金]            - 批量更新现价（CSV：id,现价 或 code,现价，一个事务写入）")
+    print("  /risk 导入 <文件.csv|xlsx|-> [--mapping 列映射.json] [--batch 5000] [--capital 总资金] [--stop-pct 8]")
+    print("                                                       - 导入券商持仓导出（按代码合并：已有的更新、没有的新增，错误行写入拒绝文件）")
+    print("  /risk 交易 <id> <买入|卖出> <数量> <价格> [--time 成交时间] [--capital 总资金] [备注]")
+    print("                                                       - 记一笔交易，数量和成本价按交易流水重新推出（卖光即删除）")
+    print("  /risk 回溯 <日期|\"日期 时间\"|当前> [id] [json|csv]    - 按交易流水回溯某个时间点的持仓（北京时间，只写日期为当天收盘后）")
+    print("  /risk 重算 [总资金] [预览]                          - 总资金变化后重算全部持仓的仓位、模式、盈亏并保存总资金（需要NumPy）")
+    print("  /risk 行情接入 <文件|管道|-|tcp:端口> [--interval 毫秒] [--batch 数量] [--capital 总资金]")
+    print("                                                       - 接入实时价格流（JSONL），按代码合并后批量写入")
+    print("  /risk 风险模拟 [--paths N] [--horizon 天数] [--returns 文件] [--workers N] [--capital 总资金]")
+    print("                                                       - 蒙特卡洛模拟组合VaR/CVaR/最大回撤（按止损价离场，需要NumPy）")
+    print("  /risk 回测 <日K线CSV目录> [--stop-pct 8] [--breakout 20] [--risk 2] [--capital 总资金] [--workers N] [--out 目录]")
+    print("                                                       - 用历史日K线回放2%规则，输出资金曲线和交易记录（需要NumPy）")
+    print("  /risk 调仓 [总资金] [--cash 可用现金] [--lot 100] [只卖] [csv|json]")
+    print("                                                       - 按集中建议仓位算出整手买卖股数（跌穿止损清仓、超仓减仓、现金内加仓，需要NumPy）")
+    print("  /risk 情景 <情景文件.json | 涨跌幅...> [--capital 总资金] [--top N] [csv|json]")
+    print("                                                       - 情景分析：整体/按代码/按标签的价格冲击下的市值变化和跌穿止损（需要NumPy）")
+    print("  /risk 止损监控 [文件|-]                             - 回放价格（CSV：code,现价），输出跌穿止损/进入10%警戒的变化")
+    print("  /risk 行情 [天数] [id]                              - 最近N天价格走势（默认30天，指定id显示日K线）")
+    print("  /risk 压缩行情 [保留天数]                            - 删除保留天数（默认30）之前的原始价格，只保留日K线")
+    print("  /risk 搜索 <关键词...> [--limit 20] [历史] [json|csv]  - 按持有理由全文搜索（相关度排序，显示匹配片段；历史：含已删除）")
+    print("  /risk 归档 [天数] [--batch 5000] [预览]               - 删除超过N天（默认30）的持仓移到归档表，回收空闲页")
+    print("  /risk 汇总 [校验|修复]                              - 按模式汇总只数、总值、仓位、盈亏（校验：全表重算对比）")
+    print("  /risk 止损建议 [id] [--atr 2] [--risk 2] [csv|json]")
+    print("                                                       - 按20日ATR检查止损价是否在日常波动以内，给出 现价-2×ATR 的止损和2%原则仓位")
+    print("  /risk 止损建议 重建                                 - 按日K线重新计算波动统计（补录旧价格、压缩行情之后）")
+    print("  /risk 汇总 全部组合 [--workers 8]                   - 所有组合并发汇总（每个组合一行，再按模式合计）")
+    print("  /risk 性能报告 [记录文件...] [--cmd 命令] [csv|json]  - 按阶段汇总 --profile 记录的耗时（p50/p95）")
     print("  /risk 删除 <id>                                       - 软删除股票（数据还在）")
-    print("  /risk 历史                                           - 查看历史记录（包括已删除）")
+    print("  /risk 历史 [显示...] [json|csv]                      - 查看历史记录（包括已删除和已归档）")
+    print("  /risk 列表|历史 ... --limit N [--after 仓位,ID]      - 分页查看（按仓位从高到低，下一页游标在末尾给出）")
     print("  /risk 集中 <现价> <止损价> [目标风险]              - 计算集中仓位（目标风险默认2%）")
     print("  /risk 分散 <现价> <止损价> [目标风险]              - 计算2%分散仓位（目标风险默认2%）")
+    print("  /risk 批量仓位 [文件|-] [--risk 2] [--capital 总资金] [csv|json]")
+    print("                                                       - 批量计算集中仓位（CSV：code,现价,止损价[,目标风险]，需要NumPy）")
+    print("  /risk 仓位网格 --price 起:止:步长 --stop 起:止:步长 [--risk 0.5,1,2] [表格|csv|json]")
+    print("                                                       - 现价×止损价×目标风险的仓位网格（需要NumPy）")
     print()
     print("说明:")
     print("  - 仓位/总值: 可以输入百分比（如11.8）或总金额（如5000）")
@@ -61,13 +663,29 @@ def show_help():
     print("  - 持有理由: 可选，记录持有这只股票的理由")
     print("  - 列表默认不显示总值和ID，需要时用'显示总值'或'显示ID'")
     print("  - 模式: '集中'或'分散'（之前的'集中'/'2%分散'也兼容）")
+    print("  - --profile[=文件]: 任何命令都可以加，按阶段记录耗时（JSON Lines，也可用环境变量 RISK_PROFILE）")
+    print("  - --portfolio 组合名: 任何命令都可以加，每个组合一个数据库（也可用环境变量 RISK_PORTFOLIO，不指定为默认组合）")
     print()
     print("示例:")
     print("  /risk 集中 2960 2457")
     print("  /risk 集中 2960 2457 1")
+    print("  /risk 批量仓位 watchlist.csv --capital 600000 json")
+    print("  /risk 情景 -5 -10 -20 --capital 600000")
+    print("  /risk 调仓 600000")
+    print("  /risk 列表 --profile=profile.jsonl")
+    print("  /risk 搜索 芯片 龙头")
+    print("  /risk 仓位网格 --price 2800:3000:50 --stop 2400:2600:50 --risk 1,2")
     print("  /risk 添加 上证50 000016 集中 11.8 2457 2457 2960")
     print("  /risk 添加 股票B 000010 集中 5000 1.00 0.80 1.00 100000 \"AI趋势\"")
     print("  /risk 添加 股票A 688008 集中 80 80 80 80 100000 \"芯片龙头\"")
+    print("  /risk 批量更新 prices.csv")
+    print("  cat prices.csv | /risk 批量更新 - 按代码")
+    print("  /risk 导入 持仓.csv --capital 600000")
+    print("  /risk 交易 1 卖出 200 2457 止损离场")
+    print("  /risk 回溯 2024-03-01")
+    print("  /risk 止损建议 --atr 2.5")
+    print("  /risk 列表 --portfolio 趋势策略")
+    print("  /risk 汇总 全部组合")
     print()
 
 def calculate_pnl(current_price, cost_price, position, total_value):
@@ -92,14 +710,14 @@ def calculate_position(total_value, total_capital=DEFAULT_TOTAL_CAPITAL):
 
 def calculate_concentrated(current_price, stop_loss, target_risk=2):
     """计算集中仓位（支持自定义目标风险）"""
-    stop_loss_drop = 1 - stop_loss / current_price
-    if stop_loss_drop <= 0:
-        print("❌ 止损价必须小于现价")
+    from portfolio_store import size_position
+    try:
+        sizing = size_position(current_price, stop_loss, target_risk)
+    except ValueError as e:
+        print(f"❌ {e}")
         return
-    
-    position = target_risk / (stop_loss_drop * 100)
-    position_pct = position * 100
-    stop_loss_drop_pct = stop_loss_drop * 100
+    position_pct = sizing.position_pct
+    stop_loss_drop_pct = sizing.stop_loss_drop_pct
     
     print(f"📊 {target_risk}%集中仓位计算")
     print("────────────────────────")
@@ -188,346 +806,244 @@ def get_simple_suggestion(mode, current_price, stop_loss, position, hold_reason)
     else:
         return "-"
 
-def list_stocks(show_deleted=False, show_total=False, show_id=False, show_cost=False, show_quantity=False, show_mode=False, show_reason=False, show_code=False):
-    """列出股票"""
-    init_db()
-    conn = get_conn()
-    cursor = conn.cursor()
-    
+def simplify_mode(mode):
+    """简化模式名称：2%分散 → 分散"""
+    if mode == "2%分散":
+        return "分散"
+    return mode
+
+def format_pnl_percent(pnl_percent):
+    """盈亏%符号规则：盈利加+，亏损带-"""
+    if pnl_percent is None:
+        return "-"
+    if pnl_percent > 0:
+        return f"+{pnl_percent:.2f}%"
+    return f"{pnl_percent:.2f}%"
+
+def format_reason(hold_reason):
+    """持有理由超过18个字截断"""
+    if hold_reason and len(hold_reason) > 18:
+        return hold_reason[:18] + ".."
+    return hold_reason or "-"
+
+# 列表列定义：(字段, 显示开关, 表头, 宽度, 表格格式化)
+# 显示开关为None的列总是显示；表格按这里的顺序输出，json/csv总是输出全部字段
+LIST_COLUMNS = [
+    ("id", "show_id", "ID", 4, str),
+    ("name", None, "名称", 12, str),
+    ("position", None, "仓位", 7, lambda v: f"{v:.1f}%"),
+    ("pnl_percent", None, "盈亏%", 8, format_pnl_percent),
+    ("mode", "show_mode", "模式", 6, simplify_mode),
+    ("suggestion", None, "建议", 8, str),
+    ("current_price", None, "现价", 8, lambda v: f"{v:.2f}"),
+    ("quantity", "show_quantity", "数量", 8, lambda v: f"{v:.0f}"),
+    ("cost_price", "show_cost", "成本价", 8, lambda v: f"{v:.2f}" if v else "-"),
+    ("stop_loss", None, "止损价", 8, lambda v: f"{v:.2f}"),
+    ("code", "show_code", "代码", 8, lambda v: v or "-"),
+    ("total_value", "show_total", "总值", 10, lambda v: f"{v:.0f}"),
+    ("hold_reason", "show_reason", "持有理由", 20, format_reason),
+]
+
+# 列表输出格式
+LIST_FORMATS = ["table", "json", "csv"]
+
+# 列表显示开关对应的命令行参数
+LIST_FLAGS = {
+    "show_total": ["显示总值", "总值", "show-total"],
+    "show_id": ["显示ID", "显示id", "id", "ID"],
+    "show_cost": ["显示成本价", "成本价", "show-cost"],
+    "show_quantity": ["显示数量", "数量", "show-quantity"],
+    "show_mode": ["显示模式", "模式", "show-mode"],
+    "show_reason": ["显示理由", "显示持有理由", "show-reason"],
+    "show_code": ["显示代码", "代码", "show-code"],
+}
+
+def parse_list_args(args):
+    """解析列表参数，返回 (显示开关, 输出格式)"""
+    flags = {flag: any(p in args for p in words) for flag, words in LIST_FLAGS.items()}
+    output_format = "table"
+    for i, arg in enumerate(args):
+        value = arg.split("=", 1)[1] if arg.startswith(("--format=", "格式=")) else arg.lstrip("-").lower()
+        if arg == "--format" and i + 1 < len(args):
+            value = args[i + 1]
+        if value in LIST_FORMATS:
+            output_format = value
+    return flags, output_format
+
+def iter_holdings(cursor):
+    """逐行读取游标并计算建议（惰性迭代，不会把所有记录读进内存）"""
+    names = [d[0] for d in cursor.description]
+    for row in cursor:
+        stock = dict(zip(names, row))
+        stock["suggestion"] = get_simple_suggestion(stock["mode"], stock["current_price"], stock["stop_loss"],
+                                                    stock["position"], stock["hold_reason"])
+        yield stock
+
+def render_stocks(stocks, columns, output_format="table", show_deleted=False, out=None):
+    """按列定义流式输出持仓（table/json/csv），返回输出行数"""
+    out = out or sys.stdout
+    fields = [c[0] for c in LIST_COLUMNS]
     if show_deleted:
-        cursor.execute("""
-            SELECT id, name, code, mode, quantity, position, total_value, 
-                   cost_price, stop_loss, current_price, hold_reason, pnl_percent, 
-                   created_at, is_deleted, deleted_at
-            FROM stocks
-            ORDER BY position DESC
-        """)
+        fields += ["is_deleted", "deleted_at"]
+    count = 0
+
+    if output_format == "json":
+        import json
+        out.write("[")
+        for stock in stocks:
+            record = {f: stock.get(f) for f in fields}
+            record["mode"] = simplify_mode(record["mode"])
+            out.write(("," if count else "") + "\n  " + json.dumps(record, ensure_ascii=False))
+            count += 1
+        out.write("\n]\n" if count else "]\n")
+        return count
+
+    if output_format == "csv":
+        import csv
+        writer = csv.writer(out)
+        writer.writerow(fields)
+        for stock in stocks:
+            record = [stock.get(f) for f in fields]
+            record[fields.index("mode")] = simplify_mode(stock["mode"])
+            writer.writerow(record)
+            count += 1
+        return count
+
+    # 表格：宽度由列定义一次算出，逐行输出
+    width = sum(c[3] for c in columns) + len(columns) - 1
+    for stock in stocks:
+        if count == 0:
+            print("📊 持仓股票列表", file=out)
+            print("=" * width, file=out)
+            print(" ".join(f"{c[2]:<{c[3]}}" for c in columns), file=out)
+            print("-" * width, file=out)
+        deleted_mark = " [已删]" if show_deleted and stock.get("is_deleted") else ""
+        print(" ".join(f"{fmt(stock[key]):<{w}}" for key, _, _, w, fmt in columns) + deleted_mark, file=out)
+        count += 1
+    if count:
+        print("=" * width, file=out)
     else:
-        cursor.execute("""
-            SELECT id, name, code, mode, quantity, position, total_value, 
-                   cost_price, stop_loss, current_price, hold_reason, pnl_percent
-            FROM stocks
-            WHERE is_deleted = 0
-            ORDER BY position DESC
-        """)
-    
-    stocks = cursor.fetchall()
-    conn.close()
-    
-    if not stocks:
-        print("📭 暂无持仓股票")
-        return
-    
-    # 简化模式名称
-    def simplify_mode(mode):
-        if mode == "集中":
-            return "集中"
-        elif mode == "2%分散":
-            return "分散"
+        print("📭 暂无持仓股票", file=out)
+    return count
+
+def parse_page_args(args):
+    """解析分页参数 --limit N --after 仓位,ID，返回 (limit, after)"""
+    limit = None
+    after = None
+    for i, arg in enumerate(args):
+        if arg.startswith(("--limit=", "--after=")):
+            name, value = arg.split("=", 1)
+        elif arg in ["--limit", "--after"] and i + 1 < len(args):
+            name, value = arg, args[i + 1]
         else:
-            return mode
-    
-    print("📊 持仓股票列表")
-    if show_total:
-        if show_id:
-            if show_cost:
-                if show_mode:
-                    if show_reason:
-                        print("=" * 156)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'总值':<10} {'持有理由':<20}")
-                        print("-" * 156)
-                    else:
-                        print("=" * 134)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'总值':<10}")
-                        print("-" * 134)
-                else:
-                    if show_reason:
-                        print("=" * 148)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'总值':<10} {'持有理由':<20}")
-                        print("-" * 148)
-                    else:
-                        print("=" * 126)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'总值':<10}")
-                        print("-" * 126)
-            else:
-                if show_mode:
-                    if show_reason:
-                        print("=" * 141)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'总值':<10} {'持有理由':<20}")
-                        print("-" * 141)
-                    else:
-                        print("=" * 119)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'总值':<10}")
-                        print("-" * 119)
-                else:
-                    if show_reason:
-                        print("=" * 133)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'总值':<10} {'持有理由':<20}")
-                        print("-" * 133)
-                    else:
-                        print("=" * 111)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'总值':<10}")
-                        print("-" * 111)
+            continue
+        if name == "--limit":
+            limit = int(value)
+            if limit <= 0:
+                raise ValueError("--limit 必须大于0")
         else:
-            if show_cost:
-                if show_mode:
-                    if show_reason:
-                        print("=" * 151)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'总值':<10} {'持有理由':<20}")
-                        print("-" * 151)
-                    else:
-                        print("=" * 129)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'总值':<10}")
-                        print("-" * 129)
-                else:
-                    if show_reason:
-                        print("=" * 143)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'总值':<10} {'持有理由':<20}")
-                        print("-" * 143)
-                    else:
-                        print("=" * 121)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'总值':<10}")
-                        print("-" * 121)
-            else:
-                if show_mode:
-                    if show_reason:
-                        print("=" * 136)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'总值':<10} {'持有理由':<20}")
-                        print("-" * 136)
-                    else:
-                        print("=" * 114)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'总值':<10}")
-                        print("-" * 114)
-                else:
-                    if show_reason:
-                        print("=" * 128)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'总值':<10} {'持有理由':<20}")
-                        print("-" * 128)
-                    else:
-                        print("=" * 106)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'总值':<10}")
-                        print("-" * 106)
-    else:
-        if show_id:
-            if show_cost:
-                if show_mode:
-                    if show_reason:
-                        print("=" * 136)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'持有理由':<20}")
-                        print("-" * 136)
-                    else:
-                        print("=" * 114)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8}")
-                        print("-" * 114)
-                else:
-                    if show_reason:
-                        print("=" * 128)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'持有理由':<20}")
-                        print("-" * 128)
-                    else:
-                        print("=" * 106)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8}")
-                        print("-" * 106)
-            else:
-                if show_mode:
-                    if show_reason:
-                        print("=" * 121)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'持有理由':<20}")
-                        print("-" * 121)
-                    else:
-                        print("=" * 99)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8}")
-                        print("-" * 99)
-                else:
-                    if show_reason:
-                        print("=" * 113)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'持有理由':<20}")
-                        print("-" * 113)
-                    else:
-                        print("=" * 91)
-                        print(f"{'ID':<4} {'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8}")
-                        print("-" * 91)
+            position, stock_id = value.split(",")
+            after = (float(position), int(stock_id))
+    return limit, after
+
+def pop_options(args, types):
+    """从参数列表中取出 --name 值 / --name=值 形式的选项（原地删除），types: {"--name": 类型}
+
+    返回 {"--name": 值}，没出现的选项不在结果里
+    """
+    options = {}
+    i = 0
+    while i < len(args):
+        name, _, value = args[i].partition("=")
+        if name in types:
+            if not value:
+                if i + 1 >= len(args):
+                    raise ValueError(f"{name} 缺少参数值")
+                value = args.pop(i + 1)
+            options[name] = types[name](value)
+            args.pop(i)
         else:
-            if show_cost:
-                if show_mode:
-                    if show_reason:
-                        print("=" * 131)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'持有理由':<20}")
-                        print("-" * 131)
-                    else:
-                        print("=" * 109)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8}")
-                        print("-" * 109)
-                else:
-                    if show_reason:
-                        print("=" * 123)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8} {'持有理由':<20}")
-                        print("-" * 123)
-                    else:
-                        print("=" * 101)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'成本价':<8} {'止损价':<8} {'代码':<8}")
-                        print("-" * 101)
-            else:
-                if show_mode:
-                    if show_reason:
-                        print("=" * 116)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'持有理由':<20}")
-                        print("-" * 116)
-                    else:
-                        print("=" * 94)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'模式':<6} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8}")
-                        print("-" * 94)
-                else:
-                    if show_reason:
-                        print("=" * 108)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8} {'持有理由':<20}")
-                        print("-" * 108)
-                    else:
-                        print("=" * 86)
-                        print(f"{'名称':<12} {'仓位':<7} {'盈亏%':<8} {'建议':<8} {'现价':<8} {'止损价':<8} {'代码':<8}")
-                        print("-" * 86)
-    
-    for stock in stocks:
+            i += 1
+    return options
+
+def build_list_query(show_deleted=False, limit=None, after=None, columns=None):
+    """生成列表查询：按 (仓位 DESC, id) 排序，after为上一页最后一行的 (仓位, id)
+
+    多取一行用来判断是否还有下一页；columns 默认为列表输出用到的字段（必须包含 position 和 id）
+    show_deleted 时 UNION ALL 归档表，两边按索引有序读取后归并
+    """
+    if columns is None:
+        columns = """id, name, code, mode, quantity, position, total_value,
+                   cost_price, stop_loss, current_price, hold_reason, pnl_percent"""
         if show_deleted:
-            stock_id, name, code, mode, quantity, position, total_value, cost_price, stop_loss, current_price, hold_reason, pnl_percent, created_at, is_deleted, deleted_at = stock
-            deleted_mark = " [已删]" if is_deleted else ""
-        else:
-            stock_id, name, code, mode, quantity, position, total_value, cost_price, stop_loss, current_price, hold_reason, pnl_percent = stock
-            deleted_mark = ""
-        
-        # 简化模式名称
-        mode_simple = simplify_mode(mode)
-        
-        # 计算建议
-        suggestion = get_simple_suggestion(mode, current_price, stop_loss, position, hold_reason)
-        
-        cost_display = f"{cost_price:.2f}" if cost_price else "-"
-        # 盈亏%符号规则：盈利加+，亏损带-
-        if pnl_percent is not None:
-            if pnl_percent > 0:
-                pnl_display = f"+{pnl_percent:.2f}%"
-            else:
-                pnl_display = f"{pnl_percent:.2f}%"
-        else:
-            pnl_display = "-"
-        reason_display = hold_reason[:18] + ".." if hold_reason and len(hold_reason) > 18 else (hold_reason or "-")
-        
-        if show_total:
-            if show_id:
-                if show_cost:
-                    if show_mode:
-                        if show_reason:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f}{deleted_mark}")
-                    else:
-                        if show_reason:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f}{deleted_mark}")
-                else:
-                    if show_mode:
-                        if show_reason:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f}{deleted_mark}")
-                    else:
-                        if show_reason:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f}{deleted_mark}")
-            else:
-                if show_cost:
-                    if show_mode:
-                        if show_reason:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f}{deleted_mark}")
-                    else:
-                        if show_reason:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f}{deleted_mark}")
-                else:
-                    if show_mode:
-                        if show_reason:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f}{deleted_mark}")
-                    else:
-                        if show_reason:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {total_value:<10.0f}{deleted_mark}")
-        else:
-            if show_id:
-                if show_cost:
-                    if show_mode:
-                        if show_reason:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8}{deleted_mark}")
-                    else:
-                        if show_reason:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8}{deleted_mark}")
-                else:
-                    if show_mode:
-                        if show_reason:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8}{deleted_mark}")
-                    else:
-                        if show_reason:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{stock_id:<4} {name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8}{deleted_mark}")
-            else:
-                if show_cost:
-                    if show_mode:
-                        if show_reason:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8}{deleted_mark}")
-                    else:
-                        if show_reason:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8}{deleted_mark}")
-                else:
-                    if show_mode:
-                        if show_reason:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8}{deleted_mark}")
-                    else:
-                        if show_reason:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                        else:
-                            print(f"{name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8}{deleted_mark}")
-            else:
-                if show_cost:
-                    if show_mode:
-                        print(f"{name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                    else:
-                        print(f"{name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {cost_display:<8} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                else:
-                    if show_mode:
-                        print(f"{name:<12} {position:.1f}% {pnl_display:<8} {mode_simple:<6} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-                    else:
-                        print(f"{name:<12} {position:.1f}% {pnl_display:<8} {suggestion:<8} {current_price:<8.2f} {stop_loss:<8.2f} {code or '-':<8} {reason_display:<20}{deleted_mark}")
-    
-    if show_total:
-        if show_cost:
-            print("=" * 80)
-        else:
-            print("=" * 125)
+            columns += ",\n                   created_at, is_deleted, deleted_at"
+    where = []
+    params = []
+    if not show_deleted:
+        where.append("is_deleted = 0")
+    if after:
+        # 写成 position <= ? 的形式，索引可以直接定位到起点
+        where.append("position <= ? AND (position < ? OR id > ?)")
+        params += [after[0], after[0], after[1]]
+    where_sql = "WHERE " + " AND ".join(where) if where else ""
+    tables = ["stocks", "stocks_archive"] if show_deleted else ["stocks"]
+    selects = [f"""
+            SELECT {columns}
+            FROM {table}
+            {where_sql}""" for table in tables]
+    params *= len(tables)
+    sql = "\n            UNION ALL".join(selects) + """
+            ORDER BY position DESC, id
+        """
+    if limit:
+        sql += "    LIMIT ?\n"
+        params.append(limit + 1)
+    return sql, params
+
+def list_stocks(show_deleted=False, show_total=False, show_id=False, show_cost=False, show_quantity=False, show_mode=False, show_reason=False, show_code=False, output_format="table", limit=None, after=None):
+    """列出股票（output_format: table/json/csv；limit/after 为键集分页）
+
+    返回下一页的 after 游标（没有下一页时为None）
+    """
+    conn = get_conn()
+    if conn is _shared_conn:
+        # 常驻进程：持仓和建议走进程内缓存，数据库没有变化时不查询、不重新计算（多取一行判断是否还有下一页）
+        holdings = open_store(conn).holdings(show_deleted, limit + 1 if limit else None, after)
+        rows = ({name: getattr(holding, name) for name in holding.__slots__} for holding in holdings)
     else:
-        if show_cost:
-            print("=" * 120)
-        else:
-            print("=" * 105)
+        cursor = conn.cursor()
+        sql, params = build_list_query(show_deleted, limit, after)
+        cursor.execute(sql, params)
+        rows = iter_holdings(cursor)
+    
+    flags = {"show_total": show_total, "show_id": show_id, "show_cost": show_cost, "show_quantity": show_quantity,
+             "show_mode": show_mode, "show_reason": show_reason, "show_code": show_code}
+    columns = [c for c in LIST_COLUMNS if c[1] is None or flags[c[1]]]
+    
+    page = {"last": None, "more": False}
+    def _page(stocks):
+        for count, stock in enumerate(stocks):
+            if limit and count == limit:
+                page["more"] = True
+                return
+            page["last"] = stock
+            yield stock
+    
+    # 逐行读取+计算建议 和 输出交替进行，compute 从 render 里单独计时
+    stocks = profiling.timed_iter("compute", _page(rows))
+    try:
+        with profiling.span("render", format=output_format):
+            render_stocks(stocks, columns, output_format, show_deleted)
+    finally:
+        stocks.close()
+        release_conn(conn)
+    
+    if not page["more"]:
+        return None
+    next_after = (page["last"]["position"], page["last"]["id"])
+    if output_format == "table":
+        print(f"👉 下一页: --limit {limit} --after {next_after[0]!r},{next_after[1]}")
+    return next_after
 
 def auto_adjust_mode(position):
     """根据仓位自动调整模式：仓位≤2%→分散，仓位>2%→集中"""
@@ -536,183 +1052,362 @@ def auto_adjust_mode(position):
     else:
         return "集中"
 
-def add_stock(name, code, mode, quantity, cost_price, stop_loss, current_price, total_capital=DEFAULT_TOTAL_CAPITAL, hold_reason=None):
-    """添加股票（按持有数量输入）"""
-    init_db()
-    
-    # 计算个股市值和仓位
-    total_value = calculate_total_value(quantity, current_price)
-    position = calculate_position(total_value, total_capital)
+def open_store(conn, total_capital=None):
+    """命令行用的持仓库：借用 get_conn() 拿到的连接（调用方负责 release_conn）
+
+    total_capital 为 None 时用组合保存的总资金；常驻进程的共享连接带上进程内持仓缓存，一次性命令不缓存
+    """
+    from portfolio_store import PortfolioStore, HOLDINGS_CACHE
+    return PortfolioStore(total_capital=total_capital, conn=conn,
+                          cache=HOLDINGS_CACHE if conn is _shared_conn else None)
+
+def add_stock(name, code, mode, quantity, cost_price, stop_loss, current_price, total_capital=None, hold_reason=None):
+    """添加股票（按持有数量输入；模式按仓位自动调整；total_capital 为 None 时用组合保存的总资金）"""
+    conn = get_conn()
+    try:
+        store = open_store(conn, total_capital)
+        total_capital = store.capital()
+        stock = store.add(name, code, quantity, cost_price, stop_loss, current_price, hold_reason)
+    finally:
+        release_conn(conn)
     
     print(f"💡 持有数量：{quantity:.0f}")
     print(f"   现价：{current_price:.2f}")
-    print(f"   自动计算个股市值：{total_value:.0f}元")
-    print(f"   自动计算仓位：{position:.1f}%（总资金：{total_capital:.0f}元）")
-    
-    # 自动调整模式
-    mode = auto_adjust_mode(position)
-    print(f"💡 自动调整模式为：{mode}（仓位：{position:.1f}%）")
-    
-    # 计算盈亏
-    pnl, pnl_percent = calculate_pnl(current_price, cost_price, position, total_value)
-    
-    conn = get_conn()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO stocks (name, code, mode, quantity, position, total_value, 
-                           cost_price, stop_loss, current_price, hold_reason, pnl, pnl_percent)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (name, code, mode, quantity, position, total_value, cost_price, stop_loss, current_price, hold_reason, pnl, pnl_percent))
-    
-    stock_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    print(f"   自动计算个股市值：{stock.total_value:.0f}元")
+    print(f"   自动计算仓位：{stock.position:.1f}%（总资金：{total_capital:.0f}元）")
+    print(f"💡 自动调整模式为：{stock.mode}（仓位：{stock.position:.1f}%）")
     
-    print(f"✅ 股票已添加！ID: {stock_id}")
+    print(f"✅ 股票已添加！ID: {stock.id}")
     print(f"   名称: {name}")
-    print(f"   模式: {mode}")
-    print(f"   仓位: {position:.1f}%")
-    print(f"   总值: {total_value:.0f}元")
+    print(f"   模式: {stock.mode}")
+    print(f"   仓位: {stock.position:.1f}%")
+    print(f"   总值: {stock.total_value:.0f}元")
     print(f"   成本价: {cost_price:.2f}")
     print(f"   止损价: {stop_loss:.2f}")
     print(f"   现价: {current_price:.2f}")
     if hold_reason:
         print(f"   持有理由: {hold_reason}")
 
-def update_stock(stock_id, current_price, hold_reason=None, total_capital=DEFAULT_TOTAL_CAPITAL):
+def update_stock(stock_id, current_price, hold_reason=None, total_capital=None):
     """更新股票现价和持有理由（自动重新计算个股市值、仓位和盈亏）"""
-    init_db()
-    
     conn = get_conn()
-    cursor = conn.cursor()
+    try:
+        stock = open_store(conn, total_capital).update(stock_id, current_price, hold_reason)
+    finally:
+        release_conn(conn)
     
-    # 获取旧数据
-    cursor.execute("""
-        SELECT cost_price, stop_loss, quantity
-        FROM stocks
-        WHERE id = ? AND is_deleted = 0
-    """, (stock_id,))
-    
-    stock = cursor.fetchone()
-    if not stock:
+    if stock is None:
         print(f"❌ 找不到ID为 {stock_id} 的股票（或已删除）")
-        conn.close()
         return
     
-    cost_price, stop_loss, quantity = stock
-    
-    # 自动重新计算个股市值、仓位
-    total_value = calculate_total_value(quantity, current_price)
-    position = calculate_position(total_value, total_capital)
-    
-    # 自动重新计算盈亏
-    pnl, pnl_percent = calculate_pnl(current_price, cost_price, position, total_value)
-    
-    # 自动调整模式
-    mode = auto_adjust_mode(position)
-    
     print(f"💡 自动重新计算：")
-    print(f"   持有数量：{quantity:.0f}")
+    print(f"   持有数量：{stock.quantity:.0f}")
     print(f"   现价：{current_price:.2f}")
-    print(f"   个股市值：{total_value:.0f}元")
-    print(f"   仓位：{position:.1f}%")
-    print(f"   模式：{mode}")
-    
-    # 更新
-    if hold_reason:
-        cursor.execute("""
-            UPDATE stocks
-            SET current_price = ?, hold_reason = ?, 
-                total_value = ?, position = ?, mode = ?,
-                pnl = ?, pnl_percent = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (current_price, hold_reason, total_value, position, mode, pnl, pnl_percent, stock_id))
-    else:
-        cursor.execute("""
-            UPDATE stocks
-            SET current_price = ?, 
-                total_value = ?, position = ?, mode = ?,
-                pnl = ?, pnl_percent = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (current_price, total_value, position, mode, pnl, pnl_percent, stock_id))
-    
-    conn.commit()
-    conn.close()
+    print(f"   个股市值：{stock.total_value:.0f}元")
+    print(f"   仓位：{stock.position:.1f}%")
+    print(f"   模式：{stock.mode}")
     
     print(f"✅ 股票已更新！ID: {stock_id}")
     print(f"   现价: {current_price}")
-    print(f"   盈亏: {pnl_percent:.2f}%")
+    print(f"   盈亏: {stock.pnl_percent:.2f}%")
     if hold_reason:
         print(f"   持有理由已更新: {hold_reason}")
 
+# 批量价格CSV表头里的列名（不区分大小写）
+PRICE_ID_COLUMNS = ["id"]
+PRICE_CODE_COLUMNS = ["code", "代码"]
+PRICE_VALUE_COLUMNS = ["price", "current_price", "现价", "价格"]
+
+def read_price_rows(source="-", by_code=False, key=None):
+    """读取批量更新数据（CSV：id,现价 或 code,现价；支持表头，'-'表示stdin）
+
+    key 固定按哪一列匹配（"id" 或 "code"）：有表头时按列名找这一列，找不到抛 ValueError；
+    key 为 None 时按 by_code 找，表头里没有这一列就用表头里第一个 id/code 列；
+    表头里有 price/现价 列时按列名取价格，否则取第一个不是 id/code 的列
+    返回 (按代码, [(id或代码, 现价), ...], [跳过的行])
+    """
+    import csv
+
+    if key is not None:
+        by_code = key == "code"
+    key_col, price_col = 0, 1
+    f = sys.stdin if source in (None, "-") else open(source, "r", encoding="utf-8-sig", newline="")
+    rows = []
+    skipped = []
+    try:
+        for line_no, fields in enumerate(csv.reader(f), 1):
+            fields = [x.strip() for x in fields]
+            if not fields or not fields[0] or fields[0].startswith("#"):
+                continue
+            names = [x.lower() for x in fields]
+            if line_no == 1 and any(n in PRICE_ID_COLUMNS + PRICE_CODE_COLUMNS for n in names):
+                key_cols = {}
+                for i, n in enumerate(names):
+                    if n in PRICE_ID_COLUMNS + PRICE_CODE_COLUMNS:
+                        key_cols.setdefault(n, i)
+                wanted = PRICE_CODE_COLUMNS if by_code else PRICE_ID_COLUMNS
+                found = [key_cols[n] for n in wanted if n in key_cols]
+                if not found and key is not None:
+                    raise ValueError(f"表头里没有 {'/'.join(wanted)} 列")
+                key_col = found[0] if found else min(key_cols.values())
+                by_code = names[key_col] in PRICE_CODE_COLUMNS
+                price_col = next((i for i, n in enumerate(names) if n in PRICE_VALUE_COLUMNS),
+                                 next((i for i, n in enumerate(names) if n not in key_cols), len(names)))
+                continue
+            if len(fields) <= max(key_col, price_col):
+                skipped.append((line_no, ",".join(fields)))
+                continue
+            try:
+                row_key = fields[key_col] if by_code else int(fields[key_col])
+                rows.append((row_key, float(fields[price_col])))
+            except ValueError:
+                skipped.append((line_no, ",".join(fields)))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return by_code, rows, skipped
+
+def append_prices(cursor, rows, ts=None):
+    """追加价格历史，同时更新当天的日K线和滚动统计（在调用方的写事务内执行）
+
+    rows: [(stock_id, 现价[, 价格时间]), ...]；没带价格时间的行用 ts（默认当前时间）；
+    同一只股票同一秒内多次写入只保留最后一次
+    K线的 ticks 是当天原始价格的行数：同一秒的更正替换原来那行，不算新的一条（压缩时按它判断原始价格是否完整）
+    """
+    ts = int(time.time() if ts is None else ts)
+    params = [(row[0], int(row[2]) if len(row) > 2 and row[2] is not None else ts, round(row[1] * PRICE_SCALE))
+              for row in rows]
+    import volatility
+    # 这一秒已经有价格的 (股票, 时间)：按价格时间分组，每组按主键逐个查（同一批通常只有一个或少数几个时间）
+    by_ts = {}
+    for stock_id, row_ts, _ in params:
+        by_ts.setdefault(row_ts, set()).add(stock_id)
+    seen = set()
+    for row_ts, ids in by_ts.items():
+        ids = list(ids)
+        for start in range(0, len(ids), volatility.LOOKUP_CHUNK):
+            part = ids[start:start + volatility.LOOKUP_CHUNK]
+            seen.update((row[0], row_ts) for row in cursor.execute(
+                f"SELECT stock_id FROM prices WHERE ts = ? AND stock_id IN ({', '.join('?' * len(part))})",
+                [row_ts] + part))
+    bars, by_day = [], {}
+    for stock_id, row_ts, price in params:
+        day = (row_ts + MARKET_UTC_OFFSET) // 86400
+        bars.append((stock_id, day, price, (stock_id, row_ts) not in seen))
+        seen.add((stock_id, row_ts))
+        by_day.setdefault(day, []).append((stock_id, price))
+    cursor.executemany("INSERT OR REPLACE INTO prices (stock_id, ts, price) VALUES (?, ?, ?)", params)
+    cursor.executemany("""
+        INSERT INTO price_bars (stock_id, day, open, high, low, close, ticks)
+        VALUES (?1, ?2, ?3, ?3, ?3, ?3, 1)
+        ON CONFLICT (stock_id, day) DO UPDATE SET
+            high = MAX(high, excluded.high),
+            low = MIN(low, excluded.low),
+            close = excluded.close,
+            ticks = ticks + ?4
+    """, bars)
+    # 滚动统计按交易日先后更新：跨天的一批里较早那天的价格不会被当成补录
+    for day in sorted(by_day):
+        volatility.update_stats(cursor, day, by_day[day])
+
+def bulk_update_stocks(rows, by_code=False, total_capital=None, ts=None):
+    """批量更新现价（一个事务内写入，自动重新计算个股市值、仓位、盈亏和模式）
+
+    rows: [(id或代码, 现价), ...]；ts为价格时间（Unix秒，默认当前时间）
+    返回 (已更新条数, 找不到的id/代码列表)
+    """
+    conn = get_conn()
+    try:
+        return open_store(conn, total_capital).update_prices(rows, by_code, ts=ts)
+    finally:
+        release_conn(conn)
+
 def delete_stock(stock_id):
     """软删除股票"""
-    init_db()
-    
     conn = get_conn()
-    cursor = conn.cursor()
+    try:
+        stock = open_store(conn).delete(stock_id)
+    finally:
+        release_conn(conn)
     
-    # 检查是否存在
-    cursor.execute("SELECT name FROM stocks WHERE id = ? AND is_deleted = 0", (stock_id,))
-    stock = cursor.fetchone()
-    if not stock:
+    if stock is None:
         print(f"❌ 找不到ID为 {stock_id} 的股票（或已删除）")
-        conn.close()
         return
     
-    name = stock[0]
-    
-    # 软删除
-    cursor.execute("""
-        UPDATE stocks
-        SET is_deleted = 1, deleted_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    """, (stock_id,))
-    
-    conn.commit()
-    conn.close()
-    
     print(f"✅ 股票已删除（软删除）！ID: {stock_id}")
-    print(f"   名称: {name}")
+    print(f"   名称: {stock.name}")
     print(f"   注：数据仍保存在数据库中，可通过'历史'命令查看")
 
-if __name__ == "__main__":
-    if len(sys.argv) == 1:
+def search_stocks(query, include_deleted=False, limit=None, output_format="table"):
+    """按持有理由搜索持仓（BM25排序，带匹配片段）"""
+    from portfolio_store import SEARCH_LIMIT, SEARCH_CANDIDATES
+    conn = get_conn()
+    try:
+        hits, more = open_store(conn).search(query, include_deleted, limit or SEARCH_LIMIT)
+    finally:
+        release_conn(conn)
+
+    if output_format == "json":
+        import json
+        json.dump([hit.to_dict() for hit in hits], sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        return hits
+    if output_format == "csv":
+        import csv
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["id", "name", "code", "position", "is_deleted", "archived", "score", "snippet"])
+        writer.writerows([hit.id, hit.name, hit.code, hit.position, hit.is_deleted, int(hit.archived),
+                          round(hit.score, 4), hit.snippet] for hit in hits)
+        return hits
+
+    if not hits:
+        print(f"📭 没有持有理由包含「{query}」的持仓" + ("" if include_deleted else "（加 历史 搜索已删除的）"))
+        return hits
+    print(f"🔍 持有理由搜索「{query}」（按相关度排序）")
+    print("=" * 80)
+    print(f"{'ID':<6} {'名称':<12} {'代码':<8} {'仓位':<8} {'相关度':<8} 匹配片段")
+    print("-" * 80)
+    for hit in hits:
+        mark = " [已归档]" if hit.archived else (" [已删]" if hit.is_deleted else "")
+        position = f"{hit.position:.1f}%"
+        print(f"{hit.id:<6} {hit.name:<12} {hit.code or '-':<8} {position:<8} {hit.score:<8.2f} {hit.snippet}{mark}")
+    print("=" * 80)
+    if more:
+        print(f"   命中较多，只在最近加入的 {max(SEARCH_CANDIDATES, limit or SEARCH_LIMIT)} 条里排序；加关键词可以缩小范围")
+    return hits
+
+def archive_stocks(days, batch=None, preview=False):
+    """把删除超过 days 天的持仓搬到归档表，然后按需增量回收空闲页"""
+    from portfolio_store import ARCHIVE_BATCH
+    conn = get_conn()
+    try:
+        store = open_store(conn)
+        if preview:
+            count = store.archivable(days)
+            free, total = store.free_pages()
+            print(f"📦 可归档: {count} 只（删除超过 {days:g} 天）")
+            print(f"   数据库: {total} 页，空闲 {free} 页")
+            return count
+        start = time.perf_counter()
+        archived = store.archive(days, batch or ARCHIVE_BATCH)
+        freed = store.vacuum()
+        free, total = store.free_pages()
+        elapsed = time.perf_counter() - start
+    finally:
+        release_conn(conn)
+
+    print(f"✅ 归档完成！{archived} 只删除超过 {days:g} 天的持仓已移到归档表（'历史'命令照常可查）")
+    print(f"   回收空闲页: {freed} 页，数据库现在 {total} 页（空闲 {free} 页）")
+    print(f"   耗时: {elapsed * 1000:.1f}ms")
+    return archived
+
+def show_summary(check=False, fix=False):
+    """持仓汇总（读 portfolio_totals，不扫表）；check 时全表重新汇总并报告偏差，fix 时按重新汇总的结果修复
+
+    返回偏差项数（不校验时为0）
+    """
+    conn = get_conn()
+    try:
+        store = open_store(conn)
+        totals = store.totals()
+        drifts = store.check_totals() if check or fix else []
+        if fix and drifts:
+            store.rebuild_totals()
+    finally:
+        release_conn(conn)
+    
+    if not totals:
+        print("📭 暂无持仓股票")
+    else:
+        print("📊 持仓汇总")
+        print("=" * 52)
+        print(f"{'模式':<8} {'只数':<8} {'总值':<12} {'仓位':<10} {'盈亏':<12}")
+        print("-" * 52)
+        for t in totals:
+            print(f"{simplify_mode(t.mode):<8} {t.holdings:<8} {t.total_value:<12.0f} {f'{t.position:.1f}%':<10} {t.pnl:<12.0f}")
+        print("-" * 52)
+        print(f"{'合计':<8} {sum(t.holdings for t in totals):<8} {sum(t.total_value for t in totals):<12.0f} "
+              f"{f'{sum(t.position for t in totals):.1f}%':<10} {sum(t.pnl for t in totals):<12.0f}")
+        print("=" * 52)
+    
+    if not (check or fix):
+        return 0
+    if not drifts:
+        print("✅ 汇总与持仓明细一致")
+        return 0
+    print(f"⚠️ 汇总与持仓明细不一致（{len(drifts)} 项）：")
+    for d in drifts:
+        print(f"   {simplify_mode(d.mode)} {d.field}: 汇总 {d.stored:g}，重新计算 {d.actual:g}（差 {d.stored - d.actual:+g}）")
+    if fix:
+        print("✅ 已按持仓明细重建汇总")
+    else:
+        print("👉 修复: /risk 汇总 修复")
+    return len(drifts)
+
+def main(argv):
+    """命令行入口（argv[0]为程序名，stock_daemon也通过这里执行命令）
+
+    --profile[=文件]、--profile-dump=模式 可以放在任意位置，开启分阶段计时（见 profiling.py）；
+    --portfolio 名称 同样可以放在任意位置，选择组合
+    """
+    argv, profile_target, profile_dump = profiling.pop_flags(argv)
+    profiling.configure(profile_target)
+    try:
+        argv, portfolio = pop_portfolio_flag(argv)
+        use_portfolio(portfolio)
+    except ValueError as e:
+        print(f"❌ 参数错误: {e}")
+        print("用法: /risk <命令...> --portfolio <组合名>（或设置环境变量 RISK_PORTFOLIO）")
+        print("示例: /risk 列表 --portfolio 趋势策略")
+        sys.exit(1)
+    command = argv[1] if len(argv) > 1 else None
+    return profiling.run(command, lambda: run_command(argv), profile_dump)
+
+def run_command(argv):
+    """执行一条命令"""
+    if len(argv) == 1:
         show_help()
         sys.exit(0)
 
-    command = sys.argv[1]
+    command = argv[1]
 
     if command == "列表":
-        show_total = len(sys.argv) > 2 and any(p in sys.argv[2:] for p in ["显示总值", "总值", "show-total"])
-        show_id = len(sys.argv) > 2 and any(p in sys.argv[2:] for p in ["显示ID", "显示id", "id", "ID"])
-        show_cost = len(sys.argv) > 2 and any(p in sys.argv[2:] for p in ["显示成本价", "成本价", "show-cost"])
-        show_quantity = len(sys.argv) > 2 and any(p in sys.argv[2:] for p in ["显示数量", "数量", "show-quantity"])
-        show_mode = len(sys.argv) > 2 and any(p in sys.argv[2:] for p in ["显示模式", "模式", "show-mode"])
-        show_reason = len(sys.argv) > 2 and any(p in sys.argv[2:] for p in ["显示理由", "显示持有理由", "show-reason"])
-        show_code = len(sys.argv) > 2 and any(p in sys.argv[2:] for p in ["显示代码", "代码", "show-code"])
-        list_stocks(show_deleted=False, show_total=show_total, show_id=show_id, show_cost=show_cost, show_quantity=show_quantity, show_mode=show_mode, show_reason=show_reason, show_code=show_code)
+        flags, output_format = parse_list_args(argv[2:])
+        try:
+            limit, after = parse_page_args(argv[2:])
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 列表 [--limit N] [--after 仓位,ID]")
+            sys.exit(1)
+        list_stocks(show_deleted=False, output_format=output_format, limit=limit, after=after, **flags)
     
     elif command == "历史":
-        list_stocks(show_deleted=True)
+        flags, output_format = parse_list_args(argv[2:])
+        try:
+            limit, after = parse_page_args(argv[2:])
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 历史 [--limit N] [--after 仓位,ID]")
+            sys.exit(1)
+        list_stocks(show_deleted=True, output_format=output_format, limit=limit, after=after, **flags)
     
     elif command == "添加":
-        if len(sys.argv) < 9:
+        if len(argv) < 9:
             print("❌ 参数错误")
             print("用法: /risk 添加 <名称> <代码> <模式> <持有数量> <成本价> <止损价> <现价> [总资金] [持有理由]")
             print("示例: /risk 添加 上证50 000016 集中 200 2457 2457 2960")
             print("      /risk 添加 股票B 000010 集中 5000 1.00 0.80 1.00 100000 \"AI趋势\"")
             sys.exit(1)
         try:
-            name = sys.argv[2]
-            code = sys.argv[3] if sys.argv[3] != "-" else None
-            mode = sys.argv[4]
-            quantity = float(sys.argv[5])
-            cost_price = float(sys.argv[6])
-            stop_loss = float(sys.argv[7])
-            current_price = float(sys.argv[8])
-            total_capital = float(sys.argv[9]) if len(sys.argv) > 9 and sys.argv[9] and sys.argv[9][0].isdigit() else DEFAULT_TOTAL_CAPITAL
-            hold_reason = sys.argv[10] if len(sys.argv) > 10 else (sys.argv[9] if len(sys.argv) > 9 and not sys.argv[9][0].isdigit() else None)
+            name = argv[2]
+            code = argv[3] if argv[3] != "-" else None
+            mode = argv[4]
+            quantity = float(argv[5])
+            cost_price = float(argv[6])
+            stop_loss = float(argv[7])
+            current_price = float(argv[8])
+            total_capital = float(argv[9]) if len(argv) > 9 and argv[9] and argv[9][0].isdigit() else None
+            hold_reason = argv[10] if len(argv) > 10 else (argv[9] if len(argv) > 9 and not argv[9][0].isdigit() else None)
             
             # 兼容旧模式名称
             if mode in ["集中"]:
@@ -731,30 +1426,486 @@ if __name__ == "__main__":
             sys.exit(1)
     
     elif command == "更新":
-        if len(sys.argv) < 4:
+        if len(argv) < 4:
             print("❌ 参数错误")
             print("用法: /risk 更新 <id> <现价> [持有理由]")
             print("示例: /risk 更新 1 2980")
             print("      /risk 更新 1 2980 \"继续看好AI趋势\"")
             sys.exit(1)
         try:
-            stock_id = int(sys.argv[2])
-            current_price = float(sys.argv[3])
-            hold_reason = sys.argv[4] if len(sys.argv) > 4 else None
+            stock_id = int(argv[2])
+            current_price = float(argv[3])
+            hold_reason = argv[4] if len(argv) > 4 else None
             update_stock(stock_id, current_price, hold_reason)
         except ValueError as e:
             print(f"❌ 参数错误: {e}")
             print("ID和现价必须是数字")
             sys.exit(1)
     
+    elif command in ["批量更新", "bulk-update"]:
+        args = argv[2:]
+        by_code = any(p in args for p in ["按代码", "--by-code"])
+        args = [a for a in args if a not in ["按代码", "--by-code"]]
+        source = args[0] if args else "-"
+        try:
+            total_capital = float(args[1]) if len(args) > 1 else None
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("总资金必须是数字")
+            sys.exit(1)
+        try:
+            start = time.perf_counter()
+            by_code, rows, skipped = read_price_rows(source, by_code)
+            updated, missing = bulk_update_stocks(rows, by_code, total_capital)
+            elapsed = time.perf_counter() - start
+        except OSError as e:
+            print(f"❌ 读取文件失败: {e}")
+            sys.exit(1)
+        print(f"✅ 批量更新完成！共更新 {updated} 只股票")
+        print(f"   耗时: {elapsed * 1000:.1f}ms（{updated / elapsed if elapsed > 0 else 0:.0f} 行/秒）")
+        if missing:
+            print(f"   ⚠️ 找不到（或已删除）: {', '.join(str(k) for k in missing)}")
+        if skipped:
+            print(f"   ⚠️ 格式错误已跳过: 第 {', '.join(str(n) for n, _ in skipped)} 行")
+
+    elif command in ["重算", "recompute"]:
+        args = argv[2:]
+        dry_run = any(p in args for p in ["预览", "--dry-run"])
+        args = [a for a in args if a not in ["预览", "--dry-run"]]
+        try:
+            if "--capital" in args:
+                total_capital = float(args[args.index("--capital") + 1])
+            else:
+                total_capital = float(args[0]) if args else get_total_capital()
+            if total_capital <= 0:
+                raise ValueError("总资金必须大于0")
+        except (ValueError, IndexError) as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 重算 [总资金] [预览]")
+            print("示例: /risk 重算 600000")
+            sys.exit(1)
+        import portfolio_engine
+        holdings, result, elapsed = portfolio_engine.recompute_portfolio(total_capital, dry_run)
+        portfolio_engine.print_recompute_summary(holdings, result, total_capital, elapsed, dry_run)
+
+    elif command in ["行情接入", "ingest"]:
+        args = argv[2:]
+        try:
+            options = pop_options(args, {"--interval": float, "--batch": int, "--capital": float})
+            interval_ms = options.get("--interval", 500)
+            batch_size = options.get("--batch", 500)
+            # 不给 --capital 时每次写入读组合保存的总资金，接入期间重算的总资金随即生效
+            total_capital = options.get("--capital")
+            if interval_ms <= 0 or batch_size <= 0 or (total_capital is not None and total_capital <= 0):
+                raise ValueError("刷新间隔、批量大小、总资金必须大于0")
+            source = args[0] if args else "-"
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 行情接入 <文件|管道|-|tcp:端口> [--interval 毫秒] [--batch 数量] [--capital 总资金]")
+            print("示例: /risk 行情接入 ticks.jsonl --interval 200")
+            print("      /risk 行情接入 tcp:9000")
+            sys.exit(1)
+        import tick_ingest
+        try:
+            tick_ingest.ingest(source, interval_ms, batch_size, total_capital)
+        except OSError as e:
+            print(f"❌ 读取价格流失败: {e}")
+            sys.exit(1)
+        except sqlite3.Error as e:
+            print(f"❌ 写入价格失败（已停止接入）: {e}")
+            sys.exit(1)
+
+    elif command in ["风险模拟", "simulate"]:
+        args = argv[2:]
+        try:
+            options = pop_options(args, {"--paths": int, "--horizon": int, "--returns": str,
+                                         "--workers": int, "--capital": float, "--seed": int})
+            if args:
+                raise ValueError(f"未知参数 {' '.join(args)}")
+            paths = options.get("--paths", 100000)
+            horizon = options.get("--horizon", 10)
+            workers = options.get("--workers", 1)
+            total_capital = options.get("--capital", get_total_capital())
+            if paths <= 0 or horizon <= 0 or workers <= 0 or total_capital <= 0:
+                raise ValueError("路径数、天数、进程数、总资金必须大于0")
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 风险模拟 [--paths N] [--horizon 天数] [--returns 文件] [--workers N] [--capital 总资金]")
+            print("示例: /risk 风险模拟 --horizon 20")
+            print("      /risk 风险模拟 --returns returns.csv --paths 1000000 --workers 4")
+            sys.exit(1)
+        import risk_sim
+        try:
+            risk_sim.simulate_portfolio(paths, horizon, options.get("--returns"), workers,
+                                        total_capital, options.get("--seed"))
+        except (OSError, StopIteration, ValueError) as e:
+            print(f"❌ 读取收益率文件失败: {e or '文件为空'}")
+            sys.exit(1)
+
+    elif command in ["回测", "backtest"]:
+        args = argv[2:]
+        rebuild = "--rebuild" in args
+        args = [a for a in args if a != "--rebuild"]
+        try:
+            options = pop_options(args, {"--capital": float, "--stop-pct": float, "--breakout": int,
+                                         "--risk": float, "--workers": int, "--out": str, "--cache": str})
+            if len(args) != 1:
+                raise ValueError("需要指定日K线CSV目录")
+            params = {"capital": options.get("--capital", DEFAULT_TOTAL_CAPITAL),
+                      "stop_pct": options.get("--stop-pct", 8),
+                      "breakout": options.get("--breakout", 20),
+                      "target_risk": options.get("--risk", 2)}
+            if min(params.values()) <= 0 or params["stop_pct"] >= 100 or options.get("--workers", 1) <= 0:
+                raise ValueError("参数必须大于0，止损百分比必须小于100")
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 回测 <日K线CSV目录> [--stop-pct 8] [--breakout 20] [--risk 2] [--capital 总资金] [--workers N] [--out 目录]")
+            print("示例: /risk 回测 ./kline --workers 4 --out ./回测结果")
+            print("CSV: 每只股票一个文件（文件名为代码），表头包含 date,open,high,low,close（或 日期,开盘,最高,最低,收盘）")
+            sys.exit(1)
+        import backtest
+        try:
+            backtest.backtest(args[0], params, options.get("--workers", 1), options.get("--out", "."),
+                              options.get("--cache"), rebuild)
+        except (OSError, ValueError) as e:
+            print(f"❌ 回测失败: {e}")
+            sys.exit(1)
+
+    elif command in ["批量仓位", "batch-size"]:
+        args = argv[2:]
+        output_format = "json" if "json" in args else "csv"
+        args = [a for a in args if a not in ["json", "csv"]]
+        try:
+            options = pop_options(args, {"--risk": float, "--capital": float})
+            if options.get("--risk", 2) <= 0 or options.get("--capital", 1) <= 0:
+                raise ValueError("目标风险和总资金必须大于0")
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 批量仓位 [文件|-] [--risk 2] [--capital 总资金] [csv|json]")
+            print("示例: /risk 批量仓位 watchlist.csv --capital 600000")
+            sys.exit(1)
+        import position_sizing
+        try:
+            position_sizing.show_batch(args[0] if args else "-", options.get("--risk", 2),
+                                       options.get("--capital"), output_format)
+        except OSError as e:
+            print(f"❌ 读取文件失败: {e}")
+            sys.exit(1)
+
+    elif command in ["仓位网格", "size-grid"]:
+        args = argv[2:]
+        output_format = next((a for a in args if a in ["表格", "csv", "json"]), "表格")
+        args = [a for a in args if a not in ["表格", "csv", "json"]]
+        import position_sizing
+        try:
+            options = pop_options(args, {"--price": position_sizing.parse_range, "--stop": position_sizing.parse_range,
+                                         "--risk": position_sizing.parse_range})
+            if "--price" not in options or "--stop" not in options:
+                raise ValueError("需要 --price 和 --stop")
+            position_sizing.show_grid(options["--price"], options["--stop"],
+                                      options.get("--risk", position_sizing.parse_range("2")), output_format)
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 仓位网格 --price 起:止:步长 --stop 起:止:步长 [--risk 0.5,1,2] [表格|csv|json]")
+            print("示例: /risk 仓位网格 --price 2800:3000:50 --stop 2400:2600:50 --risk 1,2")
+            sys.exit(1)
+
+    elif command in ["情景", "scenario"]:
+        args = argv[2:]
+        output_format = next((a for a in args if a in ["csv", "json"]), "table")
+        args = [a for a in args if a not in ["csv", "json"]]
+        try:
+            options = pop_options(args, {"--capital": float, "--top": int})
+            total_capital = options.get("--capital", get_total_capital())
+            if total_capital <= 0:
+                raise ValueError("总资金必须大于0")
+            if not args:
+                raise ValueError("需要情景文件或涨跌幅")
+            import scenario
+            scenario.require_numpy()
+            try:
+                shocks = [float(a) for a in args]
+            except ValueError:
+                shocks = None
+            if shocks is not None:
+                scenarios, tags = scenario.uniform_scenarios(shocks), {}
+            else:
+                scenarios, tags = scenario.load_scenarios(args[0])
+        except (ValueError, OSError) as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 情景 <情景文件.json | 涨跌幅...> [--capital 总资金] [--top N] [csv|json]")
+            print("示例: /risk 情景 -5 -10 -20 --capital 600000")
+            print("      /risk 情景 scenarios.json --top 10")
+            sys.exit(1)
+        scenario.show_scenarios(scenarios, tags, total_capital, options.get("--top", scenario.DEFAULT_TOP), output_format)
+    
+    elif command in ["调仓", "rebalance"]:
+        args = argv[2:]
+        output_format = next((a for a in args if a in ["csv", "json"]), "table")
+        allow_buy = not any(a in args for a in ["只卖", "--sell-only"])
+        args = [a for a in args if a not in ["csv", "json", "只卖", "--sell-only"]]
+        try:
+            options = pop_options(args, {"--capital": float, "--cash": float, "--lot": int})
+            total_capital = options.get("--capital", float(args[0]) if args else get_total_capital())
+            if total_capital <= 0:
+                raise ValueError("总资金必须大于0")
+            if options.get("--lot", 1) <= 0 or options.get("--cash", 0) < 0:
+                raise ValueError("--lot 必须大于0，--cash 不能为负")
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 调仓 [总资金] [--cash 可用现金] [--lot 100] [只卖] [csv|json]")
+            print("示例: /risk 调仓 600000")
+            print("      /risk 调仓 --capital 600000 --cash 50000 json")
+            sys.exit(1)
+        import rebalance
+        rebalance.show_rebalance(total_capital, options.get("--cash"), options.get("--lot", rebalance.DEFAULT_LOT),
+                                 allow_buy, output_format)
+    
+    elif command in ["止损监控", "watch-stops"]:
+        source = argv[2] if len(argv) > 2 else "-"
+        import stop_watcher
+        try:
+            stop_watcher.watch_prices(source)
+        except OSError as e:
+            print(f"❌ 读取文件失败: {e}")
+            sys.exit(1)
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 止损监控 [文件|-]（CSV：code,现价；有表头时按 code/代码 列匹配）")
+            print("示例: /risk 止损监控 ticks.csv")
+            sys.exit(1)
+
+    elif command in ["行情", "prices"]:
+        try:
+            days = int(argv[2]) if len(argv) > 2 else 30
+            stock_id = int(argv[3]) if len(argv) > 3 else None
+            if days <= 0:
+                raise ValueError("天数必须大于0")
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 行情 [天数] [id]")
+            print("示例: /risk 行情 30")
+            print("      /risk 行情 90 1")
+            sys.exit(1)
+        import price_history
+        price_history.show_prices(days, stock_id)
+
+    elif command in ["压缩行情", "compact-prices"]:
+        try:
+            keep_days = int(argv[2]) if len(argv) > 2 else 30
+            if keep_days < 0:
+                raise ValueError("保留天数不能为负数")
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 压缩行情 [保留天数]")
+            print("示例: /risk 压缩行情 30")
+            sys.exit(1)
+        import price_history
+        start = time.perf_counter()
+        ticks, bars = price_history.compact_prices(keep_days)
+        elapsed = time.perf_counter() - start
+        print(f"✅ 压缩完成！删除 {ticks} 条原始价格，按原始价格校正 {bars} 根日K线（保留最近 {keep_days} 天原始价格）")
+        print(f"   耗时: {elapsed * 1000:.1f}ms")
+
+    elif command in ["搜索", "search"]:
+        args = argv[2:]
+        include_deleted = any(p in args for p in ["历史", "--all"])
+        args = [a for a in args if a not in ["历史", "--all"]]
+        try:
+            options = pop_options(args, {"--limit": int})
+            if options.get("--limit", 1) <= 0:
+                raise ValueError("--limit 必须大于0")
+            output_format = next((a for a in args if a in ["csv", "json"]), "table")
+            query = " ".join(a for a in args if a not in ["csv", "json"])
+            if not query.strip():
+                raise ValueError("缺少关键词")
+            search_stocks(query, include_deleted, options.get("--limit"), output_format)
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 搜索 <关键词...> [--limit 20] [历史] [json|csv]")
+            print("示例: /risk 搜索 芯片")
+            print("      /risk 搜索 AI 龙头 历史")
+            sys.exit(1)
+
+    elif command in ["导入", "import"]:
+        args = argv[2:]
+        try:
+            options = pop_options(args, {"--mapping": str, "--batch": int, "--capital": float, "--stop-pct": float,
+                                         "--rejects": str})
+            if not args:
+                raise ValueError("缺少文件")
+            if options.get("--batch", 1) <= 0:
+                raise ValueError("--batch 必须大于0")
+            total_capital = options.get("--capital", get_total_capital())
+            if total_capital <= 0:
+                raise ValueError("总资金必须大于0")
+            if not 0 < options.get("--stop-pct", 8) < 100:
+                raise ValueError("--stop-pct 必须在0到100之间")
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 导入 <文件.csv|文件.xlsx|-> [--mapping 列映射.json] [--batch 5000] [--capital 总资金] "
+                  "[--stop-pct 8] [--rejects 拒绝文件.csv]")
+            print("示例: /risk 导入 持仓.csv --capital 600000")
+            print("      /risk 导入 持仓.xlsx --mapping 华泰.json --stop-pct 10")
+            sys.exit(1)
+        import broker_import
+        try:
+            broker_import.import_file(args[0], options.get("--mapping"),
+                                      options.get("--batch", broker_import.DEFAULT_BATCH),
+                                      total_capital,
+                                      options.get("--stop-pct", broker_import.DEFAULT_STOP_PCT),
+                                      options.get("--rejects"))
+        except BrokenPipeError:
+            raise
+        except (OSError, ValueError) as e:
+            print(f"❌ 导入失败: {e}")
+            sys.exit(1)
+
+    elif command in ["交易", "trade"]:
+        args = argv[2:]
+        try:
+            options = pop_options(args, {"--time": str, "--capital": float})
+            if len(args) < 4:
+                raise ValueError("缺少参数")
+            import trade_ledger
+            stock_id = int(args[0])
+            kind = {"买入": "买入", "buy": "买入", "卖出": "卖出", "sell": "卖出"}.get(args[1])
+            if kind is None:
+                raise ValueError("交易类型必须是 买入 或 卖出")
+            quantity, price = float(args[2]), float(args[3])
+            if quantity <= 0 or price <= 0:
+                raise ValueError("数量和价格必须大于0")
+            ts = trade_ledger.parse_time(options["--time"]) if "--time" in options else None
+            total_capital = options.get("--capital", get_total_capital())
+            if total_capital <= 0:
+                raise ValueError("总资金必须大于0")
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 交易 <id> <买入|卖出> <数量> <价格> [--time 成交时间] [--capital 总资金] [备注]")
+            print("示例: /risk 交易 1 买入 100 2980")
+            print("      /risk 交易 1 卖出 200 2457 --time \"2024-03-01 14:30\" 止损离场")
+            sys.exit(1)
+        try:
+            trade_ledger.record_trade(stock_id, kind, quantity, price, ts, " ".join(args[4:]) or None, total_capital)
+        except ValueError as e:
+            print(f"❌ 交易未记录: {e}")
+            sys.exit(1)
+
+    elif command in ["回溯", "as-of"]:
+        args = argv[2:]
+        output_format = next((a for a in args if a in ["csv", "json"]), "table")
+        args = [a for a in args if a not in ["csv", "json"]]
+        try:
+            if not args or len(args) > 2:
+                raise ValueError("需要时间（可选持仓ID）")
+            import trade_ledger
+            ts = None if args[0] in ["当前", "now"] else trade_ledger.parse_time(args[0])
+            stock_id = int(args[1]) if len(args) > 1 else None
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 回溯 <日期|\"日期 时间\"|当前> [id] [json|csv]")
+            print("示例: /risk 回溯 2024-03-01")
+            print("      /risk 回溯 \"2024-03-01 10:30\" 1")
+            sys.exit(1)
+        trade_ledger.show_positions_at(ts, stock_id, output_format)
+
+    elif command in ["归档", "archive"]:
+        args = argv[2:]
+        preview = any(p in args for p in ["预览", "--dry-run"])
+        args = [a for a in args if a not in ["预览", "--dry-run"]]
+        try:
+            options = pop_options(args, {"--batch": int})
+            days = float(args[0]) if args else 30
+            if days < 0:
+                raise ValueError("天数不能为负数")
+            if options.get("--batch", 1) <= 0:
+                raise ValueError("--batch 必须大于0")
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 归档 [天数] [--batch 5000] [预览]")
+            print("示例: /risk 归档 30")
+            sys.exit(1)
+        archive_stocks(days, options.get("--batch"), preview)
+
+    elif command in ["止损建议", "stop-suggest"]:
+        import volatility
+        args = argv[2:]
+        if any(a in args for a in ["重建", "--rebuild"]):
+            volatility.rebuild()
+        else:
+            output_format = next((a for a in args if a in ["csv", "json"]), "table")
+            try:
+                options = pop_options(args, {"--atr": float, "--risk": float})
+                rest = [a for a in args if a not in ["csv", "json"]]
+                stock_id = int(rest[0]) if rest else None
+                atr_multiple = options.get("--atr", volatility.STOP_ATR_MULTIPLE)
+                target_risk = options.get("--risk", 2)
+                if atr_multiple <= 0 or target_risk <= 0:
+                    raise ValueError("--atr、--risk 必须大于0")
+            except ValueError as e:
+                print(f"❌ 参数错误: {e}")
+                print("用法: /risk 止损建议 [id] [--atr 2] [--risk 2] [csv|json]")
+                print("示例: /risk 止损建议")
+                print("      /risk 止损建议 3 --atr 2.5 --risk 1")
+                sys.exit(1)
+            volatility.show_stop_suggestions(stock_id, atr_multiple, target_risk, output_format)
+
+    elif command in ["汇总", "summary"]:
+        args = argv[2:]
+        fix = any(p in args for p in ["修复", "--fix"])
+        check = fix or any(p in args for p in ["校验", "--check"])
+        if any(p in args for p in ["全部组合", "--all-portfolios"]):
+            import portfolios
+            try:
+                options = pop_options(args, {"--workers": int})
+                workers = options.get("--workers", portfolios.SUMMARY_WORKERS)
+                if workers <= 0:
+                    raise ValueError("--workers 必须大于0")
+                if check:
+                    raise ValueError("校验/修复 针对单个组合，请用 --portfolio 指定")
+            except ValueError as e:
+                print(f"❌ 参数错误: {e}")
+                print("用法: /risk 汇总 全部组合 [--workers 8]")
+                print("示例: /risk 汇总 校验 --portfolio 趋势策略")
+                sys.exit(1)
+            if portfolios.show_all_summary(workers):
+                sys.exit(1)
+        elif show_summary(check, fix) and not fix:
+            sys.exit(1)
+    
+    elif command in ["性能报告", "profile-report"]:
+        args = argv[2:]
+        try:
+            options = pop_options(args, {"--cmd": str})
+        except ValueError as e:
+            print(f"❌ 参数错误: {e}")
+            print("用法: /risk 性能报告 [记录文件...] [--cmd 命令] [csv|json]")
+            sys.exit(1)
+        output_format = next((a for a in args if a in ["csv", "json"]), "table")
+        sources = [a for a in args if a not in ["csv", "json"]]
+        if not sources:
+            default = profiling.env_file()
+            if not default:
+                print("❌ 参数错误: 请指定记录文件（或设置 RISK_PROFILE=文件）")
+                print("用法: /risk 性能报告 [记录文件...] [--cmd 命令] [csv|json]")
+                print("示例: /risk 列表 --profile=profile.jsonl")
+                print("      /risk 性能报告 profile.jsonl --cmd 列表")
+                sys.exit(1)
+            sources = [default]
+        try:
+            profiling.show_report(sources, options.get("--cmd"), output_format)
+        except OSError as e:
+            print(f"❌ 读取失败: {e}")
+            sys.exit(1)
+
     elif command == "删除":
-        if len(sys.argv) != 3:
+        if len(argv) != 3:
             print("❌ 参数错误")
             print("用法: /risk 删除 <id>")
             print("示例: /risk 删除 1")
             sys.exit(1)
         try:
-            stock_id = int(sys.argv[2])
+            stock_id = int(argv[2])
             delete_stock(stock_id)
         except ValueError as e:
             print(f"❌ 参数错误: {e}")
@@ -762,16 +1913,16 @@ if __name__ == "__main__":
             sys.exit(1)
     
     elif command in ["集中", "集中"]:
-        if len(sys.argv) < 4:
+        if len(argv) < 4:
             print("❌ 参数错误")
             print("用法: /risk 集中 <现价> <止损价> [目标风险]")
             print("示例: /risk 集中 2960 2457")
             print("      /risk 集中 2960 2457 1")
             sys.exit(1)
         try:
-            current_price = float(sys.argv[2])
-            stop_loss = float(sys.argv[3])
-            target_risk = float(sys.argv[4]) if len(sys.argv) > 4 else 2
+            current_price = float(argv[2])
+            stop_loss = float(argv[3])
+            target_risk = float(argv[4]) if len(argv) > 4 else 2
             calculate_concentrated(current_price, stop_loss, target_risk)
         except ValueError as e:
             print(f"❌ 参数错误: {e}")
@@ -779,16 +1930,16 @@ if __name__ == "__main__":
             sys.exit(1)
     
     elif command in ["分散", "2%分散"]:
-        if len(sys.argv) < 4:
+        if len(argv) < 4:
             print("❌ 参数错误")
             print("用法: /risk 分散 <现价> <止损价> [目标风险]")
             print("示例: /risk 分散 2960 2457")
             print("      /risk 分散 2960 2457 1")
             sys.exit(1)
         try:
-            current_price = float(sys.argv[2])
-            stop_loss = float(sys.argv[3])
-            target_risk = float(sys.argv[4]) if len(sys.argv) > 4 else 2
+            current_price = float(argv[2])
+            stop_loss = float(argv[3])
+            target_risk = float(argv[4]) if len(argv) > 4 else 2
             calculate_diversified(current_price, stop_loss, target_risk)
         except ValueError as e:
             print(f"❌ 参数错误: {e}")
@@ -800,3 +1951,8 @@ if __name__ == "__main__":
         print()
         show_help()
         sys.exit(1)
+
+if __name__ == "__main__":
+    # 以模块身份运行，扩展模块 import stock_db 时拿到的是同一份连接和状态
+    import stock_db
+    stock_db.main(sys.argv)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 止损监控
+按股票代码把持仓的止损价、10%警戒价排成有序数组，价格到来时只用二分查找定位
+真正穿越了阈值的持仓，逐个判断状态并输出变化事件，不再每个价格都把全部持仓重算一遍
+状态判断与 stock_db.get_simple_suggestion 一致：现价≤止损价 → 清仓，离止损价10%以内 → 注意
+"""
+
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+import stock_db
+
+STATE_OK = 0
+STATE_WARN = 1
+STATE_STOP = 2
+
+STATE_LABELS = ["正常", "⚠️ 注意", "🆘 清仓"]
+
+# 离止损价10%以内 ⇔ 现价 ≤ 止损价 / 0.9
+WARN_RATIO = 0.9
+
+# 二分查找区间放宽的相对误差：阈值换算有浮点误差，边界附近的持仓都拿出来按原公式判断
+EPSILON = 1e-9
+
+StopEvent = namedtuple("StopEvent", ["stock_id", "code", "price", "old_state", "new_state"])
+
+def stop_state(current_price, stop_loss):
+    """与 get_simple_suggestion 相同的止损判断"""
+    if current_price <= stop_loss:
+        return STATE_STOP
+    if (current_price - stop_loss) / current_price * 100 <= 10:
+        return STATE_WARN
+    return STATE_OK
+
+class SymbolBook:
+    """一个股票代码下的持仓：警戒价、止损价各一个有序数组
+
+    同一代码的几笔持仓现价不同（分别更新过）时，价格记为 None：第一个价格逐笔判断全部持仓，之后共用这个代码的最新价
+    """
+
+    __slots__ = ("price", "warn_levels", "warn_ids", "stop_levels", "stop_ids", "stop_loss", "states")
+
+    def __init__(self, holdings):
+        # holdings: [(stock_id, 止损价, 现价), ...]
+        prices = {price for _, _, price in holdings}
+        self.price = prices.pop() if len(prices) == 1 else None
+        self.stop_loss = {stock_id: stop for stock_id, stop, _ in holdings}
+        by_stop = sorted(holdings, key=lambda h: h[1])
+        self.stop_levels = [stop for _, stop, _ in by_stop]
+        self.stop_ids = [stock_id for stock_id, _, _ in by_stop]
+        self.warn_levels = [stop / WARN_RATIO for stop in self.stop_levels]
+        self.warn_ids = self.stop_ids
+        self.states = {stock_id: STATE_OK if price is None else stop_state(price, stop)
+                       for stock_id, stop, price in holdings}
+
+    def crossed(self, old_price, new_price):
+        """阈值落在新旧价格之间的持仓ID"""
+        if old_price is None:
+            return self.stop_ids
+        lo, hi = (new_price, old_price) if new_price < old_price else (old_price, new_price)
+        lo, hi = lo * (1 - EPSILON), hi * (1 + EPSILON)
+        ids = []
+        for levels, level_ids in ((self.warn_levels, self.warn_ids), (self.stop_levels, self.stop_ids)):
+            i = bisect_left(levels, lo)
+            j = bisect_right(levels, hi, i)
+            if i < j:
+                ids.extend(level_ids[i:j])
+        return ids
+
+class StopWatcher:
+    """止损监控：按代码分组的有序阈值，on_price 返回状态变化事件"""
+
+    def __init__(self, holdings=()):
+        # holdings: [(stock_id, code, 止损价, 现价), ...]，没有止损价的持仓不监控
+        groups = {}
+        for stock_id, code, stop_loss, current_price in holdings:
+            if code and stop_loss and stop_loss > 0:
+                groups.setdefault(code, []).append((stock_id, stop_loss, current_price))
+        self.books = {code: SymbolBook(entries) for code, entries in groups.items()}
+        self.stats = {"ticks": 0, "checked": 0, "events": 0}
+
+    def on_price(self, code, price):
+        """处理一个价格，返回 [StopEvent, ...]（大多数价格不穿越任何阈值，返回空列表）"""
+        self.stats["ticks"] += 1
+        book = self.books.get(code)
+        if book is None or price == book.price:
+            return []
+        old_price, book.price = book.price, price
+        candidates = book.crossed(old_price, price)
+        if not candidates:
+            return []
+
+        events = []
+        states = book.states
+        self.stats["checked"] += len(candidates)
+        # 同一持仓可能同时穿越警戒价和止损价，去重后按ID顺序输出
+        for stock_id in sorted(set(candidates)):
+            new_state = stop_state(price, book.stop_loss[stock_id])
+            old_state = states[stock_id]
+            if new_state != old_state:
+                states[stock_id] = new_state
+                events.append(StopEvent(stock_id, code, price, old_state, new_state))
+        self.stats["events"] += len(events)
+        return events
+
+    def states(self):
+        """当前所有持仓状态 {stock_id: 状态}"""
+        return {stock_id: state for book in self.books.values() for stock_id, state in book.states.items()}
+
+def load_watcher(conn):
+    """从数据库读取当前持仓建立监控"""
+    rows = conn.execute("""
+        SELECT id, code, stop_loss, current_price FROM stocks
+        WHERE is_deleted = 0 AND stop_loss > 0 AND code IS NOT NULL
+    """).fetchall()
+    return StopWatcher(rows)
+
+def format_event(event, names):
+    """事件 → 一行提示"""
+    name = names.get(event.stock_id, event.stock_id)
+    transition = f"{STATE_LABELS[event.old_state]} → {STATE_LABELS[event.new_state]}"
+    if event.new_state == STATE_STOP:
+        return f"🆘 {name} 现价 {event.price:.2f} 跌穿止损价（{transition}）"
+    if event.new_state == STATE_WARN:
+        return f"⚠️ {name} 现价 {event.price:.2f} 离止损价10%以内（{transition}）"
+    return f"✅ {name} 现价 {event.price:.2f} 回到止损警戒线以上（{transition}）"
+
+def watch_prices(source="-"):
+    """回放价格（CSV：code,现价，'-'表示stdin），输出止损状态变化"""
+    conn = stock_db.get_conn()
+    try:
+        watcher = load_watcher(conn)
+        names = {stock_id: f"{name}({code})" for stock_id, name, code in
+                 conn.execute("SELECT id, name, code FROM stocks WHERE is_deleted = 0")}
+    finally:
+        stock_db.release_conn(conn)
+
+    _, rows, skipped = stock_db.read_price_rows(source, key="code")
+    start = time.perf_counter()
+    for code, price in rows:
+        for event in watcher.on_price(code, price):
+            print(format_event(event, names))
+    elapsed = time.perf_counter() - start
+
+    stats = watcher.stats
+    print(f"📊 监控 {len(watcher.books)} 个代码，处理 {stats['ticks']} 个价格，"
+          f"状态变化 {stats['events']} 次（只检查了 {stats['checked']} 个持仓）")
+    print(f"   耗时: {elapsed * 1000:.1f}ms")
+    if skipped:
+        print(f"   ⚠️ 格式错误已跳过: 第 {', '.join(str(n) for n, _ in skipped)} 行")
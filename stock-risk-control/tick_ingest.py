@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 实时行情接入
+asyncio读取价格流（JSONL文件、命名管道、stdin或TCP），每个代码只保留最新价格，
+每隔N毫秒或攒够M个代码就在一个事务里批量写入（复用 bulk_update_stocks），不再每个价格写一次库
+
+价格格式（每行一条）：{"code": "600519", "price": 1600.5, "ts": 1760000000}，ts可省略；
+也接受 CSV：600519,1600.5
+"""
+
+import sys
+import os
+import json
+import stat
+import time
+import asyncio
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import stock_db
+
+# 默认刷新间隔（毫秒）和批量大小（代码数）
+DEFAULT_INTERVAL_MS = 500
+DEFAULT_BATCH_SIZE = 500
+
+# 解析后待合并的价格队列上限，写满时读取端等待（背压）
+QUEUE_SIZE = 10000
+
+# 定期输出指标的间隔（秒）
+STATS_INTERVAL = 5
+
+def _parse_ts(value):
+    """ts 字段 → Unix秒（整数）；没有时为None，不是数字或超出范围抛 ValueError"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError("ts 不是数字")
+    ts = int(value)
+    # SQLite 整数是64位；负数不是合法的价格时间
+    if not 0 <= ts < 1 << 63:
+        raise ValueError("ts 超出范围")
+    return ts
+
+def parse_tick(line):
+    """一行 → (代码, 价格, 时间戳或None)，格式错误（含 ts 不是Unix秒）返回None"""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    try:
+        if line.startswith("{"):
+            tick = json.loads(line)
+            return str(tick["code"]), float(tick["price"]), _parse_ts(tick.get("ts"))
+        code, price = line.split(",")[:2]
+        return code.strip(), float(price), None
+    except (ValueError, KeyError, TypeError, OverflowError):
+        return None
+
+def parse_source(source):
+    """'tcp:端口' / 'tcp:主机:端口' → (主机, 端口)；其他返回None（按文件/管道读取）"""
+    if not source.startswith("tcp:"):
+        return None
+    parts = source[4:].rsplit(":", 1)
+    host, port = (parts[0], parts[1]) if len(parts) == 2 else ("127.0.0.1", parts[0])
+    return host, int(port)
+
+class TickIngestor:
+    """读取 → 合并 → 批量写入，三段通过asyncio队列和事件衔接"""
+
+    def __init__(self, interval_ms=DEFAULT_INTERVAL_MS, batch_size=DEFAULT_BATCH_SIZE,
+                 total_capital=None):
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+        self.total_capital = total_capital
+        self.queue = None
+        self.flush_now = None
+        # 写库线程和它自己的连接（sqlite3 连接不能跨线程，不借用常驻进程的共享连接）
+        self.writer = None
+        self.conn = None
+        # 待写入：代码 -> (价格, 时间戳)
+        self.pending = {}
+        self.closed = False
+        self.flush_latencies = []
+        self.metrics = {
+            "received": 0,      # 收到的价格
+            "invalid": 0,       # 格式错误
+            "coalesced": 0,     # 被同代码更新的价格覆盖（合并丢弃）
+            "written": 0,       # 写入数据库的股票行数
+            "unknown": 0,       # 找不到（或已删除）的代码
+            "flushes": 0,
+            "max_queue": 0,
+        }
+
+    async def put_line(self, line):
+        tick = parse_tick(line)
+        if tick is None:
+            if line.strip() and not line.lstrip().startswith("#"):
+                self.metrics["invalid"] += 1
+            return
+        self.metrics["received"] += 1
+        await self.queue.put(tick)
+        if self.queue.qsize() > self.metrics["max_queue"]:
+            self.metrics["max_queue"] = self.queue.qsize()
+
+    async def read_stream(self, reader):
+        """逐行读取 asyncio.StreamReader，读到EOF结束"""
+        while line := await reader.readline():
+            await self.put_line(line.decode("utf-8", "replace"))
+
+    async def read_pipe(self, fd):
+        """命名管道/stdin：注册到事件循环非阻塞读，写库出错取消读取时不会卡在阻塞的 os.read 上"""
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        # 传输关闭时会关掉文件，用复制的fd；非阻塞标志和原fd共用，读完恢复
+        pipe = os.fdopen(os.dup(fd), "rb", buffering=0)
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        try:
+            await self.read_stream(reader)
+        finally:
+            transport.close()
+            os.set_blocking(fd, True)
+
+    async def read_fd(self, fd):
+        """读取文件/命名管道/stdin，读到EOF结束
+
+        普通文件不能注册到事件循环：在线程里 os.read，拿到多少处理多少（文件总会读完，不会一直阻塞）
+        """
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            await self.read_pipe(fd)
+            return
+        loop = asyncio.get_running_loop()
+        rest = b""
+        while True:
+            chunk = await loop.run_in_executor(None, os.read, fd, 1 << 16)
+            if not chunk:
+                break
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                await self.put_line(line.decode("utf-8", "replace"))
+        if rest:
+            await self.put_line(rest.decode("utf-8", "replace"))
+
+    async def handle_client(self, reader, writer):
+        """TCP连接：每行一条价格，连接关闭即结束"""
+        try:
+            await self.read_stream(reader)
+        finally:
+            writer.close()
+
+    async def coalesce(self):
+        """从队列取价格，每个代码只保留最新一条"""
+        while True:
+            tick = await self.queue.get()
+            if tick is None:
+                break
+            code, price, ts = tick
+            pending = self.pending
+            if code in pending:
+                self.metrics["coalesced"] += 1
+            pending[code] = (price, ts)
+            if len(pending) >= self.batch_size:
+                self.flush_now.set()
+
+    def _write(self, rows):
+        """在写库线程里执行：第一次用时打开这个线程自己的连接，之后每批复用"""
+        if self.conn is None:
+            self.conn = stock_db.open_db(stock_db.current_db_path(), verbose=False)
+        return stock_db.open_store(self.conn, self.total_capital).update_prices(rows, True)
+
+    def _close_conn(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    async def flush(self):
+        """换出待写入的价格，在写库线程里一个事务写入（写库期间继续接收和合并）"""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        # 每个代码按自己最新价格的时间写入（没带 ts 的用写入时间），回放历史行情时K线和交易日不会错位
+        rows = [(code, price, ts) for code, (price, ts) in batch.items()]
+        start = time.perf_counter()
+        updated, missing = await asyncio.get_running_loop().run_in_executor(self.writer, self._write, rows)
+        self.flush_latencies.append((time.perf_counter() - start) * 1000)
+        self.metrics["flushes"] += 1
+        self.metrics["written"] += updated
+        self.metrics["unknown"] += len(missing)
+
+    async def flush_loop(self):
+        """每隔 interval 或攒够 batch_size 个代码刷新一次，输入结束后写完剩余价格"""
+        while not self.closed or self.pending:
+            try:
+                await asyncio.wait_for(self.flush_now.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_now.clear()
+            await self.flush()
+
+    async def report_loop(self, interval=STATS_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            print(self.format_metrics(), file=sys.stderr)
+
+    def snapshot(self):
+        """当前指标（含队列深度和刷新延迟分位数）"""
+        latencies = sorted(self.flush_latencies)
+        metrics = dict(self.metrics, queue_depth=self.queue.qsize() if self.queue else 0,
+                       pending=len(self.pending))
+        if latencies:
+            metrics["flush_p50_ms"] = statistics.median(latencies)
+            metrics["flush_p95_ms"] = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+            metrics["flush_max_ms"] = latencies[-1]
+        return metrics
+
+    def format_metrics(self):
+        m = self.snapshot()
+        line = (f"📊 队列 {m['queue_depth']}（峰值 {m['max_queue']}） | 收到 {m['received']} | "
+                f"合并丢弃 {m['coalesced']} | 写入 {m['written']} 行/{m['flushes']} 次")
+        if "flush_p50_ms" in m:
+            line += f" | 刷新延迟 p50 {m['flush_p50_ms']:.1f}ms p95 {m['flush_p95_ms']:.1f}ms"
+        return line
+
+    async def read(self, source):
+        """按来源读取价格流，读到EOF结束（TCP模式一直运行）"""
+        address = parse_source(source)
+        if address:
+            server = await asyncio.start_server(self.handle_client, *address)
+            print(f"✅ 正在监听 {address[0]}:{address[1]}（Ctrl+C 结束）", file=sys.stderr)
+            async with server:
+                await server.serve_forever()
+        elif source == "-":
+            await self.read_fd(sys.stdin.fileno())
+        else:
+            fd = os.open(source, os.O_RDONLY)
+            try:
+                await self.read_fd(fd)
+            finally:
+                os.close(fd)
+
+    async def run(self, source="-", report=True):
+        """运行到输入结束（TCP模式运行到Ctrl+C）；写库失败时立即停止读取并抛出"""
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.flush_now = asyncio.Event()
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix="tick-flush")
+        consumer = asyncio.create_task(self.coalesce())
+        flusher = asyncio.create_task(self.flush_loop())
+        reporter = asyncio.create_task(self.report_loop()) if report else None
+        reader = asyncio.create_task(self.read(source))
+        try:
+            await asyncio.wait([reader, flusher], return_when=asyncio.FIRST_COMPLETED)
+            if flusher.done():
+                # 刷新循环只会因为写库出错而提前结束：不等输入结束，马上停止读取并抛出
+                reader.cancel()
+                flusher.result()
+            await reader
+        finally:
+            # 输入结束（或被中断）：合并完队列里剩下的价格，再写完最后一批
+            reader.cancel()
+            if not consumer.done():
+                await self.queue.put(None)
+                await consumer
+            self.closed = True
+            self.flush_now.set()
+            try:
+                await flusher
+            finally:
+                if reporter:
+                    reporter.cancel()
+                await asyncio.get_running_loop().run_in_executor(self.writer, self._close_conn)
+                self.writer.shutdown()
+
+def ingest(source="-", interval_ms=DEFAULT_INTERVAL_MS, batch_size=DEFAULT_BATCH_SIZE,
+           total_capital=None):
+    """接入价格流并输出汇总"""
+    # 先在主线程完成数据库初始化/升级，写入线程里直接用
+    stock_db.init_db()
+    ingestor = TickIngestor(interval_ms, batch_size, total_capital)
+    start = time.perf_counter()
+    try:
+        asyncio.run(ingestor.run(source))
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.perf_counter() - start
+
+    m = ingestor.snapshot()
+    print(f"✅ 行情接入结束！收到 {m['received']} 个价格，合并丢弃 {m['coalesced']} 个，"
+          f"写入 {m['written']} 行（{m['flushes']} 次事务）")
+    print(f"   耗时: {elapsed:.2f}s（{m['received'] / elapsed if elapsed > 0 else 0:.0f} 价格/秒）")
+    if "flush_p50_ms" in m:
+        print(f"   刷新延迟: p50 {m['flush_p50_ms']:.1f}ms，p95 {m['flush_p95_ms']:.1f}ms，"
+              f"最大 {m['flush_max_ms']:.1f}ms；队列峰值 {m['max_queue']}")
+    if m["unknown"]:
+        print(f"   ⚠️ 找不到（或已删除）的代码: {m['unknown']} 次")
+    if m["invalid"]:
+        print(f"   ⚠️ 格式错误已跳过: {m['invalid']} 行")
+    return m
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 交易流水
+买入、卖出（含止损离场）逐笔追加到 trades 表，stocks 里的数量和成本价由流水推出；
+添加/导入/删除 也各记一笔校正。每积累 SNAPSHOT_EVERY 笔交易存一次持仓快照，
+按时间点回溯 = 读最近的快照 + 重放之后的交易，不用从头重放整个流水
+"""
+
+import sys
+import time
+from datetime import datetime, timezone
+
+import stock_db
+
+# 时间参数支持的格式（北京时间）；只有日期时取当天收盘之后（23:59:59）
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+def parse_time(text):
+    """'2024-03-01' / '2024-03-01 10:30[:00]'（北京时间）或 Unix秒 → Unix秒"""
+    text = text.strip()
+    if text.isdigit():
+        return int(text)
+    for fmt in TIME_FORMATS:
+        try:
+            parsed = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        ts = int(parsed.replace(tzinfo=timezone.utc).timestamp()) - stock_db.MARKET_UTC_OFFSET
+        return ts + 86399 if fmt == "%Y-%m-%d" else ts
+    raise ValueError(f"无法识别的时间 {text}（格式：2024-03-01 或 \"2024-03-01 10:30\"）")
+
+def format_time(ts):
+    """Unix秒 → 北京时间 'YYYY-MM-DD HH:MM:SS'"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts + stock_db.MARKET_UTC_OFFSET))
+
+def record_trade(stock_id, kind, quantity, price, ts=None, note=None, total_capital=None):
+    """交易命令入口：记一笔买入/卖出并输出更新后的持仓"""
+    conn = stock_db.get_conn()
+    try:
+        stock = stock_db.open_store(conn, total_capital).trade(stock_id, kind, quantity, price, ts, note)
+    finally:
+        stock_db.release_conn(conn)
+
+    if stock is None:
+        print(f"❌ 找不到ID为 {stock_id} 的股票（或已删除）")
+        return None
+    when = f"（成交时间 {format_time(ts)}）" if ts is not None else ""
+    print(f"✅ 已记录{kind} {quantity:g} @ {price:g}{when}  ID: {stock_id} {stock.name}")
+    if stock.is_deleted:
+        print("   已清仓，持仓已删除（可在'历史'里查看，'回溯'可以查清仓之前的持仓）")
+        return stock
+    cost = f"{stock.cost_price:.3f}" if stock.cost_price is not None else "-"
+    print(f"   持有数量: {stock.quantity:g}  成本价: {cost}")
+    print(f"   个股市值: {stock.total_value:.0f}元  仓位: {stock.position:.1f}%  模式: {stock.mode}")
+    return stock
+
+def show_positions_at(ts=None, stock_id=None, output_format="table"):
+    """回溯命令入口：输出某个时间点的持仓（数量、成本价、成本金额）"""
+    conn = stock_db.get_conn()
+    try:
+        store = stock_db.open_store(conn)
+        start = time.perf_counter()
+        positions = store.positions_at(ts, stock_id)
+        elapsed = time.perf_counter() - start
+    finally:
+        stock_db.release_conn(conn)
+
+    if output_format == "json":
+        import json
+        json.dump([p.to_dict() for p in positions], sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        return positions
+    if output_format == "csv":
+        import csv
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["stock_id", "name", "code", "quantity", "cost_price"])
+        writer.writerows([p.stock_id, p.name, p.code, p.quantity, p.cost_price] for p in positions)
+        return positions
+
+    moment = format_time(ts) if ts is not None else "当前"
+    if not positions:
+        print(f"📭 {moment} 没有持仓" + (f"（ID {stock_id}）" if stock_id is not None else ""))
+        return positions
+    print(f"📅 {moment} 的持仓（按交易流水回溯）")
+    print("=" * 72)
+    print(f"{'ID':<6} {'名称':<12} {'代码':<8} {'持有数量':<12} {'成本价':<10} {'成本金额':<12}")
+    print("-" * 72)
+    total_cost = 0.0
+    for p in positions:
+        cost_value = p.quantity * p.cost_price if p.cost_price is not None else None
+        total_cost += cost_value or 0
+        cost = f"{p.cost_price:.3f}" if p.cost_price is not None else "-"
+        value = f"{cost_value:.0f}" if cost_value is not None else "-"
+        print(f"{p.stock_id:<6} {p.name or '-':<12} {p.code or '-':<8} {p.quantity:<12g} {cost:<10} {value:<12}")
+    print("=" * 72)
+    print(f"共 {len(positions)} 只，成本合计 {total_cost:.0f}元（耗时 {elapsed * 1000:.1f}ms）")
+    return positions
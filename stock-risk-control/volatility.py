@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+股票风险控制策略 - 波动率与止损建议
+每次写入价格（stock_db.append_prices）时在同一事务里增量更新 price_stats：当天的最高/最低/最新价，
+加上最近 STATS_WINDOW 个完整交易日的真实波幅和对数收益（环形缓冲 + 滚动和），每个价格 O(1)，不回看历史；
+止损建议按 ATR 判断止损价是否落在日常波动以内，给出 现价 - k×ATR 的止损价和对应的 2% 原则仓位
+"""
+
+import math
+import sys
+from array import array
+
+import stock_db
+
+# 滚动窗口（交易日）：ATR 和实现波动率都取最近20天（海龟法则的N值）
+STATS_WINDOW = 20
+
+# 建议止损 = 现价 - STOP_ATR_MULTIPLE × ATR；止损距离不到 TIGHT_ATR_MULTIPLE 个ATR 算过紧（日常波动就会打掉），
+# 超过 WIDE_ATR_MULTIPLE 个ATR 算偏宽
+STOP_ATR_MULTIPLE = 2.0
+TIGHT_ATR_MULTIPLE = 1.0
+WIDE_ATR_MULTIPLE = 4.0
+
+# 少于几个交易日的价格不给建议
+MIN_STATS_DAYS = 5
+
+# 年化波动率：每年交易日数
+TRADING_DAYS = 250
+
+# 每条 IN (...) 查询最多带多少个id
+LOOKUP_CHUNK = 500
+
+class RollingStats:
+    """一只股票的滚动统计（price_stats 的一行）：当前交易日的K线 + 之前最多 STATS_WINDOW 个完整交易日的环形缓冲
+
+    价格为整数（× PRICE_SCALE），缓冲里每天存 (真实波幅（元）, 对数收益)，没有上一天收盘价时收益为 NaN
+    """
+    __slots__ = ("stock_id", "day", "high", "low", "close", "prev_close", "trough",
+                 "days", "ret_days", "pos", "tr_sum", "ret_sum", "ret_sq_sum", "ring")
+
+    COLUMNS = ("stock_id", "day", "high", "low", "close", "prev_close", "trough",
+               "days", "ret_days", "pos", "tr_sum", "ret_sum", "ret_sq_sum", "ring")
+
+    @classmethod
+    def start(cls, stock_id, day, high, low, close):
+        stats = cls()
+        stats.stock_id, stats.day, stats.high, stats.low, stats.close = stock_id, day, high, low, close
+        stats.prev_close, stats.trough = None, low
+        stats.days = stats.ret_days = stats.pos = 0
+        stats.tr_sum = stats.ret_sum = stats.ret_sq_sum = 0.0
+        stats.ring = array("d", bytes(16 * STATS_WINDOW))
+        return stats
+
+    @classmethod
+    def from_row(cls, row):
+        """price_stats 的一行（COLUMNS 顺序）→ RollingStats"""
+        stats = cls()
+        (stats.stock_id, stats.day, stats.high, stats.low, stats.close, stats.prev_close, stats.trough,
+         stats.days, stats.ret_days, stats.pos, stats.tr_sum, stats.ret_sum, stats.ret_sq_sum, ring) = row
+        stats.ring = array("d")
+        stats.ring.frombytes(ring)
+        return stats
+
+    def to_row(self):
+        return (self.stock_id, self.day, self.high, self.low, self.close, self.prev_close, self.trough,
+                self.days, self.ret_days, self.pos, self.tr_sum, self.ret_sum, self.ret_sq_sum, self.ring.tobytes())
+
+    def add(self, day, high, low, close):
+        """合并一根K线（单个价格时 high = low = close）；进入新交易日时把上一天推进缓冲
+
+        早于当前交易日的补录价格只更新最低价，不进入滚动统计（'止损建议 重建' 按日K线重新计算）
+        """
+        self.trough = min(self.trough, low)
+        if day < self.day:
+            return
+        if day == self.day:
+            self.high = max(self.high, high)
+            self.low = min(self.low, low)
+            self.close = close
+            return
+        self._push(*self._day_stats())
+        self.prev_close = self.close
+        self.day, self.high, self.low, self.close = day, high, low, close
+
+    def _day_stats(self):
+        """当前交易日的 (真实波幅（元）, 对数收益)"""
+        unit = 1 / stock_db.PRICE_SCALE
+        if self.prev_close is None:
+            return (self.high - self.low) * unit, math.nan
+        tr = (max(self.high, self.prev_close) - min(self.low, self.prev_close)) * unit
+        ret = math.log(self.close / self.prev_close) if self.close > 0 and self.prev_close > 0 else math.nan
+        return tr, ret
+
+    def _push(self, tr, ret):
+        """一个完整交易日进缓冲：写满后覆盖最旧的一天，滚动和减去旧值加上新值"""
+        i = 2 * self.pos
+        if self.days == STATS_WINDOW:
+            old_tr, old_ret = self.ring[i], self.ring[i + 1]
+            self.tr_sum -= old_tr
+            if not math.isnan(old_ret):
+                self.ret_sum -= old_ret
+                self.ret_sq_sum -= old_ret * old_ret
+                self.ret_days -= 1
+        else:
+            self.days += 1
+        self.ring[i], self.ring[i + 1] = tr, ret
+        self.tr_sum += tr
+        if not math.isnan(ret):
+            self.ret_sum += ret
+            self.ret_sq_sum += ret * ret
+            self.ret_days += 1
+        self.pos = (self.pos + 1) % STATS_WINDOW
+        if self.pos == 0:
+            # 每转一圈按缓冲重新求和，加减产生的浮点误差不会一直累积
+            rets = [r for r in self.ring[1::2] if not math.isnan(r)]
+            self.tr_sum = math.fsum(self.ring[0::2])
+            self.ret_sum = math.fsum(rets)
+            self.ret_sq_sum = math.fsum(r * r for r in rets)
+
+    def current(self):
+        """含当前交易日（可能还没收盘）的 (ATR（元）, 日波动率, 天数)：当天顶替缓冲里最旧的一天，O(1)
+
+        少于2个收益时日波动率为 None
+        """
+        days, tr_sum, ret_days, ret_sum, ret_sq_sum = self.days, self.tr_sum, self.ret_days, self.ret_sum, self.ret_sq_sum
+        if days == STATS_WINDOW:
+            old_tr, old_ret = self.ring[2 * self.pos], self.ring[2 * self.pos + 1]
+            days, tr_sum = days - 1, tr_sum - old_tr
+            if not math.isnan(old_ret):
+                ret_days, ret_sum, ret_sq_sum = ret_days - 1, ret_sum - old_ret, ret_sq_sum - old_ret * old_ret
+        tr, ret = self._day_stats()
+        days, tr_sum = days + 1, tr_sum + tr
+        if not math.isnan(ret):
+            ret_days, ret_sum, ret_sq_sum = ret_days + 1, ret_sum + ret, ret_sq_sum + ret * ret
+        volatility = None
+        if ret_days >= 2:
+            volatility = math.sqrt(max(0.0, (ret_sq_sum - ret_sum * ret_sum / ret_days) / (ret_days - 1)))
+        return tr_sum / days, volatility, days
+
+_UPSERT_SQL = (f"INSERT OR REPLACE INTO price_stats ({', '.join(RollingStats.COLUMNS)}) "
+               f"VALUES ({', '.join('?' * len(RollingStats.COLUMNS))})")
+
+def load_stats(cursor, stock_ids):
+    """{stock_id: RollingStats}，没有统计的id不在结果里"""
+    found = {}
+    stock_ids = list(stock_ids)
+    for start in range(0, len(stock_ids), LOOKUP_CHUNK):
+        part = stock_ids[start:start + LOOKUP_CHUNK]
+        cursor.execute(f"SELECT {', '.join(RollingStats.COLUMNS)} FROM price_stats "
+                       f"WHERE stock_id IN ({', '.join('?' * len(part))})", part)
+        found.update((row[0], RollingStats.from_row(row)) for row in cursor.fetchall())
+    return found
+
+def update_stats(cursor, day, prices):
+    """写入价格时增量更新滚动统计（在调用方的写事务内执行）
+
+    prices: [(stock_id, 价格 × PRICE_SCALE), ...]，按写入顺序；每只股票读一行、写一行，与历史长度无关；
+    按 LOOKUP_CHUNK 只股票一组读写，大批量导入时内存里只有一组统计
+    """
+    by_stock = {}
+    for stock_id, price in prices:
+        by_stock.setdefault(stock_id, []).append(price)
+    stock_ids = list(by_stock)
+    for start in range(0, len(stock_ids), LOOKUP_CHUNK):
+        part = stock_ids[start:start + LOOKUP_CHUNK]
+        states = load_stats(cursor, part)
+        for stock_id in part:
+            stats = states.get(stock_id)
+            for price in by_stock[stock_id]:
+                if stats is None:
+                    stats = states[stock_id] = RollingStats.start(stock_id, day, price, price, price)
+                else:
+                    stats.add(day, price, price, price)
+        cursor.executemany(_UPSERT_SQL, [stats.to_row() for stats in states.values()])
+
+def rebuild_stats(cursor):
+    """按日K线重新计算全部滚动统计（迁移、补录旧价格或压缩行情之后），返回股票数
+
+    缓冲只需要每只股票最近 STATS_WINDOW + 2 根K线（最旧的一根只提供前收盘价），按主键倒序各取这么多根；
+    最低价用 MIN(low) 在SQLite里汇总，不把全部K线读进Python
+    """
+    cursor.execute("DELETE FROM price_stats")
+    rows = []
+    troughs = cursor.connection.execute("SELECT stock_id, MIN(low) FROM price_bars GROUP BY stock_id").fetchall()
+    for stock_id, trough in troughs:
+        bars = cursor.execute("""
+            SELECT day, high, low, close FROM price_bars WHERE stock_id = ? ORDER BY day DESC LIMIT ?
+        """, (stock_id, STATS_WINDOW + 2)).fetchall()
+        bars.reverse()
+        stats = RollingStats.start(stock_id, *bars[0])
+        for bar in bars[1:]:
+            stats.add(*bar)
+        stats.trough = trough
+        rows.append(stats.to_row())
+    cursor.executemany(_UPSERT_SQL, rows)
+    return len(rows)
+
+def rebuild():
+    """止损建议 重建 命令入口"""
+    conn = stock_db.get_conn()
+    try:
+        count = stock_db.run_write(conn, rebuild_stats)
+    finally:
+        stock_db.release_conn(conn)
+    print(f"✅ 已按日K线重建 {count} 只股票的波动统计")
+    return count
+
+def _fmt(value, spec=".2f", suffix=""):
+    return format(value, spec) + suffix if value is not None else "-"
+
+def _verdict(suggestion):
+    if suggestion.atr is None:
+        return f"📭 数据不足（{suggestion.days}天）"
+    if suggestion.stop_loss is None or suggestion.stop_loss <= 0:
+        return "📝 未设止损"
+    if suggestion.stop_loss >= suggestion.current_price:
+        return "🆘 已跌穿"
+    if suggestion.atr == 0:
+        # 停牌或货币基金这类价格一直不动的：没有波幅可比，不按ATR判断
+        return "💤 无波动"
+    if suggestion.stop_atr < TIGHT_ATR_MULTIPLE:
+        return "⚠️ 过紧"
+    if suggestion.stop_atr > WIDE_ATR_MULTIPLE:
+        return "📏 偏宽"
+    return "✅ 合适"
+
+def show_stop_suggestions(stock_id=None, atr_multiple=STOP_ATR_MULTIPLE, target_risk=2, output_format="table"):
+    """止损建议命令入口"""
+    conn = stock_db.get_conn()
+    try:
+        suggestions = stock_db.open_store(conn).stop_suggestions(stock_id, atr_multiple, target_risk)
+    finally:
+        stock_db.release_conn(conn)
+
+    if output_format == "json":
+        import json
+        json.dump([dict(s.to_dict(), verdict=_verdict(s)) for s in suggestions], sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        return suggestions
+    if output_format == "csv":
+        import csv
+        fields = ["stock_id", "name", "code", "current_price", "stop_loss", "days", "atr", "volatility", "mae",
+                  "stop_atr", "suggested_stop", "suggested_position", "position"]
+        writer = csv.writer(sys.stdout)
+        writer.writerow(fields + ["verdict"])
+        writer.writerows([getattr(s, f) for f in fields] + [_verdict(s)] for s in suggestions)
+        return suggestions
+
+    if not suggestions:
+        print(f"📭 找不到ID为 {stock_id} 的股票（或已删除）" if stock_id is not None else "📭 暂无持仓股票")
+        return suggestions
+    print(f"🎯 止损建议（{STATS_WINDOW}日ATR，建议止损 = 现价 - {atr_multiple:g}×ATR，按{target_risk:g}%原则算仓位）")
+    print("=" * 118)
+    print(f"{'ID':<6} {'名称':<12} {'现价':<9} {'止损价':<9} {'距离(ATR)':<10} {'ATR%':<7} {'年化波动':<9} "
+          f"{'最大不利':<9} {'判断':<12} {'建议止损':<9} {'建议仓位':<9} {'当前仓位':<8}")
+    print("-" * 118)
+    for s in suggestions:
+        atr_pct = s.atr / s.current_price * 100 if s.atr is not None and s.current_price else None
+        print(f"{s.stock_id:<6} {s.name:<12} {s.current_price:<9.2f} {_fmt(s.stop_loss):<9} {_fmt(s.stop_atr, '.1f'):<10} "
+              f"{_fmt(atr_pct, '.1f'):<7} {_fmt(s.volatility, '.1f', '%'):<9} {_fmt(s.mae, '.1f', '%'):<9} "
+              f"{_verdict(s):<12} {_fmt(s.suggested_stop):<9} {_fmt(s.suggested_position, '.1f', '%'):<9} "
+              f"{s.position:.1f}%")
+    print("=" * 118)
+    print(f"💡 距离 = (现价 - 止损价) / ATR：不到{TIGHT_ATR_MULTIPLE:g}个ATR容易被日常波动打掉，超过{WIDE_ATR_MULTIPLE:g}个ATR偏宽；"
+          f"最大不利 = 有价格记录以来的最低价低于成本价的幅度")
+    print("   只给建议，不修改止损价")
+    if any(s.atr == 0 for s in suggestions):
+        print(f"   💤 无波动：最近{STATS_WINDOW}个交易日价格没有变化（停牌等），ATR为0，不给按ATR的建议止损和仓位")
+    if any(s.atr is None for s in suggestions):
+        print(f"   少于{MIN_STATS_DAYS}个交易日的价格不给建议；刚补录过更早的价格时先运行 /risk 止损建议 重建")
+    return suggestions